@@ -0,0 +1,312 @@
+"""
+Benchmarks of rob's hot paths, with results as JSON
+
+Run from the repo root, e.g. `python -m benchmarks.run --output results.json`.
+Compare results of two releases to find regressions.
+"""
+
+from __future__ import annotations
+
+import json
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+import click
+
+import rob.console as con
+from benchmarks.trees import SHAPES, TreeShape, make_robocopy_output, make_tree
+from rob import VERSION
+from rob.actions import AddFolderActions, RemoveFolderActions
+from rob.archive import ARCHIVE_SUFFIX, compress_tree, extract_archive
+from rob.cli import save_results
+from rob.engines import NativeEngine
+from rob.filesystem import delete_tree, get_dir_size
+from rob.folders import Folder, Library
+from rob.robocopy import parse_robocopy_output
+
+QUICK_SHAPE = TreeShape(
+    small_files=500,
+    small_file_bytes=4096,
+    packs=2,
+    pack_bytes=8 * 1024**2,
+    depth=3,
+    fanout=3,
+)
+"Used with --quick, to check that the benchmarks work"
+
+
+@dataclass
+class Result:
+    name: str
+    params: dict
+    seconds: list[float] = field(default_factory=list)
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "params": self.params,
+            "runs": len(self.seconds),
+            "min": min(self.seconds),
+            "median": statistics.median(self.seconds),
+            "mean": statistics.mean(self.seconds),
+            "max": max(self.seconds),
+        }
+
+
+def measure(
+    name: str,
+    params: dict,
+    function: Callable[[], object],
+    repeat: int,
+    setup: Optional[Callable[[], object]] = None,
+) -> Result:
+    """Time `function` `repeat` times. `setup` runs before each run and isn't timed."""
+    result = Result(name, params)
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        result.seconds.append(time.perf_counter() - start)
+    print(f"{name} {params}: {min(result.seconds):.4f}s", flush=True)
+    return result
+
+
+def bench_dir_size(
+    scratch: Path, repeat: int, shapes: dict[str, TreeShape]
+) -> list[Result]:
+    results = []
+    for shape_name, shape in shapes.items():
+        root = scratch.joinpath(f"size_{shape_name}")
+        # Sizes are read from metadata, so packs don't need data
+        make_tree(root, shape, sparse_packs=True)
+        results.append(
+            measure(
+                "get_dir_size",
+                {"shape": shape_name, "files": shape.small_files + shape.packs},
+                lambda root=root: get_dir_size(root),
+                repeat,
+            )
+        )
+        shutil.rmtree(root)
+    return results
+
+
+def bench_delete(
+    scratch: Path, repeat: int, shapes: dict[str, TreeShape]
+) -> list[Result]:
+    results = []
+    for shape_name, shape in shapes.items():
+        root = scratch.joinpath(f"delete_{shape_name}")
+        params = {"shape": shape_name, "files": shape.small_files + shape.packs}
+        for name, delete in (("rmtree", shutil.rmtree), ("delete_tree", delete_tree)):
+            results.append(
+                measure(
+                    name,
+                    params,
+                    lambda root=root, delete=delete: delete(root),
+                    repeat,
+                    setup=lambda root=root, shape=shape: make_tree(
+                        root, shape, sparse_packs=True
+                    ),
+                )
+            )
+    return results
+
+
+def bench_archive(
+    scratch: Path, repeat: int, shape_name: str, shape: TreeShape
+) -> list[Result]:
+    source_dir = scratch.joinpath("archive_source")
+    stats = make_tree(source_dir, shape)
+    archive_path = scratch.joinpath(f"archive{ARCHIVE_SUFFIX}")
+    target_dir = scratch.joinpath("archive_target")
+    params = {"shape": shape_name, "files": stats.files, "bytes": stats.apparent_bytes}
+    results = [
+        measure(
+            "compress_tree",
+            params,
+            lambda: compress_tree(source_dir, archive_path, lambda advance: None),
+            repeat,
+            setup=lambda: archive_path.unlink(missing_ok=True),
+        ),
+        measure(
+            "extract_archive",
+            params,
+            lambda: extract_archive(archive_path, target_dir, lambda advance: None),
+            repeat,
+            setup=lambda: shutil.rmtree(target_dir, ignore_errors=True),
+        ),
+    ]
+    shutil.rmtree(source_dir)
+    shutil.rmtree(target_dir)
+    archive_path.unlink()
+    return results
+
+
+def bench_robocopy_parser(repeat: int, files: int) -> list[Result]:
+    output = make_robocopy_output(files)
+    return [
+        measure(
+            "parse_robocopy_output",
+            {"files": files, "bytes": len(output)},
+            lambda: parse_robocopy_output(output),
+            repeat,
+        )
+    ]
+
+
+def bench_library(scratch: Path, repeat: int, folders: int) -> list[Result]:
+    library_folder = scratch.joinpath("library")
+    library_folder.mkdir()
+    paths = [Path(f"C:\\Games\\Game {index}") for index in range(folders)]
+
+    def save() -> None:
+        library = Library(library_folder)
+        for path in paths:
+            library.add_folder(Folder(path))
+        library.save()
+
+    def reset() -> None:
+        for path in library_folder.iterdir():
+            path.unlink()
+
+    def find() -> None:
+        library = Library(library_folder)
+        for path in paths[::10]:
+            assert library.find_folder(str(path))
+            assert library.find_folder(Folder(path).short_name)
+
+    params = {"folders": folders}
+    results = [
+        measure("library_save", params, save, repeat, setup=reset),
+        measure(
+            "library_load", params, lambda: Library(library_folder).folders, repeat
+        ),
+        measure(
+            "library_find_folder",
+            params | {"lookups": len(paths[::10]) * 2},
+            find,
+            repeat,
+        ),
+    ]
+    shutil.rmtree(library_folder)
+    return results
+
+
+def bench_add_remove(
+    scratch: Path, library_scratch: Path, repeat: int, shape_name: str, shape: TreeShape
+) -> list[Result]:
+    """
+    Add and remove a folder, copying its data with the native engine, which stands
+    in for robocopy on other platforms. Data is copied even if `scratch` and
+    `library_scratch` are on the same filesystem.
+    """
+    source_dir = scratch.joinpath("source", "Game")
+    stats = make_tree(source_dir, shape)
+    library_folder = library_scratch.joinpath("cycle_library")
+    library_folder.mkdir()
+    folder = Folder(source_dir)
+    params = {"shape": shape_name, "files": stats.files, "bytes": stats.apparent_bytes}
+
+    def move(actions_class: type) -> None:
+        library = Library(library_folder)
+        actions = actions_class(
+            folder,
+            library,
+            dry_run=False,
+            dont_copy_permissions=True,
+            copy_engine=NativeEngine(),
+            rename_only=False,
+        )
+        actions.run(confirm=False)
+        save_results(library_folder, [actions], [actions], dry_run=False)
+
+    add = Result("add", params)
+    remove = Result("remove", params)
+    for _ in range(repeat):
+        for result, actions_class in (
+            (add, AddFolderActions),
+            (remove, RemoveFolderActions),
+        ):
+            start = time.perf_counter()
+            move(actions_class)
+            result.seconds.append(time.perf_counter() - start)
+    for result in (add, remove):
+        print(f"{result.name} {params}: {min(result.seconds):.4f}s", flush=True)
+    shutil.rmtree(source_dir.parent)
+    shutil.rmtree(library_folder)
+    return [add, remove]
+
+
+@click.command()
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write results to this JSON file. Printed if not set.",
+)
+@click.option("--repeat", default=3, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--scratch",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Folder for test data. A temporary folder by default.",
+)
+@click.option(
+    "--library-scratch",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Folder for the library of the add and remove benchmark, e.g. on another drive. Same as --scratch by default.",
+)
+@click.option(
+    "--quick",
+    is_flag=True,
+    help="Use small test data, to check that the benchmarks work.",
+)
+def main(
+    output: Optional[Path],
+    repeat: int,
+    scratch: Optional[Path],
+    library_scratch: Optional[Path],
+    quick: bool,
+):
+    """Run benchmarks of rob's hot paths"""
+    shapes = {"quick": QUICK_SHAPE} if quick else SHAPES
+    # Benchmark output only
+    con.quiet()
+    with tempfile.TemporaryDirectory(prefix="rob_bench_", dir=scratch) as temp_dir:
+        scratch = Path(temp_dir)
+        with tempfile.TemporaryDirectory(
+            prefix="rob_bench_", dir=library_scratch or scratch
+        ) as library_temp_dir:
+            results = bench_dir_size(scratch, repeat, shapes)
+            results += bench_delete(scratch, repeat, shapes)
+            results += bench_robocopy_parser(repeat, files=1_000 if quick else 200_000)
+            results += bench_library(scratch, repeat, folders=100 if quick else 5_000)
+            for shape_name, shape in shapes.items():
+                results += bench_archive(scratch, repeat, shape_name, shape)
+                results += bench_add_remove(
+                    scratch, Path(library_temp_dir), repeat, shape_name, shape
+                )
+
+    report = {
+        "rob_version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "repeat": repeat,
+        "results": [result.to_json() for result in results],
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text, encoding="utf8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
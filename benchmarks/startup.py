@@ -0,0 +1,109 @@
+"""
+Check that rob starts quickly, with results as JSON
+
+Run from the repo root, e.g. `python -m benchmarks.startup`. Exits with an error if
+startup is over budget, or if a module that should be imported by commands that
+need it is imported at startup.
+"""
+
+from __future__ import annotations
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+IMPORT_BUDGET_MS = 150
+"Cumulative import time of `rob.cli`, as reported by `python -X importtime`"
+HELP_BUDGET_MS = 400
+"Wall time of `rob --help`, including the interpreter"
+LAZY_MODULES = [
+    "rich",
+    "sqlite3",
+    "rob.actions",
+    "rob.bench",
+    "rob.folders",
+    "rob.journal",
+    "rob.rebalance",
+    "rob.store",
+]
+"Modules that must not be imported by `import rob.cli`"
+
+
+def get_import_times(module: str) -> dict[str, int]:
+    """Cumulative import time of each module imported by `module`, in microseconds"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        # e.g. "import time:       504 |      27418 |   click"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def time_command(args: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "rob"] + args,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--repeat", default=5, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--import-budget", default=IMPORT_BUDGET_MS, show_default=True, help="Milliseconds."
+)
+@click.option(
+    "--help-budget", default=HELP_BUDGET_MS, show_default=True, help="Milliseconds."
+)
+def main(repeat: int, import_budget: int, help_budget: int):
+    """Check rob's startup time and the modules that it imports"""
+    import_runs = [get_import_times("rob.cli") for _ in range(repeat)]
+    import_ms = min(times["rob.cli"] for times in import_runs) / 1000
+    help_runs = [time_command(["--help"]) * 1000 for _ in range(repeat)]
+    help_ms = min(help_runs)
+    eager_modules = sorted(
+        name
+        for name in import_runs[0]
+        if any(name == lazy or name.startswith(f"{lazy}.") for lazy in LAZY_MODULES)
+    )
+
+    errors = []
+    if import_ms > import_budget:
+        errors.append(
+            f"import rob.cli took {import_ms:.0f}ms, budget is {import_budget}ms"
+        )
+    if help_ms > help_budget:
+        errors.append(f"rob --help took {help_ms:.0f}ms, budget is {help_budget}ms")
+    if eager_modules:
+        errors.append(f"Imported at startup: {', '.join(eager_modules)}")
+    report = {
+        "python": sys.version.split()[0],
+        "import_ms": round(import_ms, 1),
+        "import_budget_ms": import_budget,
+        "help_ms": round(help_ms, 1),
+        "help_median_ms": round(statistics.median(help_runs), 1),
+        "help_budget_ms": help_budget,
+        "eager_modules": eager_modules,
+        "errors": errors,
+    }
+    print(json.dumps(report, indent=2))
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,125 @@
+"""Synthetic folder trees and robocopy output, shaped like game installs"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+from rob.filesystem import DirStats
+
+
+@dataclass
+class TreeShape:
+    small_files: int
+    "Config files, scripts, textures etc. Spread over nested folders."
+    small_file_bytes: int
+    packs: int
+    "Large archives, e.g. .pak files"
+    pack_bytes: int
+    depth: int
+    "Nesting of folders that hold small files"
+    fanout: int
+    "Subfolders of each folder"
+
+
+SHAPES = {
+    "small": TreeShape(
+        small_files=20_000,
+        small_file_bytes=4096,
+        packs=0,
+        pack_bytes=0,
+        depth=6,
+        fanout=3,
+    ),
+    "game": TreeShape(
+        small_files=5_000,
+        small_file_bytes=16 * 1024,
+        packs=4,
+        pack_bytes=256 * 1024**2,
+        depth=5,
+        fanout=3,
+    ),
+}
+
+
+def make_tree(root: Path, shape: TreeShape, sparse_packs: bool = False) -> DirStats:
+    """
+    Create a tree of `shape` in `root`. Return what was created.
+
+    Packs are written with data, unless `sparse_packs`, which is faster but only
+    suits benchmarks that don't read file contents.
+    """
+    dirs = _make_dirs(root, shape.depth, shape.fanout)
+    data = os.urandom(shape.small_file_bytes)
+    for index in range(shape.small_files):
+        dirs[index % len(dirs)].joinpath(f"file{index}.dat").write_bytes(data)
+    chunk = os.urandom(8 * 1024**2)
+    for index in range(shape.packs):
+        with open(root.joinpath(f"data{index}.pak"), "wb") as file:
+            if sparse_packs:
+                file.truncate(shape.pack_bytes)
+                continue
+            written = 0
+            while written < shape.pack_bytes:
+                written += file.write(chunk[: shape.pack_bytes - written])
+    return DirStats(
+        apparent_bytes=shape.small_files * shape.small_file_bytes
+        + shape.packs * shape.pack_bytes,
+        files=shape.small_files + shape.packs,
+        dirs=len(dirs) - 1,
+    )
+
+
+def _make_dirs(root: Path, depth: int, fanout: int) -> list[Path]:
+    dirs = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [
+            parent.joinpath(f"dir{index}")
+            for parent in level
+            for index in range(fanout)
+        ]
+        dirs += level
+    for path in dirs:
+        path.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+def make_robocopy_output(files: int, file_bytes: int = 1024**2) -> str:
+    """Output of robocopy with /NDL /NP /BYTES, as parsed by `RobocopyParser`"""
+    divider = "-" * 79
+    lines = [
+        divider,
+        "   ROBOCOPY     ::     Robust File Copy for Windows",
+        divider,
+        "",
+        "  Started : Monday, 31 January 2022 12:00:00",
+        "   Source : C:\\Games\\Game\\",
+        "     Dest : D:\\rob\\Game(0123456789ab)\\",
+        "",
+        "    Files : *.*",
+        "",
+        "  Options : *.* /BYTES /NDL /S /E /DCOPY:DA /COPY:DAT /NP /MT:8 /R:0 /W:30",
+        "",
+        divider,
+        "",
+    ]
+    lines += [
+        f"\t    New File  \t\t{file_bytes:>11}\tC:\\Games\\Game\\data\\file{index}.dat"
+        for index in range(files)
+    ]
+    total_bytes = files * file_bytes
+    lines += [
+        "",
+        divider,
+        "",
+        "               Total    Copied   Skipped  Mismatch    FAILED    Extras",
+        "    Dirs :         1         1         0         0         0         0",
+        f"   Files :  {files:>8}  {files:>8}         0         0         0         0",
+        f"   Bytes :  {total_bytes:>8}  {total_bytes:>8}         0         0         0         0",
+        "   Times :   0:00:10   0:00:10                       0:00:00   0:00:00",
+        "   Speed :           104857600 Bytes/sec.",
+        "   Ended : Monday, 31 January 2022 12:00:10",
+    ]
+    return "\r\n".join(lines)
@@ -1,22 +1,53 @@
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from dataclasses import dataclass, field
-from pathlib import WindowsPath
+from pathlib import Path
+from typing import Callable, ClassVar, Optional
 
 import rob.console as con
+import rob.timings
+from rob.archive import ArchiveStats, compress, extract, read_manifest, verify_archive
+from rob.bench import tune_copy_engine
+from rob.dedupe import break_links
+from rob.engines import CopyEngine
 from rob.filesystem import (
+    DirStats,
     DiskUsage,
     create_symlink,
+    delete_file,
     delete_folder,
+    delete_paths,
     delete_symlink,
-    get_dir_size,
+    get_physical_disk,
+    get_volume,
+    is_hard_link,
+    is_same_filesystem,
+    raise_if_exists,
     rename_folder,
     test_dir_creation,
     test_disk_space,
+    test_rename,
     test_set_ntfs_permisisons,
     test_symlink_creation,
 )
 from rob.folders import Folder, Library
-from rob.robocopy import run_robocopy
+from rob.journal import Journal
+from rob.manifest import (
+    Manifest,
+    ManifestChanges,
+    build_manifest,
+    get_changes,
+    verify_copy,
+)
+from rob.preflight import (
+    Probe,
+    get_folder_key,
+    get_probe_dir,
+    get_volume_key,
+    run_probes,
+)
+from rob.scheduler import Job, run_jobs
+from rob.trash import move_to_trash
 
 
 @dataclass
@@ -27,30 +58,231 @@ class FilestoreActions(ABC):
     Invoke with `run()`
     """
 
+    operation: ClassVar[str]
     folder: Folder
     library: Library
     dry_run: bool
     dont_copy_permissions: bool
+    copy_engine: CopyEngine
+    verify: str = "quick"
+    "See `verify_copy()`"
+    journal: Optional[Journal] = None
+    "Progress of an interrupted command. If set, steps that are done are skipped."
+    rename_only: Optional[bool] = None
+    """
+    Move data by renaming folders, as source and library are on the same filesystem.
+    If `None`, this is found by comparing device IDs.
+    """
+    recheck: bool = False
+    "Run pre-flight checks that passed recently, instead of trusting the cache"
+    defer_delete: bool = False
+    "Move data that is no longer needed to trash, instead of waiting for it to be deleted"
 
-    from_dir: WindowsPath = field(init=False)
-    to_dir: WindowsPath = field(init=False)
-    dir_size_bytes: int = field(init=False)
+    from_dir: Path = field(init=False)
+    to_dir: Path = field(init=False)
+    manifest: Manifest = field(init=False)
+    "Made before data is moved, to verify the copy"
+
+    def __post_init__(self):
+        """Call at the end of `__post_init__` of subclasses, once `from_dir` and `to_dir` are set"""
+        self.copy_engine = tune_copy_engine(
+            self.copy_engine, self.library, self.from_dir, self.to_dir
+        )
+
+    @property
+    def dir_stats(self) -> DirStats:
+        return self.manifest.stats
+
+    @property
+    def dir_size_bytes(self) -> int:
+        return self.dir_stats.apparent_bytes
+
+    @property
+    def copy_bytes(self) -> int:
+        """Space needed on the target disk"""
+        return 0 if self.rename_only else self.dir_size_bytes
+
+    @property
+    def copy_files(self) -> int:
+        return 0 if self.rename_only else self.dir_stats.files
+
+    def get_step_size(self, name: str) -> tuple[int, int]:
+        """Bytes and files handled by step `name`, for timings"""
+        if name in ("copy", "compress", "extract"):
+            return self.copy_bytes, self.copy_files
+        if name in ("verify", "delete"):
+            return self.dir_size_bytes, self.dir_stats.files
+        return 0, 0
+
+    def scan(self, path: Path) -> Manifest:
+        with rob.timings.phase("scan", self.folder.short_name) as span:
+            manifest = build_manifest(path)
+            span.bytes_, span.files = (
+                manifest.stats.apparent_bytes,
+                manifest.stats.files,
+            )
+        return manifest
+
+    def get_new_dirs(self) -> list[Path]:
+        """Folders that are created by the actions, so must not exist yet"""
+        return [self.folder.get_temp_dir()]
+
+    def get_probe_dirs(self, name: str) -> tuple[Path, Path]:
+        """
+        Test folders for probe `name`, that are siblings of `from_dir` and `to_dir`
+        so should have the same permissions
+        """
+        return (
+            get_probe_dir(self.from_dir.parent, self.folder, f"{name}_from"),
+            get_probe_dir(self.to_dir.parent, self.folder, f"{name}_to"),
+        )
+
+    def get_probe(
+        self, name: str, test: Callable[[Path, Path], Optional[bool]]
+    ) -> Probe:
+        """Probe that runs `test` with both test folders of `name`"""
+        return Probe(
+            name,
+            lambda: test(*self.get_probe_dirs(name)),
+            get_volume_key(self.from_dir.parent),
+            get_volume_key(self.to_dir.parent),
+        )
+
+    def get_probes(self) -> list[Probe]:
+        """Checks that can run at the same time"""
+        source_dir, target_dir = self.get_probe_dirs("write")
+        return [
+            Probe(
+                "write",
+                lambda: test_dir_creation(source_dir),
+                get_folder_key(self.from_dir.parent),
+            ),
+            Probe(
+                "write",
+                lambda: test_dir_creation(target_dir),
+                get_folder_key(self.to_dir.parent),
+            ),
+        ]
+
+    @property
+    def tests_permissions(self) -> bool:
+        return (
+            self.copy_engine.copies_ntfs_permissions and not self.dont_copy_permissions
+        )
 
-    @abstractmethod
     def preflight_checks(self) -> None:
         con.print_("\n[bold]Pre-flight checks[/bold]")
+        for path in self.get_new_dirs():
+            raise_if_exists(path)
+        rename_probe = self.get_probe("rename", test_rename)
+        permissions_probe = self.get_probe("permissions", test_set_ntfs_permisisons)
+        probes = self.get_probes()
+        if self.rename_only:
+            probes.append(rename_probe)
+        elif self.tests_permissions:
+            probes.append(permissions_probe)
+        results = run_probes(self.library, probes, self.recheck, self.dry_run)
+        if self.rename_only:
+            self.rename_only = bool(results[-1])
+            if not self.rename_only and self.tests_permissions:
+                run_probes(
+                    self.library, [permissions_probe], self.recheck, self.dry_run
+                )
+        test_disk_space(self.copy_bytes, DiskUsage(get_volume(self.to_dir)))
+
+    @property
+    def resume(self) -> bool:
+        return self.journal is not None
 
     @abstractmethod
+    def get_steps(self) -> list[tuple[str, Callable[[], None]]]:
+        """Names and functions of each step. A step must be safe to run again."""
+
+    def get_options(self) -> dict:
+        """Arguments that are needed to resume the command"""
+        return {
+            "dont_copy_permissions": self.dont_copy_permissions,
+            "verify": self.verify,
+            "rename_only": self.rename_only,
+            "defer_delete": self.defer_delete,
+        }
+
     def actions(self) -> None:
+        """
+        Run each step, saving progress to a journal in the library
+
+        If the command is interrupted, `rob resume` continues from the last step done.
+        """
         con.print_("\n[bold]Actions[/bold]")
+        if self.journal is None and not self.dry_run:
+            self.journal = Journal(
+                library=self.library,
+                operation=self.operation,
+                folder=self.folder,
+                manifest=self.manifest,
+                options=self.get_options(),
+            )
+            self.journal.save()
+        for name, step in self.get_steps():
+            if self.journal and name in self.journal.steps_done:
+                continue
+            bytes_, files = self.get_step_size(name)
+            with rob.timings.phase(name, self.folder.short_name, bytes_, files):
+                step()
+            if self.journal:
+                self.journal.mark_done(name)
+
+    def complete(self) -> None:
+        """Call when the library has been saved, to forget progress"""
+        if self.journal:
+            self.journal.delete()
+
+    def copy(self, source: Path, target: Path, incremental: bool = False) -> None:
+        self.copy_engine.copy(
+            source,
+            target,
+            self.dir_size_bytes,
+            dry_run=self.dry_run,
+            copy_permissions=not self.dont_copy_permissions,
+            incremental=incremental or self.resume,
+        )
+
+    def rename(self, source: Path, target: Path) -> None:
+        if self.resume and not source.exists() and target.exists():
+            return
+        rename_folder(source, target, dry_run=self.dry_run)
+
+    def delete(self, path: Path) -> None:
+        if self.resume and not path.exists():
+            return
+        if self.defer_delete:
+            move_to_trash(path, dry_run=self.dry_run)
+        elif path.is_file():
+            delete_file(path, dry_run=self.dry_run)
+        else:
+            delete_folder(path, dry_run=self.dry_run)
+
+    @property
+    def disks(self) -> set[str]:
+        return {get_physical_disk(self.from_dir), get_physical_disk(self.to_dir)}
+
+    def print_size(self) -> None:
+        con.print_(
+            f"Folder size: {con.style_bytes_as_gb(self.dir_size_bytes)} "
+            f"({self.dir_stats.files:,} files in {self.dir_stats.dirs:,} folders)"
+        )
 
     def confirm(self) -> None:
-        con.print_(f"Folder size: {con.style_bytes_as_gb(self.dir_size_bytes)}")
+        self.print_size()
         con.confirm_action(self.dry_run)
 
-    def run(self) -> None:
-        self.confirm()
-        self.preflight_checks()
+    def run(self, confirm: bool = True) -> None:
+        if confirm:
+            self.confirm()
+        # Pre-flight checks expect that no data has been moved yet
+        if not self.resume:
+            with rob.timings.phase("preflight", self.folder.short_name):
+                self.preflight_checks()
         self.actions()
 
 
@@ -60,36 +292,128 @@ class AddFolderActions(FilestoreActions):
     Filesystem actions for `add` command
 
     Move data from `folder.source_dir` to `folder.get_library_subdir()`
+
+    If the folder is warm, only files that have changed since it was removed are
+    copied, and files that have been deleted are deleted from the library.
     """
 
+    operation = "add"
+    changes: Optional[ManifestChanges] = field(init=False, default=None)
+    "Set if the folder is warm"
+
     def __post_init__(self):
         self.from_dir = self.folder.source_dir
         self.to_dir = self.folder.get_library_subdir(self.library)
-        self.dir_size_bytes = get_dir_size(self.from_dir)
+        if self.journal:
+            self.manifest = self.journal.manifest
+        else:
+            self.manifest = self.scan(self.from_dir)
+        if self.folder.is_warm and self.to_dir.exists():
+            self.changes = get_changes(self.manifest, self.scan(self.to_dir))
+            self.rename_only = False
+        elif self.rename_only is None:
+            self.rename_only = is_same_filesystem(
+                self.folder.source_dir.parent, self.library.library_folder
+            )
+        super().__post_init__()
 
-    def preflight_checks(self) -> None:
-        super().preflight_checks()
-        test_dir_creation(self.to_dir)
-        test_dir_creation(self.folder.get_temp_dir())
-        # Test symlink with sibling of source dir - it should have similar permissions
-        test_symlink_creation(self.folder.get_temp_dir(), self.to_dir)
-        test_disk_space(self.dir_size_bytes, DiskUsage(self.to_dir.drive))
-        if not self.dont_copy_permissions:
-            # Use empty source directory to test permissions
-            test_set_ntfs_permisisons(self.folder.get_temp_dir(), self.to_dir)
+    @property
+    def copy_bytes(self) -> int:
+        if self.changes is None:
+            return super().copy_bytes
+        return self.changes.copy_bytes
 
-    def actions(self) -> None:
-        super().actions()
-        rename_folder(self.from_dir, self.folder.get_temp_dir(), dry_run=self.dry_run)
-        run_robocopy(
-            self.folder.get_temp_dir(),
+    @property
+    def copy_files(self) -> int:
+        if self.changes is None:
+            return super().copy_files
+        return len(self.changes.changed_files)
+
+    def print_size(self) -> None:
+        super().print_size()
+        if self.changes is not None:
+            con.print_(
+                f"Library has a warm copy. Changed since it was removed: "
+                f"{con.style_bytes_as_gb(self.changes.copy_bytes)} "
+                f"({len(self.changes.changed_files):,} files to copy, "
+                f"{len(self.changes.deleted_files):,} to delete)"
+            )
+
+    def get_new_dirs(self) -> list[Path]:
+        # A warm copy is updated in place
+        return super().get_new_dirs() + (
+            [] if self.changes is not None else [self.to_dir]
+        )
+
+    def get_probes(self) -> list[Probe]:
+        return super().get_probes() + [self.get_probe("symlink", test_symlink_creation)]
+
+    def get_steps(self) -> list[tuple[str, Callable[[], None]]]:
+        temp_dir = self.folder.get_temp_dir()
+        steps = [("rename", lambda: self.rename(self.from_dir, temp_dir))]
+        if self.rename_only:
+            return steps + [
+                ("move", lambda: self.rename(temp_dir, self.to_dir)),
+                ("symlink", self.create_symlink),
+            ]
+        if self.changes:
+            steps.append(("delete_removed", self.delete_removed))
+        return steps + [
+            (
+                "copy",
+                lambda: self.copy(
+                    temp_dir, self.to_dir, incremental=self.changes is not None
+                ),
+            ),
+            (
+                "verify",
+                lambda: verify_copy(
+                    self.manifest,
+                    temp_dir,
+                    self.to_dir,
+                    mode=self.verify,
+                    dry_run=self.dry_run,
+                ),
+            ),
+            ("symlink", self.create_symlink),
+            ("delete", lambda: self.delete(temp_dir)),
+        ]
+
+    def delete_removed(self) -> None:
+        """Delete files from warm copy that have been deleted or replaced in source"""
+        assert self.changes is not None
+        # Files are updated in place, which would change other hard links to them.
+        # See `rob.dedupe`.
+        linked_files = [
+            rel_path
+            for rel_path in self.changes.changed_files
+            if is_hard_link(self.to_dir.joinpath(rel_path))
+        ]
+        delete_paths(
             self.to_dir,
-            self.dir_size_bytes,
+            self.changes.deleted_files + linked_files,
+            self.changes.deleted_dirs,
             dry_run=self.dry_run,
-            copy_permissions=not self.dont_copy_permissions,
         )
+
+    def create_symlink(self) -> None:
+        if self.resume and self.from_dir.is_symlink():
+            return
         create_symlink(self.from_dir, self.to_dir, dry_run=self.dry_run)
-        delete_folder(self.folder.get_temp_dir(), dry_run=self.dry_run)
+
+    def update_library(self, library: Library) -> None:
+        library.add_folder(self.folder)
+
+    def print_result(self) -> None:
+        con.print_success(
+            f"\n[bold]Add folder {con.style_path(self.folder.source_dir)} to {con.style_library(self.library)}[/bold]"
+        )
+        con.print_(
+            f"Data is now in subfolder with name {con.style_path(self.folder.short_name)}"
+        )
+        con.print_(
+            f"{con.style_path(self.folder.source_dir)} [bold]is[/bold] a symlink"
+        )
 
 
 @dataclass
@@ -98,35 +422,249 @@ class RemoveFolderActions(FilestoreActions):
     Filesystem actions for `remove` command
 
     Move data from `folder.get_library_subdir()` to `folder.source_dir`
+
+    If `keep_warm`, data is left in the library so that it can be added again quickly.
     """
 
+    operation = "remove"
+    keep_warm: bool = False
+    may_have_links: bool = field(init=False, default=False)
+    "Files may be hard links to files in other folders. A copy has its own data."
+
     def __post_init__(self):
-        self.from_dir = self.folder.get_library_subdir(self.library)
+        self.from_dir = self.folder.get_library_data_path(self.library)
         self.to_dir = self.folder.source_dir
-        self.dir_size_bytes = get_dir_size(self.from_dir)
-
-    def preflight_checks(self) -> None:
-        super().preflight_checks()
-        # Sibling of source dir
-        test_dir_creation(self.folder.get_temp_dir())
-        # Subdir of library
-        test_dir_creation(self.library.get_test_dir())
-        test_disk_space(self.dir_size_bytes, DiskUsage(self.to_dir.drive))
-        if not self.dont_copy_permissions:
-            # Use empty source directory to test permissions
-            test_set_ntfs_permisisons(
-                self.library.get_test_dir(), self.folder.get_temp_dir()
+        if self.journal:
+            self.manifest = self.journal.manifest
+        elif self.folder.is_compressed:
+            self.manifest = read_manifest(self.from_dir)
+        else:
+            self.manifest = self.scan(self.from_dir)
+        if self.folder.is_compressed:
+            # Data is restored from the archive
+            self.rename_only = False
+        elif self.rename_only is None:
+            # A warm copy has to be a copy
+            self.rename_only = not self.keep_warm and is_same_filesystem(
+                self.library.library_folder, self.folder.source_dir.parent
             )
+        self.may_have_links = self.rename_only and self.library.has_content_index()
+        super().__post_init__()
 
-    def actions(self) -> None:
-        super().actions()
-        run_robocopy(
-            self.from_dir,
-            self.folder.get_temp_dir(),
-            self.dir_size_bytes,
-            dry_run=self.dry_run,
-            copy_permissions=not self.dont_copy_permissions,
+    def get_new_dirs(self) -> list[Path]:
+        # A compressed folder doesn't have a symlink in its place
+        return super().get_new_dirs() + (
+            [self.to_dir] if self.folder.is_compressed else []
         )
+
+    def get_steps(self) -> list[tuple[str, Callable[[], None]]]:
+        temp_dir = self.folder.get_temp_dir()
+        if self.folder.is_compressed:
+            return [
+                ("extract", lambda: self.extract(temp_dir)),
+                (
+                    "verify",
+                    # Checksums of data were tested when it was extracted
+                    lambda: verify_copy(
+                        self.manifest, self.from_dir, temp_dir, dry_run=self.dry_run
+                    ),
+                ),
+                ("rename", lambda: self.rename(temp_dir, self.to_dir)),
+                ("delete", lambda: self.delete(self.from_dir)),
+            ]
+        if self.rename_only:
+            return (
+                [("separate", self.separate_files)] if self.may_have_links else []
+            ) + [
+                ("move", lambda: self.rename(self.from_dir, temp_dir)),
+                ("delete_symlink", self.delete_symlink),
+                ("rename", lambda: self.rename(temp_dir, self.to_dir)),
+            ]
+        steps = [
+            ("copy", lambda: self.copy(self.from_dir, temp_dir)),
+            (
+                "verify",
+                lambda: verify_copy(
+                    self.manifest,
+                    self.from_dir,
+                    temp_dir,
+                    mode=self.verify,
+                    dry_run=self.dry_run,
+                ),
+            ),
+            ("delete_symlink", self.delete_symlink),
+            ("rename", lambda: self.rename(temp_dir, self.to_dir)),
+        ]
+        if not self.keep_warm:
+            steps.append(("delete", lambda: self.delete(self.from_dir)))
+        return steps
+
+    def get_options(self) -> dict:
+        return super().get_options() | {"keep_warm": self.keep_warm}
+
+    def delete_symlink(self) -> None:
+        if self.resume and not self.to_dir.is_symlink():
+            return
         delete_symlink(self.to_dir, dry_run=self.dry_run)
-        rename_folder(self.folder.get_temp_dir(), self.to_dir, dry_run=self.dry_run)
-        delete_folder(self.from_dir, dry_run=self.dry_run)
+
+    def separate_files(self) -> None:
+        if self.resume and not self.from_dir.exists():
+            return
+        break_links(self.from_dir, dry_run=self.dry_run)
+
+    def extract(self, temp_dir: Path) -> None:
+        if self.resume and temp_dir.exists():
+            # Extraction can't continue where it stopped
+            delete_folder(temp_dir)
+        extract(self.from_dir, temp_dir, self.dir_size_bytes, dry_run=self.dry_run)
+
+    def update_library(self, library: Library) -> None:
+        if self.keep_warm:
+            library.keep_warm(self.folder)
+        else:
+            library.remove_folder(self.folder)
+
+    def print_result(self) -> None:
+        folder = self.folder
+        con.print_success(
+            f"\n[bold]Remove folder {con.style_path(folder.source_dir)} with name {con.style_path(folder.short_name)} from {con.style_library(self.library)}[/bold]"
+        )
+        con.print_(f"Data is now at {con.style_path(folder.source_dir)}")
+        con.print_(f"{con.style_path(folder.source_dir)} is [bold]not[/bold] a symlink")
+        if self.keep_warm:
+            con.print_(
+                f"A copy of the data is kept in subfolder {con.style_path(folder.short_name)}"
+            )
+
+
+@dataclass
+class CompressFolderActions(FilestoreActions):
+    """
+    Filesystem actions for `compress` command
+
+    Move data from `folder.get_library_subdir()` to an archive in the library, and
+    delete the symlink at `folder.source_dir`. NTFS permissions are not kept.
+    """
+
+    operation = "compress"
+    stats: Optional[ArchiveStats] = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.from_dir = self.folder.get_library_subdir(self.library)
+        self.to_dir = self.folder.get_archive_path(self.library)
+        if self.journal:
+            self.manifest = self.journal.manifest
+        else:
+            self.manifest = self.scan(self.from_dir)
+        self.rename_only = False
+        super().__post_init__()
+
+    def get_new_dirs(self) -> list[Path]:
+        return [self.to_dir]
+
+    def get_steps(self) -> list[tuple[str, Callable[[], None]]]:
+        return [
+            ("compress", self.compress),
+            (
+                "verify",
+                lambda: verify_archive(
+                    self.manifest, self.to_dir, mode=self.verify, dry_run=self.dry_run
+                ),
+            ),
+            ("delete_symlink", self.delete_symlink),
+            ("delete", lambda: self.delete(self.from_dir)),
+        ]
+
+    def compress(self) -> None:
+        if self.resume and self.to_dir.exists():
+            # The archive is only written once it is complete
+            return
+        self.stats = compress(
+            self.from_dir, self.to_dir, self.dir_size_bytes, dry_run=self.dry_run
+        )
+
+    def delete_symlink(self) -> None:
+        if not self.folder.source_dir.is_symlink():
+            return
+        delete_symlink(self.folder.source_dir, dry_run=self.dry_run)
+
+    def update_library(self, library: Library) -> None:
+        library.compress_folder(
+            self.folder,
+            self.dir_stats,
+            self.to_dir.stat().st_size,
+            self.stats.bytes_per_second if self.stats else None,
+        )
+
+    def print_result(self) -> None:
+        folder = self.folder
+        con.print_success(
+            f"\n[bold]Compress folder {con.style_path(folder.source_dir)} in {con.style_library(self.library)}[/bold]"
+        )
+        con.print_(f"Data is now in archive {con.style_path(self.to_dir.name)}")
+        con.print_(
+            f"Run [bold]rob remove[/bold] to restore it to {con.style_path(folder.source_dir)}"
+        )
+
+
+def run_batch(
+    batch: list[FilestoreActions], confirm: bool = True
+) -> list[FilestoreActions]:
+    """
+    Run actions for many folders
+
+    Confirm once, run all pre-flight checks, then run actions at the same time
+    if they use different disks. Return actions that succeeded.
+    """
+    if len(batch) == 1:
+        batch[0].run(confirm)
+        return batch
+
+    if confirm:
+        for actions in batch:
+            con.print_(f"\n{con.style_path(actions.folder.source_dir)}")
+            actions.print_size()
+        total_bytes = sum(actions.dir_size_bytes for actions in batch)
+        con.print_(f"\nTotal size: {con.style_bytes_as_gb(total_bytes)}")
+        con.confirm_action(batch[0].dry_run)
+
+    if not_started := [actions for actions in batch if not actions.resume]:
+        for actions in not_started:
+            con.print_(f"\n{con.style_path(actions.folder.source_dir)}", end="")
+            with rob.timings.phase("preflight", actions.folder.short_name):
+                actions.preflight_checks()
+        test_batch_disk_space(not_started)
+
+    jobs = [
+        Job(name=actions.folder.short_name, disks=actions.disks, run=actions.actions)
+        for actions in batch
+    ]
+    run_jobs(jobs)
+    return [actions for actions, job in zip(batch, jobs) if not job.error]
+
+
+def get_journal_actions(journal: Journal, copy_engine: CopyEngine) -> FilestoreActions:
+    """Actions to continue the interrupted command saved in `journal`"""
+    actions_class = {
+        "add": AddFolderActions,
+        "remove": RemoveFolderActions,
+        "compress": CompressFolderActions,
+    }[journal.operation]
+    return actions_class(
+        journal.folder,
+        journal.library,
+        dry_run=False,
+        copy_engine=copy_engine,
+        journal=journal,
+        **journal.options,
+    )
+
+
+def test_batch_disk_space(batch: list[FilestoreActions]) -> None:
+    """Pre-flight checks test space for each folder, so also test the total"""
+    bytes_by_volume: dict[str, int] = defaultdict(int)
+    for actions in batch:
+        bytes_by_volume[get_volume(actions.to_dir)] += actions.copy_bytes
+    con.print_("")
+    for volume, dir_size_bytes in bytes_by_volume.items():
+        test_disk_space(dir_size_bytes, DiskUsage(volume))
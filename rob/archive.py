@@ -0,0 +1,490 @@
+"""
+Compressed archives of library subdirs, for folders that are kept in cold storage
+
+An archive is a stream of entries in the order they were found, each followed by
+its data:
+
+    MAGIC
+    ENTRY path           a folder
+    ENTRY path target    a symlink, where `size` is the length of `target`
+    ENTRY path CHUNK...  a file, with one chunk for every `CHUNK_BYTES` of data
+    END
+
+Chunks are compressed by a pool of threads and written in order, so large files
+and many small files are both compressed in parallel. zlib releases the GIL while
+it works. Chunks that don't get smaller, e.g. of game data that is compressed
+already, are stored as they are.
+"""
+
+from __future__ import annotations
+
+import os
+import stat
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import BinaryIO, Callable, Iterator, Optional, Union
+
+from click import ClickException
+
+import rob.console as con
+from rob.engines import ProgressCallback
+from rob.filesystem import DirStats, delete_tree, is_link
+from rob.manifest import Manifest, ManifestEntry, raise_if_problems
+
+ARCHIVE_SUFFIX = ".robz"
+MAGIC = b"ROBZ\x00\x01\r\n"
+CHUNK_BYTES = 1024**2
+COMPRESSION_LEVEL = 1
+"Fastest zlib level. Cold data is read from slow disks, so speed matters more than size."
+ARCHIVE_THREADS = min(32, os.cpu_count() or 1)
+PENDING_PER_THREAD = 4
+"Chunks waiting to be written, which limits memory use"
+
+ENTRY = struct.Struct("<cIqQI")
+"Kind, mode, mtime_ns, size and length of path"
+CHUNK = struct.Struct("<BIII")
+"Codec, size, stored size and CRC-32 of data"
+KIND_DIR = b"d"
+KIND_FILE = b"f"
+KIND_SYMLINK = b"l"
+KIND_END = b"e"
+CODEC_STORED = 0
+CODEC_ZLIB = 1
+
+
+@dataclass
+class ArchiveStats:
+    """What `compress_tree()` or `extract_archive()` did"""
+
+    files: int = 0
+    bytes_: int = 0
+    "Size of data before compression"
+    compressed_bytes: int = 0
+    "Size of the archive"
+    seconds: float = 0
+
+    @property
+    def ratio(self) -> float:
+        """Size of the archive as a fraction of the data"""
+        return self.compressed_bytes / self.bytes_ if self.bytes_ else 1
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_ / self.seconds if self.seconds else 0
+
+
+def compress(
+    source: Path, archive_path: Path, dir_size_bytes: int, dry_run: bool = False
+) -> Optional[ArchiveStats]:
+    """Compress `source` with a progress bar. Return `None` in dry run mode."""
+    msg = f"Compressing data from {con.style_path(source)} to {con.style_path(archive_path)}"
+    if dry_run:
+        con.print_(msg, end="")
+        con.print_skipped()
+        return None
+    con.print_(msg)
+    with con.progress_bar("Compressing data...", dir_size_bytes) as progress:
+        stats = compress_tree(source, archive_path, progress)
+    con.print_(
+        f"[green]Compression complete[/green] {stats.files:,} files, "
+        f"{con.style_bytes_as_gb(stats.bytes_)} compressed to {stats.ratio:.0%} at "
+        f"{con.style_bytes_per_second(stats.bytes_per_second)}"
+    )
+    return stats
+
+
+def extract(
+    archive_path: Path, target: Path, dir_size_bytes: int, dry_run: bool = False
+) -> Optional[ArchiveStats]:
+    """Extract to `target` with a progress bar. Return `None` in dry run mode."""
+    msg = f"Extracting data from {con.style_path(archive_path)} to {con.style_path(target)}"
+    if target.exists():
+        con.print_(msg)
+        raise ClickException(f"{target} already exists")
+    if dry_run:
+        con.print_(msg, end="")
+        con.print_skipped()
+        return None
+    con.print_(msg)
+    with con.progress_bar("Extracting data...", dir_size_bytes) as progress:
+        stats = extract_archive(archive_path, target, progress)
+    con.print_(
+        f"[green]Extraction complete[/green] {stats.files:,} files, "
+        f"{con.style_bytes_as_gb(stats.bytes_)} at "
+        f"{con.style_bytes_per_second(stats.bytes_per_second)}"
+    )
+    return stats
+
+
+def verify_archive(
+    manifest: Manifest, archive_path: Path, mode: str = "quick", dry_run: bool = False
+) -> None:
+    """
+    Check that the archive matches `manifest`, which was made before it was written
+
+    "quick" mode compares paths, sizes and modified times. "hash" mode also tests
+    the checksum of all data in the archive.
+    """
+    con.print_(f"Verifying archive {con.style_path(archive_path)}", end="")
+    if dry_run:
+        con.print_skipped()
+        return
+    problems = manifest.compare(read_manifest(archive_path))
+    if not problems and mode == "hash":
+        try:
+            test_archive(archive_path)
+        except ClickException as e:
+            problems = [e.message]
+    raise_if_problems(problems, "Folder and archive do not match. Aborting.")
+
+
+def compress_tree(
+    source: Path,
+    archive_path: Path,
+    progress: ProgressCallback,
+    threads: int = ARCHIVE_THREADS,
+) -> ArchiveStats:
+    """
+    Write contents of `source` to a new archive at `archive_path`
+
+    The archive is written to a temporary file first, so it is never left half
+    written. The temporary file is deleted if compression fails.
+    """
+    stats = ArchiveStats()
+    start = perf_counter()
+    temp_path = archive_path.with_name(f"{archive_path.name}.partial")
+    try:
+        with open(temp_path, "wb") as archive, ThreadPoolExecutor(threads) as executor:
+            writer = _OrderedWriter(archive, threads * PENDING_PER_THREAD)
+            writer.put(MAGIC)
+            for rel_path, path_stat, link in _walk(source):
+                path = source.joinpath(rel_path)
+                if link:
+                    target = os.fsencode(os.readlink(path))
+                    writer.put(
+                        _pack_entry(KIND_SYMLINK, rel_path, path_stat, len(target))
+                    )
+                    writer.put(target)
+                    stats.files += 1
+                elif stat.S_ISDIR(path_stat.st_mode):
+                    writer.put(_pack_entry(KIND_DIR, rel_path, path_stat, 0))
+                else:
+                    writer.put(
+                        _pack_entry(KIND_FILE, rel_path, path_stat, path_stat.st_size)
+                    )
+                    with open(path, "rb") as file:
+                        size = 0
+                        while chunk := file.read(CHUNK_BYTES):
+                            size += len(chunk)
+                            writer.put(
+                                executor.submit(_compress_chunk, chunk),
+                                lambda count=len(chunk): progress(count),
+                            )
+                    if size != path_stat.st_size:
+                        raise ClickException(f"{path} changed while it was compressed")
+                    stats.files += 1
+                    stats.bytes_ += size
+            writer.put(KIND_END)
+            writer.flush()
+            stats.compressed_bytes = archive.tell()
+            archive.flush()
+            os.fsync(archive.fileno())
+    except BaseException:
+        # Including Ctrl+C
+        temp_path.unlink(missing_ok=True)
+        raise
+    os.replace(temp_path, archive_path)
+    stats.seconds = perf_counter() - start
+    return stats
+
+
+def extract_archive(
+    archive_path: Path,
+    target: Path,
+    progress: ProgressCallback,
+    threads: int = ARCHIVE_THREADS,
+) -> ArchiveStats:
+    """
+    Extract the archive at `archive_path` to a new folder `target`
+
+    Chunks are read in order and decompressed by a pool of threads, so the archive
+    is only read once. The checksum of every chunk is tested.
+
+    `target` is deleted if extraction fails, so it can be tried again.
+    """
+    stats = ArchiveStats(compressed_bytes=archive_path.stat().st_size)
+    start = perf_counter()
+    dirs: list[tuple[Path, int, int]] = []
+    open_files: set[BinaryIO] = set()
+    "Files that are waiting for their chunks to be written"
+    with open(archive_path, "rb") as archive, ThreadPoolExecutor(threads) as executor:
+        reader = _Reader(archive, archive_path)
+        writer = _OrderedWriter(None, threads * PENDING_PER_THREAD)
+        target.mkdir()
+        try:
+            for kind, rel_path, mode, mtime_ns, size in reader.entries():
+                path = target.joinpath(rel_path)
+                if kind == KIND_DIR:
+                    path.mkdir()
+                    dirs.append((path, mode, mtime_ns))
+                elif kind == KIND_SYMLINK:
+                    os.symlink(os.fsdecode(reader.read(size)), path)
+                    stats.files += 1
+                else:
+                    # Closed by the writer after its last chunk is written
+                    file = open(path, "wb")  # pylint: disable=consider-using-with
+                    open_files.add(file)
+                    remaining = size
+                    while remaining:
+                        codec, chunk_size, data, crc = reader.read_chunk(
+                            remaining, path
+                        )
+                        remaining -= chunk_size
+                        writer.put(
+                            executor.submit(
+                                _decompress_chunk, codec, chunk_size, data, crc, path
+                            ),
+                            lambda count=chunk_size: progress(count),
+                            file,
+                        )
+                    writer.put(
+                        None,
+                        partial(_close, file, path, mode, mtime_ns, open_files),
+                    )
+                    stats.files += 1
+                    stats.bytes_ += size
+            writer.flush()
+            # Set folder metadata last, as creating files changes it
+            for path, mode, mtime_ns in reversed(dirs):
+                os.chmod(path, stat.S_IMODE(mode))
+                os.utime(path, ns=(mtime_ns, mtime_ns))
+        except BaseException:
+            # Including Ctrl+C
+            for file in open_files:
+                file.close()
+            try:
+                delete_tree(target)
+            except OSError:
+                con.print_(
+                    f"[yellow]Could not delete {con.style_path(target)}[/yellow]"
+                )
+            raise
+    stats.seconds = perf_counter() - start
+    return stats
+
+
+def read_manifest(archive_path: Path) -> Manifest:
+    """Files and folders in the archive. Data is skipped, not read."""
+    manifest = Manifest()
+    with open(archive_path, "rb") as archive:
+        reader = _Reader(archive, archive_path)
+        for kind, rel_path, _, mtime_ns, size in reader.entries():
+            if kind == KIND_DIR:
+                manifest.dirs.add(rel_path)
+                manifest.stats.dirs += 1
+                continue
+            is_symlink = kind == KIND_SYMLINK
+            if is_symlink:
+                reader.read(size)
+            else:
+                reader.skip_chunks(size, rel_path)
+            manifest.files[rel_path] = ManifestEntry(
+                size=size, mtime_ns=mtime_ns, is_symlink=is_symlink
+            )
+            manifest.stats += DirStats(
+                apparent_bytes=size, allocated_bytes=size, files=1
+            )
+    return manifest
+
+
+def test_archive(archive_path: Path, threads: int = ARCHIVE_THREADS) -> None:
+    """Decompress every chunk of the archive and test its checksum"""
+    with open(archive_path, "rb") as archive, ThreadPoolExecutor(threads) as executor:
+        reader = _Reader(archive, archive_path)
+        writer = _OrderedWriter(None, threads * PENDING_PER_THREAD)
+        for kind, rel_path, _, _, size in reader.entries():
+            if kind == KIND_SYMLINK:
+                reader.read(size)
+            remaining = size if kind == KIND_FILE else 0
+            while remaining:
+                codec, chunk_size, data, crc = reader.read_chunk(remaining, rel_path)
+                remaining -= chunk_size
+                writer.put(
+                    executor.submit(
+                        _decompress_chunk, codec, chunk_size, data, crc, rel_path
+                    )
+                )
+        writer.flush()
+
+
+def _walk(source: Path) -> Iterator[tuple[str, os.stat_result, bool]]:
+    """
+    Relative path, stat and whether it is a link, of everything in `source`, with
+    folders before their contents
+    """
+    dirs = [""]
+    index = 0
+    while index < len(dirs):
+        rel_dir = dirs[index]
+        index += 1
+        with os.scandir(source.joinpath(rel_dir)) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                rel_path = os.path.join(rel_dir, entry.name)
+                path_stat = entry.stat(follow_symlinks=False)
+                link = is_link(entry)
+                if stat.S_ISDIR(path_stat.st_mode) and not link:
+                    dirs.append(rel_path)
+                yield rel_path, path_stat, link
+
+
+def _pack_entry(kind: bytes, rel_path: str, path_stat: os.stat_result, size: int):
+    # Stored with / so that archives can be read on other platforms
+    path = rel_path.replace(os.sep, "/").encode("utf8")
+    return (
+        ENTRY.pack(kind, path_stat.st_mode, path_stat.st_mtime_ns, size, len(path))
+        + path
+    )
+
+
+def _compress_chunk(chunk: bytes) -> bytes:
+    crc = zlib.crc32(chunk)
+    compressed = zlib.compress(chunk, COMPRESSION_LEVEL)
+    if len(compressed) < len(chunk):
+        return CHUNK.pack(CODEC_ZLIB, len(chunk), len(compressed), crc) + compressed
+    return CHUNK.pack(CODEC_STORED, len(chunk), len(chunk), crc) + chunk
+
+
+def _decompress_chunk(
+    codec: int, size: int, data: bytes, crc: int, path: Union[Path, str]
+) -> bytes:
+    try:
+        if codec == CODEC_ZLIB:
+            data = zlib.decompress(data, bufsize=size)
+    except zlib.error as e:
+        raise ClickException(f"Archive is damaged. Data of {path} is invalid.") from e
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ClickException(f"Archive is damaged. Data of {path} does not match.")
+    return data
+
+
+def _close(
+    file: BinaryIO, path: Path, mode: int, mtime_ns: int, open_files: set[BinaryIO]
+) -> None:
+    file.close()
+    open_files.discard(file)
+    os.chmod(path, stat.S_IMODE(mode))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class _OrderedWriter:
+    """
+    Write data to files in the order it is put, while it is being prepared by other
+    threads. `put()` waits if too much is pending.
+    """
+
+    def __init__(self, default_file: Optional[BinaryIO], max_pending: int):
+        self.default_file = default_file
+        self.max_pending = max_pending
+        self.pending: deque[
+            tuple[
+                Union[bytes, Future, None],
+                Optional[Callable[[], None]],
+                Optional[BinaryIO],
+            ]
+        ] = deque()
+
+    def put(
+        self,
+        data: Union[bytes, Future, None],
+        after: Optional[Callable[[], None]] = None,
+        file: Optional[BinaryIO] = None,
+    ) -> None:
+        """Write `data`, which can be a `Future` of bytes, then call `after`"""
+        self.pending.append((data, after, file or self.default_file))
+        while len(self.pending) > self.max_pending:
+            self._write_next()
+
+    def flush(self) -> None:
+        while self.pending:
+            self._write_next()
+
+    def _write_next(self) -> None:
+        data, after, file = self.pending.popleft()
+        if isinstance(data, Future):
+            data = data.result()
+        if data is not None and file is not None:
+            file.write(data)
+        if after:
+            after()
+
+
+class _Reader:
+    def __init__(self, archive: BinaryIO, path: Path):
+        self.archive = archive
+        self.path = path
+        if self.read(len(MAGIC)) != MAGIC:
+            raise ClickException(f"{path} is not a rob archive")
+
+    def read(self, size: int) -> bytes:
+        data = self.archive.read(size)
+        if len(data) != size:
+            raise ClickException(f"Archive {self.path} is incomplete")
+        return data
+
+    def entries(self) -> Iterator[tuple[bytes, str, int, int, int]]:
+        """
+        Kind, relative path, mode, mtime_ns and size of each entry
+
+        Paths must be inside a folder that came before them, so that entries can't
+        be extracted outside the target folder, or through a symlink.
+        """
+        dirs = {""}
+        while (kind := self.read(1)) != KIND_END:
+            _, mode, mtime_ns, size, path_length = ENTRY.unpack(
+                kind + self.read(ENTRY.size - 1)
+            )
+            rel_path = self.read(path_length).decode("utf8").replace("/", os.sep)
+            parent, name = os.path.split(rel_path)
+            if (
+                name in ("", os.curdir, os.pardir)
+                or parent not in dirs
+                or os.path.isabs(rel_path)
+                or os.path.splitdrive(rel_path)[0]
+            ):
+                raise ClickException(f"Archive is damaged. Path {rel_path} is invalid.")
+            if kind == KIND_DIR:
+                dirs.add(rel_path)
+            yield kind, rel_path, mode, mtime_ns, size
+
+    def read_chunk(
+        self, remaining: int, path: Union[Path, str]
+    ) -> tuple[int, int, bytes, int]:
+        """
+        Codec, size, stored data and CRC-32 of the next chunk of the file at `path`,
+        which has `remaining` bytes left
+        """
+        codec, size, stored_size, crc = self._read_chunk_header(remaining, path)
+        return codec, size, self.read(stored_size), crc
+
+    def skip_chunks(self, size: int, path: Union[Path, str]) -> None:
+        """Skip the chunks of a file of `size` bytes"""
+        while size:
+            _, chunk_size, stored_size, _ = self._read_chunk_header(size, path)
+            self.archive.seek(stored_size, os.SEEK_CUR)
+            size -= chunk_size
+
+    def _read_chunk_header(
+        self, remaining: int, path: Union[Path, str]
+    ) -> tuple[int, int, int, int]:
+        codec, size, stored_size, crc = CHUNK.unpack(self.read(CHUNK.size))
+        # Chunks are never empty, and are stored as they are if they don't get
+        # smaller. A size that doesn't fit would make the reader loop forever.
+        if not 0 < size <= remaining or stored_size > size:
+            raise ClickException(f"Archive is damaged. Data of {path} is invalid.")
+        return codec, size, stored_size, crc
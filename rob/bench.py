@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import cache
+from pathlib import Path
+from typing import Callable, Optional
+
+import rob.console as con
+from rob import PROJECT_NAME
+from rob.engines import DEFAULT_BUFFER_SIZE, CopyEngine
+from rob.folders import Library
+from rob.preflight import get_volume_key
+
+BENCH_DIR_NAME = f"_{PROJECT_NAME}_bench"
+BUFFER_SIZES = [256 * 1024, 1024**2, DEFAULT_BUFFER_SIZE, 32 * 1024**2]
+LARGE_FILE_THREADS = [1, 2, 4, 8]
+LARGE_FILE_COUNT = 16
+SMALL_FILE_THREADS = [1, 2, 4, 8, 16, 32]
+SMALL_FILE_COUNT = 256
+SMALL_FILE_SIZE = 64 * 1024
+CLOSE_TO_BEST = 0.9
+"Fewer threads are chosen if they are at least this fraction as fast as the best"
+CAN_DROP_CACHE = hasattr(os, "posix_fadvise")
+"""
+Whether test files can be read from disk instead of the OS cache. Not on Windows,
+where every buffer size would be measured at the speed of memory.
+"""
+
+
+@dataclass
+class VolumeProfile:
+    """Copy settings that suit a volume, measured by `rob bench`"""
+
+    volume: str
+    "From `get_volume_key()`"
+    threads: int
+    small_file_threads: int
+    buffer_size: int
+    read_bytes_per_second: float
+    write_bytes_per_second: float
+    small_files_per_second: float
+    measured_at: float = field(default_factory=time.time)
+
+    def to_row(self) -> dict:
+        return asdict(self)
+
+
+def get_bench_folders(library: Library, paths: list[Path]) -> dict[str, Path]:
+    """
+    A folder to test on each volume of the library, its folders and `paths`, by
+    `get_volume_key()`
+    """
+    folders: dict[str, Path] = {}
+    for path in (
+        [library.library_folder]
+        + paths
+        + [source_dir.parent for source_dir in library.source_dirs]
+    ):
+        if path.is_dir():
+            folders.setdefault(get_volume_key(path), path)
+    return folders
+
+
+def bench_volume(volume: str, folder: Path, size_bytes: int) -> VolumeProfile:
+    """Measure throughput with test files in `folder`, which are deleted afterwards"""
+    bench_dir = folder.joinpath(BENCH_DIR_NAME)
+    # May be left by an interrupted test
+    bench_dir.mkdir(exist_ok=True)
+    try:
+        path = bench_dir.joinpath("sequential")
+        con.print_(f"Testing sequential write to {con.style_path(folder)}", end="")
+        write_seconds = _timed(lambda: _write_file(path, size_bytes))
+        con.print_(f" {con.style_bytes_per_second(size_bytes / write_seconds)}")
+
+        con.print_(f"Testing sequential read from {con.style_path(folder)}", end="")
+        buffer_sizes = BUFFER_SIZES if CAN_DROP_CACHE else [DEFAULT_BUFFER_SIZE]
+        read_rates = {
+            buffer_size: size_bytes / _timed(lambda: _read_file(path, buffer_size))
+            for buffer_size in buffer_sizes
+        }
+        buffer_size = choose_setting(read_rates)
+        con.print_(
+            f" {con.style_bytes_per_second(read_rates[buffer_size])} "
+            f"with {buffer_size // 1024:,} KB buffer"
+        )
+        if not CAN_DROP_CACHE:
+            con.print_(
+                "[yellow]Unable to clear the OS file cache on this platform. Read speed may be too high, and the buffer size is not tuned.[/yellow]"
+            )
+        path.unlink()
+
+        con.print_(f"Testing large files in {con.style_path(folder)}", end="")
+        large_rates = {
+            threads: _bench_files(
+                bench_dir, LARGE_FILE_COUNT, size_bytes // LARGE_FILE_COUNT, threads
+            )
+            for threads in LARGE_FILE_THREADS
+        }
+        threads = choose_setting(large_rates)
+        con.print_(
+            f" {con.style_bytes_per_second(large_rates[threads] * size_bytes / LARGE_FILE_COUNT)} "
+            f"with {threads} threads"
+        )
+
+        con.print_(f"Testing small files in {con.style_path(folder)}", end="")
+        small_rates = {
+            threads: _bench_files(bench_dir, SMALL_FILE_COUNT, SMALL_FILE_SIZE, threads)
+            for threads in SMALL_FILE_THREADS
+        }
+        small_file_threads = choose_setting(small_rates)
+        con.print_(
+            f" {small_rates[small_file_threads]:,.0f} files/s "
+            f"with {small_file_threads} threads"
+        )
+    finally:
+        shutil.rmtree(bench_dir, ignore_errors=True)
+    return VolumeProfile(
+        volume=volume,
+        threads=threads,
+        small_file_threads=small_file_threads,
+        buffer_size=buffer_size,
+        read_bytes_per_second=read_rates[buffer_size],
+        write_bytes_per_second=size_bytes / write_seconds,
+        small_files_per_second=small_rates[small_file_threads],
+    )
+
+
+def choose_setting(rates: dict[int, float]) -> int:
+    """
+    The smallest setting that is close to the fastest. Less threads or memory is
+    better when the difference is within measurement noise.
+    """
+    best = max(rates.values())
+    return min(
+        setting for setting, rate in rates.items() if rate >= best * CLOSE_TO_BEST
+    )
+
+
+def _bench_files(folder: Path, count: int, size_bytes: int, threads: int) -> float:
+    """Write then read `count` files with `threads` at a time. Return files per second."""
+    paths = [folder.joinpath(f"{threads}_{index}") for index in range(count)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        seconds = _timed(
+            lambda: list(
+                executor.map(lambda path: _write_file(path, size_bytes), paths)
+            )
+        )
+        seconds += _timed(
+            lambda: list(
+                executor.map(lambda path: _read_file(path, DEFAULT_BUFFER_SIZE), paths)
+            )
+        )
+    for path in paths:
+        path.unlink()
+    return count / seconds
+
+
+def _timed(function: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    function()
+    # Avoid division by zero on coarse clocks
+    return max(time.perf_counter() - start, 1e-6)
+
+
+@cache
+def _get_chunk() -> bytes:
+    # Random data, as some filesystems compress or skip runs of zeros
+    return os.urandom(DEFAULT_BUFFER_SIZE)
+
+
+def _write_file(path: Path, size_bytes: int) -> None:
+    chunk = _get_chunk()
+    with open(path, "wb") as file:
+        written = 0
+        while written < size_bytes:
+            written += file.write(chunk[: size_bytes - written])
+        file.flush()
+        # Measure the disk, not the page cache
+        os.fsync(file.fileno())
+
+
+def _read_file(path: Path, buffer_size: int) -> None:
+    _drop_cache(path)
+    buffer = bytearray(buffer_size)
+    with open(path, "rb", buffering=0) as file:
+        while file.readinto(buffer):
+            pass
+
+
+def _drop_cache(path: Path) -> None:
+    """Ask the OS to read `path` from disk next time. See `CAN_DROP_CACHE`."""
+    if not CAN_DROP_CACHE:
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def get_profile(library: Library, path: Path) -> Optional[VolumeProfile]:
+    row = library.get_volume_profile(get_volume_key(path))
+    return VolumeProfile(**dict(row)) if row else None
+
+
+def tune_copy_engine(
+    copy_engine: CopyEngine, library: Library, source: Path, target: Path
+) -> CopyEngine:
+    """
+    Return a copy of `copy_engine` with settings that suit the volumes of `source`
+    and `target`, if they have been measured by `rob bench`
+
+    Thread counts are limited by the slower volume. Settings that were given on the
+    command line are kept.
+    """
+    if not copy_engine.auto_tune:
+        return copy_engine
+    profiles = [
+        profile
+        for path in (source, target)
+        if (profile := get_profile(library, path)) is not None
+    ]
+    if not profiles:
+        return copy_engine
+    return copy_engine.tune(
+        threads=min(profile.threads for profile in profiles),
+        small_file_threads=min(profile.small_file_threads for profile in profiles),
+        buffer_size=max(profile.buffer_size for profile in profiles),
+    )
@@ -1,22 +1,51 @@
-from pathlib import WindowsPath
+from __future__ import annotations
+
+import glob
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, TextIO
 
 import click
 from click import ClickException
 from click_help_colors import HelpColorsGroup
 
-from rob.actions import AddFolderActions, RemoveFolderActions
+import rob.timings
 from rob.console import (
     HELP_HEADERS_COLOR,
     HELP_OPTIONS_COLOR,
+    confirm_action,
     print_,
+    print_history_table,
     print_library_info,
+    print_library_json,
     print_success,
     print_title,
+    print_title_later,
+    quiet,
     style_library,
     style_path,
 )
+from rob.engines import (
+    ENGINE_NAMES,
+    CopyEngine,
+    get_copy_engine,
+    get_default_engine_name,
+)
 from rob.exceptions import echo_red_error
-from rob.folders import Folder, Library
+from rob.filesystem import delete_folder, get_volume
+from rob.manifest import VERIFY_MODES
+
+if TYPE_CHECKING:
+    from rob.actions import FilestoreActions
+    from rob.folders import Folder, Library
+
+# Modules that are only needed by some commands are imported by those commands,
+# so that rob starts quickly, e.g. for --help. See benchmarks/startup.py.
+# pylint: disable=import-outside-toplevel
+
+DEFAULT_BENCH_MB = 128
+DEFAULT_DEBOUNCE_SECONDS = 2.0
 
 
 def library_folder_option(function):
@@ -25,7 +54,7 @@ def library_folder_option(function):
         "--library-folder",
         default=".",
         type=click.Path(
-            exists=True, file_okay=False, path_type=WindowsPath, resolve_path=True
+            exists=True, file_okay=False, path_type=Path, resolve_path=True
         ),
         help="The path of the library. The current folder is used by default.",
     )(function)
@@ -40,29 +69,80 @@ def library_folder_option(function):
 )
 @click.pass_context
 @library_folder_option
-def cli(ctx, library_folder: WindowsPath):
+def cli(ctx, library_folder: Path):
     """
     rob is a command line tool that frees up space on your SSD by moving data to a library of folders on another disk.
 
     rob creates a symlink from the original location to the library so that games continue to work and can be updated.
     """
     click.exceptions.echo = echo_red_error  # type: ignore
-    print_title()
+    if ctx.invoked_subcommand:
+        # Not printed if the command doesn't print, e.g. --help or list --json
+        print_title_later()
+    else:
+        print_title()
 
     if ctx.invoked_subcommand is None:
         # Show help and library info if no command provided
         click.echo(cli.get_help(ctx))
         print_("")
+        from rob.folders import Library
+
         library = Library(library_folder)
         print_library_info(library)
 
 
 @cli.command(name="list")
 @library_folder_option
-def list_(library_folder: WindowsPath):
+@click.option(
+    "--refresh",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Scan all folders again, instead of only those that have changed.",
+)
+@click.option(
+    "--json",
+    "output_format",
+    flag_value="json",
+    help="Print as JSON, for other programs. Folders are printed as their size is found.",
+)
+@click.option(
+    "--ndjson",
+    "output_format",
+    flag_value="ndjson",
+    help="Print as JSON, with a line for each drive and folder.",
+)
+def list_(library_folder: Path, refresh: bool, output_format: Optional[str]):
     """List folders in library and their size"""
+    from rob.folders import Library
+
+    if output_format:
+        # Only JSON is printed to stdout
+        quiet()
     library = Library(library_folder)
-    print_library_info(library, show_size=True)
+    if output_format:
+        print_library_json(library, refresh, ndjson=output_format == "ndjson")
+    else:
+        print_library_info(library, show_size=True, refresh=refresh)
+
+
+@cli.command()
+@library_folder_option
+@click.option(
+    "--limit",
+    default=20,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of operations to show.",
+)
+def history(library_folder: Path, limit: int):
+    """List recent add and remove operations"""
+    from rob.folders import Library
+
+    library = Library(library_folder)
+    print_("")
+    print_history_table(library.get_history(limit))
 
 
 def dry_run_option(function):
@@ -86,10 +166,133 @@ def dont_copy_permissions_option(function):
     )(function)
 
 
+def recheck_option(function):
+    return click.option(
+        "--recheck",
+        default=False,
+        type=bool,
+        is_flag=True,
+        help="Run all pre-flight checks, including those that passed recently.",
+    )(function)
+
+
+def defer_delete_option(function):
+    return click.option(
+        "--defer-delete",
+        default=False,
+        type=bool,
+        is_flag=True,
+        help="Move old data to trash and delete it in the background, so the command ends sooner. See rob gc.",
+    )(function)
+
+
+def timings_options(function):
+    """`--timings` and `--trace`, which are handled when the command ends"""
+
+    def show_timings(ctx: click.Context, _, value: bool) -> None:
+        if value:
+            rob.timings.enable()
+            ctx.call_on_close(rob.timings.print_timings)
+
+    def save_trace(ctx: click.Context, _, value: Optional[Path]) -> None:
+        if value:
+            rob.timings.enable()
+            ctx.call_on_close(lambda: rob.timings.write_trace(value))
+
+    function = click.option(
+        "--timings",
+        default=False,
+        type=bool,
+        is_flag=True,
+        expose_value=False,
+        callback=show_timings,
+        help="Show how long each phase took (advanced).",
+    )(function)
+    return click.option(
+        "--trace",
+        type=click.Path(dir_okay=False, path_type=Path),
+        expose_value=False,
+        callback=save_trace,
+        help="Save timings of each phase to a Chrome trace file, with data size and speed (advanced).",
+    )(function)
+
+
+def from_file_option(function):
+    return click.option(
+        "--from-file",
+        type=click.File(encoding="utf8"),
+        help="A text file with one folder per line.",
+    )(function)
+
+
+def copy_engine_options(function):
+    def set_priority(_, __, value: bool) -> bool:
+        if value:
+            # Once for the whole process, which its copy threads inherit
+            from rob.throttle import set_background_priority
+
+            if not set_background_priority():
+                print_(
+                    "[yellow]Disk priority can't be lowered on this system. Copies "
+                    "still slow down while other programs use the disk.[/yellow]"
+                )
+        return value
+
+    function = click.option(
+        "--engine",
+        default=get_default_engine_name(),
+        show_default=True,
+        type=click.Choice(ENGINE_NAMES),
+        help="Program used to copy data (advanced).",
+    )(function)
+    function = click.option(
+        "--threads",
+        type=click.IntRange(min=1),
+        help="Number of files to copy at once. Default is 8, or as measured by rob bench (advanced).",
+    )(function)
+    function = click.option(
+        "--max-rate",
+        type=click.FloatRange(min=1),
+        help="Copy at most this many MB per second, so that other programs can use the disk.",
+    )(function)
+    return click.option(
+        "--background",
+        default=False,
+        type=bool,
+        is_flag=True,
+        callback=set_priority,
+        help="Copy with low priority, and slow down while other programs use the disk.",
+    )(function)
+
+
+def get_engine(
+    engine: str, threads: Optional[int], max_rate: Optional[float], background: bool
+) -> CopyEngine:
+    """Copy engine with the options of `copy_engine_options()`. `max_rate` is in MB/s."""
+    return get_copy_engine(
+        engine, threads, max_rate * 1024**2 if max_rate else None, background
+    )
+
+
+def verify_option(function):
+    return click.option(
+        "--verify",
+        default="quick",
+        show_default=True,
+        type=click.Choice(VERIFY_MODES),
+        help="How to check copied data: compare size and modified time of every file, or also compare file contents.",
+    )(function)
+
+
 @cli.command(no_args_is_help=True)
 @library_folder_option
 @dry_run_option
 @dont_copy_permissions_option
+@copy_engine_options
+@timings_options
+@verify_option
+@recheck_option
+@defer_delete_option
 @click.option(
     "--allow-same-disk",
     default=False,
@@ -97,116 +300,816 @@ def dont_copy_permissions_option(function):
     is_flag=True,
     help="Allow source folder to be on same disk as rob library (advanced).",
 )
-@click.argument(
-    "folder-path",
-    type=click.Path(
-        exists=True,
-        file_okay=False,
-        path_type=WindowsPath,
-    ),
-)
+@click.argument("folder-paths", nargs=-1)
+@from_file_option
 def add(
-    folder_path: WindowsPath,
-    library_folder: WindowsPath,
+    folder_paths: tuple[str, ...],
+    from_file: Optional[TextIO],
+    library_folder: Path,
     dry_run: bool,
     dont_copy_permissions: bool,
+    engine: str,
+    threads: Optional[int],
+    max_rate: Optional[float],
+    background: bool,
+    verify: str,
+    recheck: bool,
+    defer_delete: bool,
     allow_same_disk: bool,
 ):
     """
-    Add FOLDER_PATH to library
+    Add FOLDER_PATHS to library
 
     Data is moved to the library folder and the original location is replaced by a symlink.
+
+    Paths can include wildcards, e.g. "C:\\Games\\*". Folders on different disks are moved at the same time.
+    """
+    from rob.actions import AddFolderActions, run_batch
+    from rob.folders import Library
+
+    library = Library(library_folder)
+    folders: list[Folder] = []
+    for folder_path in get_search_terms(folder_paths, from_file, expand_paths=True):
+        folders.append(
+            get_folder_to_add(
+                Path(folder_path),
+                library,
+                folders,
+                allow_same_disk,
+                lock=not dry_run,
+            )
+        )
+
+    copy_engine = get_engine(engine, threads, max_rate, background)
+    batch = []
+    for folder in folders:
+        print_(
+            f"[bold]Add folder {style_path(folder.source_dir)} to {style_library(library)}[/bold]"
+        )
+        batch.append(
+            AddFolderActions(
+                folder,
+                library,
+                dry_run,
+                dont_copy_permissions,
+                copy_engine,
+                verify,
+                recheck=recheck,
+                defer_delete=defer_delete,
+            )
+        )
+    succeeded = run_batch(batch)
+    save_results(library_folder, batch, succeeded, dry_run)
+
+
+def get_folder_to_add(
+    folder_path: Path,
+    library: Library,
+    other_folders: list[Folder],
+    allow_same_disk: bool,
+    lock: bool = False,
+) -> Folder:
     """
+    Check that `folder_path` can be added to `library` along with `other_folders`
+
+    If `lock`, the folder is locked first, so that another process can't start to
+    move it after it has been checked.
+    """
+    from rob.folders import Folder
+
+    # The folder is renamed while data is moved, so check the path as given first
+    unresolved_folder = Folder(
+        source_dir=folder_path.parent.resolve() / folder_path.name
+    )
+    if lock:
+        lock_folder(library, unresolved_folder)
+    raise_if_not_journaled(library, [unresolved_folder])
     if folder_path.is_symlink():
         raise ClickException(
             f"Cannot add folder. {folder_path} is a symlink. Is it already in library?"
         )
+    if not folder_path.is_dir():
+        raise ClickException(f"Cannot add folder. {folder_path} is not a folder.")
     # Resolve path to fix capitalisation
     # Do this after symlink check to avoid resolving symlink!
     folder_path = folder_path.resolve()
-    library = Library(library_folder)
 
     if folder_path in library.source_dirs:
         raise ClickException(f"Cannot add folder. {folder_path} is already in library.")
 
-    folder = Folder(source_dir=folder_path)
-    if library.library_folder.drive == folder.source_dir.drive and not allow_same_disk:
+    # A warm folder has a copy of its data in the library already
+    folder = library.get_warm_folder(folder_path) or Folder(source_dir=folder_path)
+    same_disk = get_volume(library.library_folder) == get_volume(folder.source_dir)
+    if same_disk and not allow_same_disk:
         raise ClickException(
             f"Cannot add {folder_path}. Source folder and library should be on different disks. "
         )
     if len(folder.source_dir.parts) == 1:
         raise ClickException("Cannot add the root folder of a disk.")
-    for source_dir in library.source_dirs:
+    other_source_dirs = [other.source_dir for other in other_folders]
+    if folder_path in other_source_dirs:
+        raise ClickException(f"Cannot add {folder_path} more than once.")
+    # Names include a hash of the lowercase path, so paths that differ only in case
+    # have the same name
+    same_name = library.get_folder_by_short_name(folder.short_name) or next(
+        (other for other in other_folders if other.short_name == folder.short_name),
+        None,
+    )
+    if same_name and same_name.source_dir != folder.source_dir:
+        raise ClickException(
+            f"Cannot add {folder_path} because {same_name.source_dir} has the same "
+            f"name in the library, {folder.short_name}."
+        )
+    for source_dir in library.source_dirs + other_source_dirs:
         if folder_path in source_dir.parents:
             raise ClickException(
                 f"Cannot add {folder_path} because it is the parent of an existing source folder."
             )
+        if source_dir in folder_path.parents:
+            raise ClickException(
+                f"Cannot add {folder_path} because it is the child of an existing source folder."
+            )
     if library.library_folder in folder_path.parents:
         # Will resolve as child of library folder
         raise ClickException(
             f"Cannot add {folder_path} because it is the child of an existing source folder."
         )
-    msg = f"[bold]Add folder {style_path(folder.source_dir)} to {style_library(library)}[/bold]"
-    print_(msg)
-
-    actions = AddFolderActions(folder, library, dry_run, dont_copy_permissions)
-    actions.run()
-
-    if not dry_run:
-        # Load library again in case it has been updated by another process
-        library = Library(library_folder)
-        library.add_folder(folder)
-        library.save()
-        print_success("\n" + msg)
-        print_(f"Data is now in subfolder with name {style_path(folder.short_name)}")
-        print_(f"{style_path(folder.source_dir)} [bold]is[/bold] a symlink")
-    else:
-        print_success("\nDry run result:")
+    return folder
 
 
 @cli.command(no_args_is_help=True)
 @library_folder_option
 @dry_run_option
 @dont_copy_permissions_option
-@click.argument("folder-path")
+@copy_engine_options
+@timings_options
+@verify_option
+@recheck_option
+@defer_delete_option
+@click.option(
+    "--keep-warm",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Keep a copy of the data in the library, so that adding the folder again only copies files that have changed.",
+)
+@click.argument("folder-paths", nargs=-1)
+@from_file_option
 def remove(
-    folder_path: str,
-    library_folder: WindowsPath,
+    folder_paths: tuple[str, ...],
+    from_file: Optional[TextIO],
+    library_folder: Path,
     dry_run: bool,
     dont_copy_permissions: bool,
+    engine: str,
+    threads: Optional[int],
+    max_rate: Optional[float],
+    background: bool,
+    verify: str,
+    recheck: bool,
+    defer_delete: bool,
+    keep_warm: bool,
 ):
     """
-    Remove FOLDER_PATH from library
+    Remove FOLDER_PATHS from library
 
     Data is restored to its original location.
 
-    You can also select a folder by providing its ID or Name.
+    If a folder was removed with --keep-warm, its copy in the library is deleted.
+
+    You can also select a folder by providing its ID or Name. Paths and Names can include wildcards, e.g. "C:\\Games\\*".
     """
+    from rob.actions import RemoveFolderActions, run_batch
+    from rob.folders import Library
+    from rob.locks import metadata_lock
+
     # Not casting folder_path to Path type so that we can search for target_dir_name too
     library = Library(library_folder)
-    folder = library.find_folder(folder_path)
+    folders: list[Folder] = []
+    for folder_path in get_search_terms(folder_paths, from_file):
+        found = library.find_folders(folder_path)
+        if not found:
+            raise ClickException(f"Cannot find folder information: {folder_path}.")
+        folders.extend(folder for folder in found if folder not in folders)
 
-    if not folder:
-        raise ClickException(f"Cannot find folder information: {folder_path}.")
-    if not folder.get_library_subdir(library).exists():
-        library.remove_folder(folder)
-        library.save()
+    if not dry_run:
+        for folder in folders:
+            lock_folder(library, folder)
+        # Another process may have moved the folder before it was locked
+        folders = [get_locked_folder(library, folder) for folder in folders]
+    raise_if_not_journaled(library, folders)
+    missing = [
+        folder
+        for folder in folders
+        if not folder.get_library_data_path(library).exists()
+    ]
+    if missing:
+        with metadata_lock(library.library_folder):
+            for folder in missing:
+                library.remove_folder(folder)
+            library.save()
+            for folder in missing:
+                library.update_size_index(folder)
         raise ClickException(
-            f"{folder.get_library_subdir(library)} does not exist. Removed from folder list."
+            f"{', '.join(str(folder.get_library_data_path(library)) for folder in missing)} "
+            "does not exist. Removed from folder list."
         )
 
-    msg = f"[bold]Remove folder {style_path(folder.source_dir)} with name {style_path(folder.short_name)} from {style_library(library)}[/bold]"
-    print_(msg)
-    actions = RemoveFolderActions(folder, library, dry_run, dont_copy_permissions)
-    actions.run()
+    if keep_warm and (
+        compressed := [folder for folder in folders if folder.is_compressed]
+    ):
+        raise ClickException(
+            f"Cannot keep a warm copy of compressed folder {compressed[0].source_dir}."
+        )
+    if warm_folders := [folder for folder in folders if folder.is_warm]:
+        delete_warm_copies(library, warm_folders, dry_run)
+        folders = [folder for folder in folders if not folder.is_warm]
+        if not folders:
+            return
+
+    copy_engine = get_engine(engine, threads, max_rate, background)
+    batch = []
+    for folder in folders:
+        print_(
+            f"[bold]Remove folder {style_path(folder.source_dir)} with name {style_path(folder.short_name)} from {style_library(library)}[/bold]"
+        )
+        batch.append(
+            RemoveFolderActions(
+                folder,
+                library,
+                dry_run,
+                dont_copy_permissions,
+                copy_engine,
+                verify,
+                recheck=recheck,
+                defer_delete=defer_delete,
+                keep_warm=keep_warm,
+            )
+        )
+    succeeded = run_batch(batch)
+    save_results(library_folder, batch, succeeded, dry_run)
+
+
+@cli.command(no_args_is_help=True)
+@library_folder_option
+@dry_run_option
+@timings_options
+@verify_option
+@recheck_option
+@defer_delete_option
+@click.argument("folder-paths", nargs=-1)
+@from_file_option
+def compress(
+    folder_paths: tuple[str, ...],
+    from_file: Optional[TextIO],
+    library_folder: Path,
+    dry_run: bool,
+    verify: str,
+    recheck: bool,
+    defer_delete: bool,
+):
+    """
+    Compress FOLDER_PATHS in library, to save space
+
+    Data is moved to an archive in the library and the symlink is deleted, so the folder can't be used until it is restored by rob remove. This suits folders that won't be used for a long time. NTFS permissions are not kept.
+
+    You can also select a folder by providing its ID or Name. Paths and Names can include wildcards, e.g. "C:\\Games\\*".
+    """
+    from rob.actions import CompressFolderActions, run_batch
+    from rob.folders import Library
+
+    library = Library(library_folder)
+    folders: list[Folder] = []
+    for folder_path in get_search_terms(folder_paths, from_file):
+        found = library.find_folders(folder_path)
+        if not found:
+            raise ClickException(f"Cannot find folder information: {folder_path}.")
+        folders.extend(folder for folder in found if folder not in folders)
 
     if not dry_run:
-        # Load library again in case it has been updated by another process
-        library = Library(library_folder)
-        library.remove_folder(folder)
-        library.save()
-        print_success("\n" + msg)
-        print_(f"Data is now at {style_path(folder.source_dir)}")
-        print_(f"{style_path(folder.source_dir)} is [bold]not[/bold] a symlink")
+        for folder in folders:
+            lock_folder(library, folder)
+        folders = [get_locked_folder(library, folder) for folder in folders]
+    raise_if_not_journaled(library, folders)
+    for folder in folders:
+        if folder.state != "active":
+            raise ClickException(
+                f"Cannot compress {folder.source_dir}. It is {folder.state}."
+            )
+
+    batch = []
+    for folder in folders:
+        print_(
+            f"[bold]Compress folder {style_path(folder.source_dir)} in {style_library(library)}[/bold]"
+        )
+        batch.append(
+            CompressFolderActions(
+                folder,
+                library,
+                dry_run,
+                # Not kept in archives
+                dont_copy_permissions=True,
+                copy_engine=get_copy_engine(get_default_engine_name()),
+                verify=verify,
+                recheck=recheck,
+                defer_delete=defer_delete,
+            )
+        )
+    succeeded = run_batch(batch)
+    save_results(library_folder, batch, succeeded, dry_run)
+
+
+def delete_warm_copies(library: Library, folders: list[Folder], dry_run: bool) -> None:
+    from rob.locks import metadata_lock
+
+    for folder in folders:
+        print_(
+            f"[bold]Delete warm copy of folder {style_path(folder.source_dir)} from {style_library(library)}[/bold]"
+        )
+    confirm_action(dry_run)
+    print_("")
+    for folder in folders:
+        delete_folder(folder.get_library_subdir(library), dry_run=dry_run)
+    if not dry_run:
+        with metadata_lock(library.library_folder):
+            for folder in folders:
+                library.remove_folder(folder)
+            library.save()
+            for folder in folders:
+                library.update_size_index(folder)
+    print_("")
+
+
+@cli.command()
+@library_folder_option
+@copy_engine_options
+@timings_options
+@click.argument("folder-paths", nargs=-1)
+def resume(
+    folder_paths: tuple[str, ...],
+    library_folder: Path,
+    engine: str,
+    threads: Optional[int],
+    max_rate: Optional[float],
+    background: bool,
+):
+    """
+    Finish interrupted add and remove commands
+
+    Steps that were completed are not run again, and data that was already copied is not copied again.
+
+    Provide FOLDER_PATHS or Names to resume only some folders. Options of the original command are used, apart from --engine and --threads.
+    """
+    from rob.actions import get_journal_actions, run_batch
+    from rob.folders import Library
+    from rob.journal import get_journals
+
+    library = Library(library_folder)
+    journals = get_journals(library)
+    if folder_paths:
+        journals = [
+            journal
+            for journal in journals
+            if str(journal.folder.source_dir) in folder_paths
+            or journal.folder.short_name in folder_paths
+        ]
+    for journal in journals:
+        lock_folder(library, journal.folder)
+    # Another process may have finished the command before the folder was locked
+    journals = [journal for journal in journals if journal.path.exists()]
+    if not journals:
+        print_("Nothing to resume")
+        return
+
+    copy_engine = get_engine(engine, threads, max_rate, background)
+    batch = []
+    for journal in journals:
+        print_(
+            f"[bold]Resume {journal.operation} of folder {style_path(journal.folder.source_dir)}[/bold]"
+        )
+        if journal.steps_done:
+            print_(f"Steps done: {', '.join(journal.steps_done)}")
+        batch.append(get_journal_actions(journal, copy_engine))
+    succeeded = run_batch(batch)
+    save_results(library_folder, batch, succeeded, dry_run=False)
+
+
+@cli.command()
+@library_folder_option
+@dry_run_option
+@dont_copy_permissions_option
+@copy_engine_options
+@timings_options
+@verify_option
+@recheck_option
+@defer_delete_option
+@click.option(
+    "--free",
+    "free_gb",
+    required=True,
+    type=click.FloatRange(min=0),
+    help="Free space wanted on the drive, in GB.",
+)
+@click.option(
+    "--keep-hot",
+    multiple=True,
+    help="A folder that should stay on the drive, by path, ID or Name. Can include wildcards and be used more than once.",
+)
+@click.option(
+    "--drive",
+    help="The drive to free space on. By default, the drive of the folders is used.",
+)
+@click.option(
+    "-y",
+    "--yes",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Do not ask for confirmation.",
+)
+@click.argument("folder-paths", nargs=-1)
+@from_file_option
+def rebalance(
+    folder_paths: tuple[str, ...],
+    from_file: Optional[TextIO],
+    library_folder: Path,
+    dry_run: bool,
+    dont_copy_permissions: bool,
+    engine: str,
+    threads: Optional[int],
+    max_rate: Optional[float],
+    background: bool,
+    verify: str,
+    recheck: bool,
+    defer_delete: bool,
+    free_gb: float,
+    keep_hot: tuple[str, ...],
+    drive: Optional[str],
+    yes: bool,
+):
+    """
+    Add or remove folders to reach a free space goal
+
+    FOLDER_PATHS are folders that may be added to library, e.g. "C:\\Games\\*". Warm folders are also used. Folders are chosen so that as little data as possible is moved, preferring those that have not been used for longest.
+
+    Folders in library that match --keep-hot are removed from library.
+    """
+    from rob.actions import AddFolderActions, RemoveFolderActions, run_batch
+    from rob.folders import Library
+    from rob.rebalance import (
+        Candidate,
+        get_fast_drive,
+        make_plan,
+        print_plan,
+        scan_candidate,
+    )
+
+    library = Library(library_folder)
+    # Search by ID and Name, as well as path
+    hot_matches = [folder for term in keep_hot for folder in library.find_folders(term)]
+
+    def is_hot(folder: Folder) -> bool:
+        return folder in hot_matches or any(
+            fnmatch(str(folder.source_dir), term)
+            or fnmatch(str(folder.source_dir), os.path.abspath(term))
+            for term in keep_hot
+        )
+
+    folders: list[Folder] = []
+    if folder_paths or from_file:
+        for folder_path in get_search_terms(folder_paths, from_file, expand_paths=True):
+            # Wildcards can match folders that are already in library
+            if Path(folder_path).is_symlink() or not Path(folder_path).is_dir():
+                continue
+            folders.append(
+                get_folder_to_add(
+                    Path(folder_path), library, folders, False, lock=not dry_run
+                )
+            )
+    folders += [
+        folder
+        for folder in library.folders
+        if folder.is_warm and folder.source_dir.exists() and folder not in folders
+    ]
+    hot_folders = [
+        folder for folder in library.folders if not folder.is_warm and is_hot(folder)
+    ]
+
+    drive = drive or get_fast_drive(
+        [folder.source_dir for folder in folders + hot_folders]
+    )
+    if not drive:
+        raise ClickException(
+            "Folders are on more than one drive, or no folders were found. Use --drive to choose one."
+        )
+    if not dry_run:
+        for folder in folders + hot_folders:
+            lock_folder(library, folder)
+    raise_if_not_journaled(library, folders + hot_folders)
+
+    print_(f"[bold]Rebalance drive {style_path(drive)}[/bold]")
+    candidates = [
+        scan_candidate(folder)
+        for folder in folders
+        if get_volume(folder.source_dir) == drive and not is_hot(folder)
+    ]
+    keep_hot_candidates = [
+        Candidate(folder, folder.get_library_data_stats(library))
+        for folder in hot_folders
+        if get_volume(folder.source_dir) == drive
+    ]
+    plan = make_plan(
+        library, drive, round(free_gb * 1024**3), candidates, keep_hot_candidates
+    )
+    print_plan(plan, library)
+    if dry_run:
+        print_success("\nDry run result:")
+        return
+    if not plan.to_library and not plan.to_drive:
+        return
+    if not yes:
+        confirm_action(dry_run)
+
+    copy_engine = get_engine(engine, threads, max_rate, background)
+    # Free space first, in case folders that are kept hot need it
+    if plan.to_library:
+        batch: list[FilestoreActions] = [
+            AddFolderActions(
+                candidate.folder,
+                library,
+                dry_run,
+                dont_copy_permissions,
+                copy_engine,
+                verify,
+                recheck=recheck,
+                defer_delete=defer_delete,
+            )
+            for candidate in plan.to_library
+        ]
+        save_results(library_folder, batch, run_batch(batch, confirm=False), dry_run)
+    if plan.to_drive:
+        batch = [
+            RemoveFolderActions(
+                candidate.folder,
+                library,
+                dry_run,
+                dont_copy_permissions,
+                copy_engine,
+                verify,
+                recheck=recheck,
+                defer_delete=defer_delete,
+            )
+            for candidate in plan.to_drive
+        ]
+        save_results(library_folder, batch, run_batch(batch, confirm=False), dry_run)
+
+
+@cli.command()
+@library_folder_option
+@click.option(
+    "--size",
+    "size_mb",
+    default=DEFAULT_BENCH_MB,
+    show_default=True,
+    type=click.IntRange(min=16),
+    help="Size of test data written to each drive, in MB. Larger tests are more accurate.",
+)
+@click.argument("folder-paths", nargs=-1)
+def bench(folder_paths: tuple[str, ...], library_folder: Path, size_mb: int):
+    """
+    Measure speed of the library drive and drives of folders
+
+    The number of threads and buffer size that suit each drive are used by add, remove and rebalance, unless --threads is used.
+
+    FOLDER_PATHS are folders on other drives to measure. Drives of folders in the library are measured by default.
+    """
+    from rob.bench import bench_volume, get_bench_folders
+    from rob.folders import Library
+
+    library = Library(library_folder)
+    bench_folders = get_bench_folders(
+        library, [Path(folder_path).resolve() for folder_path in folder_paths]
+    )
+    for volume, folder in bench_folders.items():
+        print_(f"\n[bold]Measure drive {style_path(volume)}[/bold]")
+        profile = bench_volume(volume, folder, size_mb * 1024**2)
+        library.save_volume_profile(profile.to_row())
+        library.connection.commit()
+    print_success("\nSaved copy settings for each drive")
+
+
+@cli.command()
+@library_folder_option
+@dry_run_option
+@click.option(
+    "--wait",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Wait for another rob gc to finish, instead of stopping.",
+)
+def gc(library_folder: Path, dry_run: bool, wait: bool):
+    """
+    Delete data in trash
+
+    Data is moved to trash by commands with --defer-delete, and deleted in the background. Use this command if that was interrupted.
+    """
+    from rob.folders import Library
+    from rob.locks import gc_lock
+    from rob.trash import empty_trash
+
+    with gc_lock(library_folder, wait):
+        count = empty_trash(Library(library_folder), dry_run)
+    if not count:
+        print_("Trash is empty")
+
+
+@cli.command()
+@library_folder_option
+@dry_run_option
+@click.option(
+    "--hard-links",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Use hard links where the drive can't clone files, e.g. NTFS. A change to one copy of a file then changes all of them.",
+)
+def dedupe(library_folder: Path, dry_run: bool, hard_links: bool):
+    """
+    Share data of identical files in different folders of the library
+
+    Files are cloned where the drive supports it, e.g. ReFS, btrfs or XFS, so each folder can still change its own copy. Folders that are added later are deduplicated by rob add. Data is separated again by rob remove.
+    """
+    from rob.dedupe import dedupe as dedupe_library
+    from rob.dedupe import get_dedupe_folders, print_stats
+    from rob.folders import Library
+    from rob.locks import dedupe_lock
+
+    library = Library(library_folder)
+    folders = get_dedupe_folders(library)
+    if not dry_run:
+        for folder in folders:
+            lock_folder(library, folder)
+    raise_if_not_journaled(library, folders)
+    with dedupe_lock(library_folder):
+        stats = dedupe_library(library, hard_links=hard_links, dry_run=dry_run)
+    print_stats(stats, hard_links, dry_run)
+    if dry_run:
+        print_success("\nDry run result:")
+
+
+@cli.command()
+@library_folder_option
+@click.option(
+    "--debounce",
+    default=DEFAULT_DEBOUNCE_SECONDS,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds without changes before sizes are updated, so that many changes cause one update.",
+)
+@click.option(
+    "--poll",
+    "poll_interval",
+    type=click.FloatRange(min=1),
+    help="Check all folders every POLL seconds, instead of being notified of changes. Used if notifications aren't supported.",
+)
+def watch(library_folder: Path, debounce: float, poll_interval: Optional[float]):
+    """
+    Keep folder sizes and symlink health up to date, until stopped with Ctrl+C
+
+    While this runs, rob list shows sizes without scanning folders, and folders with a missing symlink or missing data. Changes are found by inotify on Linux. Other platforms check all folders every minute.
+    """
+    from rob.locks import watch_lock
+    from rob.watch import watch as watch_library
+
+    with watch_lock(library_folder):
+        try:
+            watch_library(library_folder, debounce, poll_interval)
+        except KeyboardInterrupt:
+            print_("Stopped watching")
+
+
+def get_search_terms(
+    args: tuple[str, ...], from_file: Optional[TextIO], expand_paths: bool = False
+) -> list[str]:
+    """
+    Combine command line arguments with lines of `from_file`
+
+    If `expand_paths`, wildcards are replaced by matching paths.
+    """
+    terms = list(args)
+    if from_file:
+        terms += [line.strip() for line in from_file if line.strip()]
+    if not terms:
+        raise click.UsageError("No folders provided.")
+    if not expand_paths:
+        return terms
+    results = []
+    for term in terms:
+        # Check path exists first, as folder names can include [ and ]
+        if glob.has_magic(term) and not Path(term).exists():  # type: ignore
+            matches = sorted(glob.glob(term))
+            if not matches:
+                raise ClickException(f"No folders match {term}.")
+            results += matches
+        else:
+            results.append(term)
+    return results
+
+
+def lock_folder(library: Library, folder: Folder) -> None:
+    """Hold a lock on `folder` until the command ends. See `folder_lock()`."""
+    from rob.locks import folder_lock
+
+    ctx = click.get_current_context()
+    locked: set[str] = ctx.meta.setdefault("locked_folders", set())
+    if folder.short_name not in locked:
+        ctx.with_resource(folder_lock(library.library_folder, folder.short_name))
+        locked.add(folder.short_name)
+
+
+def get_locked_folder(library: Library, folder: Folder) -> Folder:
+    """Read `folder` again after it has been locked"""
+    if found := library.get_folder(folder.source_dir):
+        return found
+    raise ClickException(f"{folder.source_dir} was removed by another rob process.")
+
+
+def raise_if_not_journaled(library: Library, folders: list[Folder]) -> None:
+    """Don't start a new command on a folder while an earlier one is unfinished"""
+    from rob.journal import find_journal
+
+    for folder in folders:
+        if journal := find_journal(library, folder):
+            raise ClickException(
+                f"The {journal.operation} command for {folder.source_dir} was interrupted. "
+                "Run rob resume to finish it."
+            )
+
+
+def save_results(
+    library_folder: Path,
+    batch: list[FilestoreActions],
+    succeeded: list[FilestoreActions],
+    dry_run: bool,
+) -> None:
+    """Update library with folders that were moved and report results"""
+    from rob.folders import Library
+    from rob.locks import metadata_lock
+
+    if not dry_run:
+        with metadata_lock(library_folder), rob.timings.phase("save"):
+            # Load library again in case it has been updated by another process
+            library = Library(library_folder)
+            for actions in succeeded:
+                actions.update_library(library)
+                library.add_history(
+                    actions.folder, actions.operation, actions.copy_bytes
+                )
+            library.save()
+            for actions in succeeded:
+                actions.complete()
+                with rob.timings.phase("size_index", actions.folder.short_name):
+                    library.update_size_index(actions.folder)
+        for actions in succeeded:
+            actions.print_result()
+        if added := [
+            actions.folder for actions in succeeded if actions.operation == "add"
+        ]:
+            dedupe_added(library_folder, added)
+        if any(actions.defer_delete for actions in batch):
+            from rob.trash import start_background_gc
+
+            print_(
+                "\nDeleting old data in the background. If it is interrupted, run [bold]rob gc[/bold]."
+            )
+            start_background_gc(library_folder)
     else:
         print_success("\nDry run result:")
+    raise_if_failed(batch, succeeded)
+
+
+def dedupe_added(library_folder: Path, folders: list[Folder]) -> None:
+    """Clone files of `folders` that are in other folders, if rob dedupe has been run"""
+    from rob.dedupe import dedupe, print_stats
+    from rob.folders import Library
+    from rob.locks import dedupe_lock
+
+    library = Library(library_folder)
+    if not library.has_content_index():
+        return
+    print_("\n[bold]Deduplicate files[/bold]")
+    try:
+        with dedupe_lock(library_folder):
+            stats = dedupe(library, folders=folders)
+    except ClickException as e:
+        # Not needed for the folders to be moved, so not an error
+        print_(f"[yellow]{e.message}. Run rob dedupe later.[/yellow]")
+        return
+    print_stats(stats, hard_links=False, dry_run=False)
+
+
+def raise_if_failed(batch: list[FilestoreActions], succeeded: list[FilestoreActions]):
+    if failed := [actions for actions in batch if actions not in succeeded]:
+        names = ", ".join(str(actions.folder.source_dir) for actions in failed)
+        raise ClickException(f"Some folders could not be moved: {names}")
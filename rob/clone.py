@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import errno
+import os
+import sys
+import threading
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import BinaryIO, ClassVar
+
+from rob.engines import CopyStats, NativeEngine, ProgressCallback
+
+FICLONE = 0x40049409
+"Linux ioctl that clones a whole file, e.g. on btrfs and XFS"
+FSCTL_DUPLICATE_EXTENTS_TO_FILE = 0x00098344
+"Windows block cloning, e.g. on ReFS and Dev Drives"
+WINDOWS_CLONE_CHUNK_BYTES = 1024**3
+"Each call must clone less than 4 GB"
+
+# Errors that mean the filesystem can't clone this pair of files
+_CLONE_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+}
+_CLONE_UNSUPPORTED_WINERRORS = {
+    1,  # ERROR_INVALID_FUNCTION, e.g. on NTFS
+    17,  # ERROR_NOT_SAME_DEVICE
+    50,  # ERROR_NOT_SUPPORTED
+    87,  # ERROR_INVALID_PARAMETER
+    347,  # ERROR_BLOCK_TOO_MANY_REFERENCES
+}
+# Errors that mean no files can be cloned between the pair of volumes. Others, e.g.
+# EINVAL, can be caused by one file.
+_VOLUME_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY}
+_VOLUME_UNSUPPORTED_WINERRORS = {1, 17, 50}
+
+_volume_support: dict[tuple[int, int], bool] = {}
+"Whether cloning works between a pair of `st_dev`, once it has been tried"
+
+
+@dataclass
+class CloneEngine(NativeEngine):
+    """
+    Clone files where the filesystem supports copy-on-write, e.g. btrfs, XFS or ReFS
+
+    A clone shares data with the original file until either is changed, so it is
+    almost instant and uses no extra space. Support is detected for each pair of
+    volumes, which can differ, e.g. subvolumes of btrfs. Files that can't be
+    cloned are copied by `NativeEngine`.
+    """
+
+    name: ClassVar = "clone"
+
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+    _files_cloned: int = field(default=0, init=False, repr=False)
+    _bytes_cloned: int = field(default=0, init=False, repr=False)
+
+    def copy_tree(
+        self,
+        source: Path,
+        target: Path,
+        copy_permissions: bool,
+        progress: ProgressCallback,
+        incremental: bool,
+    ) -> CopyStats:
+        # A new instance counts clones of this tree only, as folders on different
+        # disks are copied at the same time
+        engine = replace(self)
+        stats = NativeEngine.copy_tree(
+            engine, source, target, copy_permissions, progress, incremental
+        )
+        stats.files_cloned = engine._files_cloned
+        stats.bytes_cloned = engine._bytes_cloned
+        return stats
+
+    def copy_data(
+        self, fsrc: BinaryIO, fdst: BinaryIO, progress: ProgressCallback
+    ) -> int:
+        volumes = (os.fstat(fsrc.fileno()).st_dev, os.fstat(fdst.fileno()).st_dev)
+        if _volume_support.get(volumes) is not False:
+            try:
+                cloned = clone_file(fsrc, fdst)
+            except OSError as e:
+                if not is_clone_unsupported(e):
+                    raise
+                # Some files can fail on volumes that support cloning, e.g. if a
+                # block has too many clones
+                if is_volume_unsupported(e):
+                    _volume_support.setdefault(volumes, False)
+                fdst.seek(0)
+                fdst.truncate()
+            else:
+                _volume_support[volumes] = True
+                progress(cloned)
+                with self._lock:
+                    self._files_cloned += 1
+                    self._bytes_cloned += cloned
+                return cloned
+        return super().copy_data(fsrc, fdst, progress)
+
+
+def clone_file(fsrc: BinaryIO, fdst: BinaryIO) -> int:
+    """Clone all data from `fsrc` to `fdst`. Return number of bytes cloned."""
+    size = os.fstat(fsrc.fileno()).st_size
+    if os.name == "nt":
+        _clone_file_windows(fsrc, fdst, size)
+    elif sys.platform == "linux":
+        # pylint: disable=import-outside-toplevel
+        import fcntl
+
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    else:
+        raise OSError(errno.EOPNOTSUPP, "Cloning is not supported on this platform")
+    return size
+
+
+def is_clone_unsupported(error: OSError) -> bool:
+    return (
+        error.errno in _CLONE_UNSUPPORTED
+        or getattr(error, "winerror", None) in _CLONE_UNSUPPORTED_WINERRORS
+    )
+
+
+def is_volume_unsupported(error: OSError) -> bool:
+    """Whether `error` from `clone_file()` means that no files can be cloned"""
+    return (
+        error.errno in _VOLUME_UNSUPPORTED
+        or getattr(error, "winerror", None) in _VOLUME_UNSUPPORTED_WINERRORS
+    )
+
+
+def _clone_file_windows(fsrc: BinaryIO, fdst: BinaryIO, size: int) -> None:
+    # pylint: disable=import-outside-toplevel
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+
+    class DuplicateExtentsData(ctypes.Structure):
+        _fields_ = [
+            ("FileHandle", wintypes.HANDLE),
+            ("SourceFileOffset", ctypes.c_longlong),
+            ("TargetFileOffset", ctypes.c_longlong),
+            ("ByteCount", ctypes.c_longlong),
+        ]
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    # The target must be as large as the source before blocks are cloned into it
+    fdst.truncate(size)
+    fdst.flush()
+    cluster_size = _get_cluster_size(fdst.name)
+    source_handle = msvcrt.get_osfhandle(fsrc.fileno())
+    target_handle = msvcrt.get_osfhandle(fdst.fileno())
+    returned = wintypes.DWORD()
+    offset = 0
+    while offset < size:
+        # Offsets must be multiples of the cluster size. The last chunk can be
+        # rounded up past the end of the file.
+        count = min(WINDOWS_CLONE_CHUNK_BYTES, size - offset)
+        count = -(-count // cluster_size) * cluster_size
+        data = DuplicateExtentsData(source_handle, offset, offset, count)
+        if not kernel32.DeviceIoControl(
+            wintypes.HANDLE(target_handle),
+            FSCTL_DUPLICATE_EXTENTS_TO_FILE,
+            ctypes.byref(data),
+            ctypes.sizeof(data),
+            None,
+            0,
+            ctypes.byref(returned),
+            None,
+        ):
+            raise ctypes.WinError(ctypes.get_last_error())
+        offset += count
+
+
+def _get_cluster_size(path: str) -> int:
+    # pylint: disable=import-outside-toplevel
+    import ctypes
+    from ctypes import wintypes
+
+    sectors_per_cluster = wintypes.DWORD()
+    bytes_per_sector = wintypes.DWORD()
+    free_clusters = wintypes.DWORD()
+    total_clusters = wintypes.DWORD()
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    root = os.path.splitdrive(os.path.abspath(path))[0] + "\\"
+    if not kernel32.GetDiskFreeSpaceW(
+        root,
+        ctypes.byref(sectors_per_cluster),
+        ctypes.byref(bytes_per_sector),
+        ctypes.byref(free_clusters),
+        ctypes.byref(total_clusters),
+    ):
+        raise ctypes.WinError(ctypes.get_last_error())
+    return sectors_per_cluster.value * bytes_per_sector.value
@@ -1,32 +1,145 @@
-from pathlib import WindowsPath
-from typing import Union
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, Union
 
 import click
-from rich import box
-from rich.console import Console
-from rich.table import Table
 
-import rob.filesystem
 from rob import PROJECT_NAME, VERSION
-from rob.folders import Library
+
+if TYPE_CHECKING:
+    # Only imported for type hints, to avoid circular imports and the cost of
+    # importing rich on commands that don't print
+    from rich.console import Console
+    from rich.progress import Progress
+    from rich.table import Table
+
+    from rob.filesystem import DiskUsage
+    from rob.folders import Library
+    from rob.timings import Span
 
 # click.termui._ansi_colors
 HELP_HEADERS_COLOR = "bright_white"
 HELP_OPTIONS_COLOR = "cyan"
 
-# https://rich.readthedocs.io/en/stable/appendix/colors.html#appendix-colors
-console = Console(highlight=False)
-print_ = console.print
+_console: Optional[Console] = None
+"Created by `get_console()` when something is first printed"
+_quiet = False
+"Set by `quiet()`"
+
+# Set by `print_title_later()`
+_title_pending = False
+
+# Output of jobs that run at the same time is prefixed with the job name
+_job = threading.local()
+
+# One live display is shared by all progress bars, as rich only allows one at a time
+_progress: Optional[Progress] = None
+_progress_users = 0
+_progress_lock = threading.Lock()
+
+
+def get_console() -> Console:
+    global _console  # pylint: disable=global-statement
+    if _console is None:
+        # pylint: disable=import-outside-toplevel
+        from rich.console import Console
+
+        # https://rich.readthedocs.io/en/stable/appendix/colors.html#appendix-colors
+        _console = Console(highlight=False)
+    return _console
+
+
+def quiet() -> None:
+    """Don't print anything, e.g. so that stdout can be read by other programs"""
+    global _quiet  # pylint: disable=global-statement
+    _quiet = True
+
+
+def _make_table() -> Table:
+    # pylint: disable=import-outside-toplevel
+    from rich import box
+    from rich.table import Table
+
+    return Table(row_styles=["cyan", "sky_blue1"], show_edge=False, box=box.SQUARE)
+
+
+def print_(*objects, sep=" ", end="\n", **kwargs) -> None:
+    """
+    Same as `console.print`
+
+    In a thread started by `job_output()`, lines are prefixed with the job name and
+    are only printed when complete, so that output of different jobs isn't mixed up.
+    """
+    global _title_pending  # pylint: disable=global-statement
+    if _quiet:
+        return
+    if _title_pending:
+        _title_pending = False
+        print_title()
+    captured = getattr(_job, "captured", None)
+    if captured is not None:
+        captured.append(sep.join(str(obj) for obj in objects) + end)
+        return
+    prefix = getattr(_job, "prefix", None)
+    if prefix is None:
+        get_console().print(*objects, sep=sep, end=end, **kwargs)
+        return
+    _job.line += sep.join(str(obj) for obj in objects) + end
+    if _job.line.endswith("\n"):
+        for line in _job.line.splitlines():
+            get_console().print(prefix + line if line else "", **kwargs)
+        _job.line = ""
+
+
+@contextmanager
+def job_output(name: str) -> Iterator[None]:
+    """Prefix output of this thread with `name`"""
+    _job.name = name
+    _job.prefix = f"[grey50]{name}:[/grey50] "
+    _job.line = ""
+    try:
+        yield
+    finally:
+        if _job.line:
+            print_()
+        _job.name = _job.prefix = None
+
+
+@contextmanager
+def captured_output() -> Iterator[list[str]]:
+    """
+    Keep output of this thread in a list instead of printing it
+
+    Used to print output of threads in order, with `print_captured()`.
+    """
+    _job.captured = []
+    try:
+        yield _job.captured
+    finally:
+        _job.captured = None
+
+
+def print_captured(captured: list[str]) -> None:
+    for text in captured:
+        print_(text, end="")
 
 
-def print_library_info(library: Library, show_size: bool = False) -> None:
+def print_library_info(
+    library: Library, show_size: bool = False, refresh: bool = False
+) -> None:
     print_("")
     disk_usage = library.disk_usage
     for disk in disk_usage:
         print_disk_usage(disk)
     print_("")
     print_library_folder_count(library)
-    table_data = library.get_table_data(show_size=show_size)
+    table_data = library.get_table_data(show_size=show_size, refresh=refresh)
     if table_data:
         print_("")
         if show_size:
@@ -38,7 +151,68 @@ def print_library_info(library: Library, show_size: bool = False) -> None:
             print_("\nRun [bold]rob list[/bold] to see size of folders.")
 
 
-def print_disk_usage(disk: rob.filesystem.DiskUsage) -> None:
+def print_library_json(
+    library: Library, refresh: bool = False, ndjson: bool = False
+) -> None:
+    """
+    Print library info as JSON to stdout. Folders are printed as soon as their size
+    is known, so they are not in order of ID.
+
+    If `ndjson`, each disk and folder is a separate JSON document on its own line.
+    """
+    disks = [
+        {
+            "type": "disk",
+            "drive": disk.drive,
+            "total_bytes": disk.usage.total,
+            "used_bytes": disk.usage.used,
+            "free_bytes": disk.usage.free,
+        }
+        for disk in library.disk_usage
+    ]
+    if ndjson:
+        for disk in disks:
+            print_json(disk)
+    else:
+        sys.stdout.write(
+            f'{{"library": {json.dumps(str(library.library_folder))}, '
+            f'"disks": {json.dumps(disks)},\n"folders": [\n'
+        )
+    total_bytes = 0
+    count = 0
+    for folder, stats in library.iter_folder_stats(refresh):
+        row = {
+            "type": "folder",
+            "id": folder.id,
+            "path": str(folder.source_dir),
+            "name": folder.short_name,
+            "state": folder.state,
+            "bytes": stats.apparent_bytes,
+            "allocated_bytes": stats.allocated_bytes,
+            "files": stats.files,
+            "dirs": stats.dirs,
+        }
+        if folder.is_compressed:
+            row["compressed_bytes"] = folder.compressed_bytes
+        if library.is_watched:
+            row["health"] = folder.health
+        if ndjson:
+            print_json(row)
+        else:
+            sys.stdout.write(",\n" if count else "")
+            sys.stdout.write(json.dumps(row))
+            sys.stdout.flush()
+        total_bytes += stats.apparent_bytes
+        count += 1
+    summary = {"type": "total", "folders": count, "bytes": total_bytes}
+    if ndjson:
+        print_json(summary)
+    else:
+        sys.stdout.write(f'\n],\n"total": {json.dumps(summary)}}}\n')
+        sys.stdout.flush()
+
+
+def print_disk_usage(disk: DiskUsage) -> None:
     print_(
         f"Drive {style_path(disk.drive)} "
         f"{style_bytes_as_gb((disk.usage.used),ndigits=None)} used / "
@@ -53,20 +227,112 @@ def print_library_folder_count(library: Library) -> None:
 
 
 def print_library_table(table_data: list[dict], show_size: bool = False) -> None:
-    table = Table(row_styles=["cyan", "sky_blue1"], show_edge=False, box=box.SQUARE)
+    table = _make_table()
     table.add_column("ID", overflow="ellipsis")
     table.add_column("Path", overflow="ellipsis")
     table.add_column("Name", overflow="fold")
+    table.add_column("State")
     if show_size:
         for row in table_data:
             row["Size"] = style_bytes_as_gb(row["Size"])
+            row["Files"] = f"{row['Files']:,}"
         table.add_column("Size", justify="right")
+        table.add_column("Files", justify="right")
     for row in table_data:
         values = (str(value) for value in row.values())
         table.add_row(*values)
     print_(table)
 
 
+def print_history_table(rows: list) -> None:
+    """`rows` from `Library.get_history()`"""
+    if not rows:
+        print_("No operations yet")
+        return
+    table = _make_table()
+    table.add_column("Time")
+    table.add_column("Operation")
+    table.add_column("Path", overflow="ellipsis")
+    table.add_column("Data moved", justify="right")
+    for row in rows:
+        table.add_row(
+            datetime.fromtimestamp(row["at"]).strftime("%Y-%m-%d %H:%M"),
+            row["operation"],
+            row["source_dir"],
+            style_bytes_as_gb(row["bytes"] or 0),
+        )
+    print_(table)
+
+
+def print_timings_table(spans: list[Span]) -> None:
+    if not spans:
+        return
+    table = _make_table()
+    table.add_column("Phase")
+    table.add_column("Name", overflow="fold")
+    table.add_column("Time", justify="right")
+    table.add_column("Data", justify="right")
+    table.add_column("Files", justify="right")
+    table.add_column("Speed", justify="right")
+    for span in spans:
+        table.add_row(
+            span.name,
+            span.folder,
+            f"{span.seconds:.3f}s",
+            style_bytes_as_gb(span.bytes_, ndigits=2) if span.bytes_ else "",
+            f"{span.files:,}" if span.files else "",
+            style_bytes_per_second(span.bytes_per_second) if span.bytes_ else "",
+        )
+    print_("\n[bold]Timings[/bold]")
+    print_(table)
+
+
+@contextmanager
+def progress_bar(description: str, total: int) -> Iterator[Callable[[int], None]]:
+    """
+    Show a progress bar with throughput and time remaining
+
+    Yields a function that advances the bar by a number of bytes. It is thread safe.
+    """
+    # pylint: disable=import-outside-toplevel
+    from rich.progress import (
+        BarColumn,
+        DownloadColumn,
+        Progress,
+        TextColumn,
+        TimeRemainingColumn,
+        TransferSpeedColumn,
+    )
+
+    global _progress, _progress_users  # pylint: disable=global-statement
+    with _progress_lock:
+        if _progress is None:
+            _progress = Progress(
+                TextColumn("[green]{task.description}[/green]"),
+                BarColumn(),
+                DownloadColumn(),
+                TransferSpeedColumn(),
+                TimeRemainingColumn(),
+                console=get_console(),
+                transient=True,
+            )
+            _progress.start()
+        _progress_users += 1
+        progress = _progress
+    if job_name := getattr(_job, "name", None):
+        description = f"{job_name}: {description}"
+    task_id = progress.add_task(description, total=total)
+    try:
+        yield lambda advance: progress.update(task_id, advance=advance)
+    finally:
+        progress.remove_task(task_id)
+        with _progress_lock:
+            _progress_users -= 1
+            if not _progress_users:
+                progress.stop()
+                _progress = None
+
+
 def print_fail(msg: str = "") -> None:
     print_(f"{msg} [bold][red]FAIL[/red][/bold]")
 
@@ -89,6 +355,18 @@ def print_title() -> None:
     )
 
 
+def print_title_later() -> None:
+    """Print the title before the next output, if there is any. See `quiet()`."""
+    global _title_pending  # pylint: disable=global-statement
+    _title_pending = True
+
+
+def print_json(data: object) -> None:
+    """Print a line of JSON to stdout as soon as it is ready"""
+    sys.stdout.write(json.dumps(data, default=str) + "\n")
+    sys.stdout.flush()
+
+
 def style_project() -> str:
     return f"[bold][purple]{PROJECT_NAME}[/purple][/bold]"
 
@@ -98,7 +376,7 @@ def style_library(library: Library) -> str:
     return f"{style_project()} library at [purple]{library_path}[/purple]"
 
 
-def style_path(obj: Union[WindowsPath, str]) -> str:
+def style_path(obj: Union[Path, str]) -> str:
     return f"[cyan]{str(obj)}[/cyan]"
 
 
@@ -107,8 +385,12 @@ def style_bytes_as_gb(size_bytes: int, ndigits=1) -> str:
     return f"{gigabytes} GB"
 
 
+def style_bytes_per_second(bytes_per_second: float) -> str:
+    return f"{round(bytes_per_second / 1024**2)} MB/s"
+
+
 def confirm_action(dry_run: bool) -> None:
     if dry_run:
-        console.rule("[green]DRY RUN MODE[/green]")
+        get_console().rule("[green]DRY RUN MODE[/green]")
         print_("No changes will be made.")
     click.confirm(text="Continue?", abort=True)
@@ -0,0 +1,348 @@
+"""
+Find files with the same content in different folders of the library, and make them
+share their data
+
+Files are grouped by size, then by a hash of their first and last blocks, and only
+then by a hash of all their data, so most files are never read in full. Sizes and
+hashes are kept in the library database, so later runs only read new or changed
+files.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from click import ClickException
+
+import rob.console as con
+from rob import PROJECT_NAME
+from rob.clone import clone_file, is_clone_unsupported
+from rob.folders import Folder, Library
+from rob.manifest import HASH_WORKERS, build_manifest, hash_file
+
+MIN_DEDUPE_BYTES = 64 * 1024
+"Smaller files save too little space to be worth reading"
+PARTIAL_HASH_BYTES = 64 * 1024
+"Read from the start and the end of each file for its partial hash"
+TEMP_SUFFIX = f".{PROJECT_NAME}_dedupe"
+
+
+@dataclass
+class DedupeStats:
+    duplicate_files: int = 0
+    "Files with the same content as another file, that don't share its data yet"
+    duplicate_bytes: int = 0
+    files_cloned: int = 0
+    files_linked: int = 0
+    files_skipped: int = 0
+    "Changed since they were hashed, or locked by another application"
+    bytes_reclaimed: int = 0
+    can_clone: bool = field(default=True, repr=False)
+    "Set to `False` when the filesystem refuses to clone"
+
+
+def get_dedupe_folders(library: Library) -> list[Folder]:
+    """Folders with data in the library. Compressed folders are archives."""
+    return [folder for folder in library.folders if folder.state in ("active", "warm")]
+
+
+def dedupe(
+    library: Library,
+    hard_links: bool = False,
+    folders: Optional[list[Folder]] = None,
+    dry_run: bool = False,
+) -> DedupeStats:
+    """
+    Make duplicate files in the library share data, with clones or, if
+    `hard_links`, hard links. Return what was done.
+
+    If `folders`, only duplicates of their files are handled, e.g. after they have
+    been added. Their files are compared with the index of all folders.
+    """
+    all_folders = get_dedupe_folders(library)
+    update_content_index(library, all_folders if folders is None else folders)
+    subdirs = {
+        folder.short_name: folder.get_library_subdir(library) for folder in all_folders
+    }
+    names = {folder.short_name for folder in folders or all_folders}
+    stats = DedupeStats()
+    for group in find_duplicates(library, subdirs):
+        # Other folders may be in use by another process, so only their files are
+        # kept. `sorted()` is stable.
+        keeper, *duplicates = sorted(group, key=lambda row: row["short_name"] in names)
+        keeper_path = subdirs[keeper["short_name"]].joinpath(keeper["rel_path"])
+        for row in duplicates:
+            if row["short_name"] not in names:
+                continue
+            path = subdirs[row["short_name"]].joinpath(row["rel_path"])
+            if replace_duplicate(
+                keeper_path, keeper, path, row, stats, hard_links, dry_run
+            ):
+                # A hard link has the modified time of `keeper`. Keep its hashes.
+                library.save_content([row | {"mtime_ns": keeper["mtime_ns"]}])
+    if not dry_run:
+        library.save()
+    return stats
+
+
+def update_content_index(library: Library, folders: Iterable[Folder]) -> None:
+    """Add new and changed files of `folders` to the index, without hashes"""
+    for folder in folders:
+        con.print_(f"Scanning {con.style_path(folder.short_name)}", end="")
+        manifest = build_manifest(folder.get_library_subdir(library))
+        indexed = {
+            row["rel_path"]: row for row in library.get_content(folder.short_name)
+        }
+        files = {
+            rel_path: entry
+            for rel_path, entry in manifest.files.items()
+            if not entry.is_symlink and entry.size >= MIN_DEDUPE_BYTES
+        }
+        # Replacing a row clears its hashes
+        library.save_content(
+            [
+                {
+                    "short_name": folder.short_name,
+                    "rel_path": rel_path,
+                    "size": entry.size,
+                    "mtime_ns": entry.mtime_ns,
+                }
+                for rel_path, entry in files.items()
+                if (row := indexed.get(rel_path)) is None
+                or (row["size"], row["mtime_ns"]) != (entry.size, entry.mtime_ns)
+            ]
+        )
+        library.delete_content(
+            folder.short_name,
+            [rel_path for rel_path in indexed if rel_path not in files],
+        )
+        con.print_success()
+
+
+def find_duplicates(library: Library, subdirs: dict[str, Path]) -> list[list[dict]]:
+    """
+    Groups of files in `subdirs` with the same content, by `short_name`. Hashes that
+    are missing from the index are calculated and saved.
+    """
+    rows = [dict(row) for row in library.get_content() if row["short_name"] in subdirs]
+    candidates = _get_groups(rows, lambda row: row["size"])
+    candidates = _hash_missing(
+        library, subdirs, candidates, "partial_hash", hash_file_ends
+    )
+    candidates = _get_groups(candidates, lambda row: (row["size"], row["partial_hash"]))
+    candidates = _hash_missing(library, subdirs, candidates, "hash", hash_file)
+    return [
+        sorted(group, key=lambda row: (row["short_name"], row["rel_path"]))
+        for group in _get_groups_list(
+            candidates, lambda row: (row["size"], row["hash"])
+        )
+    ]
+
+
+def _get_groups_list(
+    rows: Iterable[dict], key: Callable[[dict], object]
+) -> list[list[dict]]:
+    groups = defaultdict(list)
+    for row in rows:
+        groups[key(row)].append(row)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _get_groups(rows: Iterable[dict], key: Callable[[dict], object]) -> list[dict]:
+    """Rows that have the same `key` as another row"""
+    return [row for group in _get_groups_list(rows, key) for row in group]
+
+
+def _hash_missing(
+    library: Library,
+    subdirs: dict[str, Path],
+    rows: list[dict],
+    column: str,
+    hash_function: Callable[[Path], bytes],
+) -> list[dict]:
+    """
+    Hash files of `rows` that don't have a hash in `column` with a pool of threads.
+    Return rows with hashes. Files that can't be read are left out.
+    """
+    missing = [row for row in rows if row[column] is None]
+    if not missing:
+        return rows
+
+    def hash_row(row: dict) -> None:
+        path = subdirs[row["short_name"]].joinpath(row["rel_path"])
+        try:
+            row[column] = hash_function(path)
+        except OSError:
+            return
+        # The partial hash covers all data of small files
+        if column == "partial_hash" and row["size"] <= 2 * PARTIAL_HASH_BYTES:
+            row["hash"] = row["partial_hash"]
+        progress(row["size"])
+
+    description = "Comparing files..." if column == "hash" else "Finding duplicates..."
+    with con.progress_bar(description, sum(row["size"] for row in missing)) as progress:
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+            list(executor.map(hash_row, missing))
+    # The database is only used by the main thread
+    for name in ("partial_hash", "hash"):
+        library.save_content_hashes(
+            name,
+            [
+                (row[name], row["short_name"], row["rel_path"])
+                for row in missing
+                if row[name] is not None
+            ],
+        )
+    return [row for row in rows if row[column] is not None]
+
+
+def hash_file_ends(path: Path) -> bytes:
+    """Hash the first and last `PARTIAL_HASH_BYTES` of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        digest.update(file.read(PARTIAL_HASH_BYTES))
+        size = os.fstat(file.fileno()).st_size
+        if size > PARTIAL_HASH_BYTES:
+            file.seek(max(size - PARTIAL_HASH_BYTES, PARTIAL_HASH_BYTES))
+            digest.update(file.read())
+    return digest.digest()
+
+
+def replace_duplicate(
+    keeper_path: Path,
+    keeper: dict,
+    path: Path,
+    row: dict,
+    stats: DedupeStats,
+    hard_links: bool,
+    dry_run: bool,
+) -> bool:
+    """
+    Replace `path` with a clone of `keeper_path`, or a hard link to it. Files are
+    skipped if they have changed since they were indexed as `keeper` and `row`.
+    Return `True` if `path` was replaced by a hard link.
+    """
+    try:
+        keeper_stat = keeper_path.lstat()
+        path_stat = path.lstat()
+    except OSError:
+        stats.files_skipped += 1
+        return False
+    if (keeper_stat.st_dev, keeper_stat.st_ino) == (path_stat.st_dev, path_stat.st_ino):
+        # Already a hard link
+        return False
+    if not _is_unchanged(keeper_stat, keeper) or not _is_unchanged(path_stat, row):
+        stats.files_skipped += 1
+        return False
+    stats.duplicate_files += 1
+    stats.duplicate_bytes += row["size"]
+    if dry_run or not (stats.can_clone or hard_links):
+        return False
+
+    temp_path = path.with_name(path.name + TEMP_SUFFIX)
+    linked = False
+    try:
+        if stats.can_clone and _clone(keeper_path, path, temp_path, stats):
+            stats.files_cloned += 1
+        elif hard_links:
+            os.link(keeper_path, temp_path)
+            linked = True
+        else:
+            return False
+        os.replace(temp_path, path)
+    except OSError:
+        # e.g. the file is open in another application
+        temp_path.unlink(missing_ok=True)
+        stats.files_skipped += 1
+        return False
+    stats.files_linked += linked
+    # Data of other hard links to `path` is still used
+    if path_stat.st_nlink == 1:
+        stats.bytes_reclaimed += row["size"]
+    return linked
+
+
+def _is_unchanged(file_stat: os.stat_result, row: dict) -> bool:
+    return (file_stat.st_size, file_stat.st_mtime_ns) == (row["size"], row["mtime_ns"])
+
+
+def _clone(keeper: Path, path: Path, temp_path: Path, stats: DedupeStats) -> bool:
+    """Clone `keeper` to `temp_path`, with the metadata of `path`"""
+    try:
+        with open(keeper, "rb") as fsrc, open(temp_path, "wb") as fdst:
+            clone_file(fsrc, fdst)
+    except OSError as e:
+        temp_path.unlink(missing_ok=True)
+        if not is_clone_unsupported(e):
+            raise
+        stats.can_clone = False
+        return False
+    shutil.copystat(path, temp_path)
+    return True
+
+
+def break_links(path: Path, dry_run: bool = False) -> None:
+    """
+    Give files in `path` their own data, if they are hard links to files elsewhere,
+    e.g. before a folder is moved out of the library. Hard links between files in
+    `path` are kept.
+    """
+    con.print_(f"Separating shared files in {con.style_path(path)}", end="")
+    if dry_run:
+        con.print_skipped()
+        return
+    links: dict[tuple[int, int], list[str]] = defaultdict(list)
+    nlinks: dict[tuple[int, int], int] = {}
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            file_path = os.path.join(dir_path, name)
+            file_stat = os.lstat(file_path)
+            if file_stat.st_nlink > 1:
+                key = (file_stat.st_dev, file_stat.st_ino)
+                links[key].append(file_path)
+                nlinks[key] = file_stat.st_nlink
+    try:
+        for key, paths in links.items():
+            if len(paths) == nlinks[key]:
+                continue
+            first, *others = paths
+            shutil.copy2(first, first + TEMP_SUFFIX)
+            os.replace(first + TEMP_SUFFIX, first)
+            for other in others:
+                os.link(first, other + TEMP_SUFFIX)
+                os.replace(other + TEMP_SUFFIX, other)
+    except OSError as e:
+        raise ClickException(f"\nUnable to copy {e.filename}: {e.strerror}") from e
+    con.print_success()
+
+
+def print_stats(stats: DedupeStats, hard_links: bool, dry_run: bool) -> None:
+    if not stats.duplicate_files:
+        con.print_success("\nNo duplicate files found")
+        return
+    con.print_(
+        f"\nFound {stats.duplicate_files:,} duplicate files, "
+        f"{con.style_bytes_as_gb(stats.duplicate_bytes)}"
+    )
+    if dry_run:
+        return
+    if stats.files_cloned or stats.files_linked:
+        con.print_success(
+            f"Cloned {stats.files_cloned:,} files and hard linked {stats.files_linked:,}. "
+            f"Space saved: {con.style_bytes_as_gb(stats.bytes_reclaimed)}"
+        )
+    if stats.files_skipped:
+        con.print_(
+            f"[yellow]Skipped {stats.files_skipped:,} files that changed or are in use[/yellow]"
+        )
+    if not stats.can_clone and not hard_links:
+        con.print_(
+            "[yellow]This drive can't clone files. Run rob dedupe --hard-links to share data with hard links instead.[/yellow]"
+        )
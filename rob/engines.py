@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+import stat
+import sys
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from time import perf_counter
+from typing import BinaryIO, Callable, ClassVar, Optional
+
+from click import ClickException
+
+import rob.console as con
+import rob.filesystem
+from rob.throttle import THROTTLE_CHUNK_BYTES, Throttle
+
+ENGINE_NAMES = ["native", "robocopy", "clone"]
+DEFAULT_THREADS = 8
+DEFAULT_BUFFER_SIZE = 8 * 1024**2
+SMALL_FILE_BYTES = 1024**2
+"Copying files smaller than this is limited by time per file, e.g. seeks, not by bandwidth"
+
+ProgressCallback = Callable[[int], None]
+"Called with the number of bytes copied since the last call"
+
+# Errors that mean a zero-copy primitive is not supported for this pair of files
+_ZERO_COPY_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+}
+
+
+@dataclass
+class CopyStats:
+    """What a copy engine did"""
+
+    files_copied: int = 0
+    bytes_copied: int = 0
+    seconds: float = 0
+    files_cloned: int = 0
+    "Included in `files_copied`. Cloned files share data with the source until changed."
+    bytes_cloned: int = 0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_copied / self.seconds if self.seconds else 0
+
+
+@dataclass
+class CopyEngine(ABC):
+    """
+    A backend that copies a folder tree from `source` to `target`
+
+    Invoke with `copy()`
+    """
+
+    name: ClassVar[str]
+    copies_ntfs_permissions: ClassVar[bool] = False
+    "Whether `copy_permissions` includes NTFS ACLs and owner info"
+
+    threads: int = DEFAULT_THREADS
+    small_file_threads: Optional[int] = None
+    "Threads for files smaller than `SMALL_FILE_BYTES`. `threads` is used if `None`."
+    auto_tune: bool = True
+    "Use settings measured by `rob bench`. Disabled if settings are chosen by the user."
+    throttle: Optional[Throttle] = None
+    "Shared by copies of the engine, so that all folders together keep to the rate"
+
+    def tune(
+        self, threads: int, small_file_threads: int, buffer_size: int
+    ) -> CopyEngine:
+        """Return a copy with settings from `rob bench`"""
+        # pylint: disable=unused-argument
+        return replace(self, threads=threads, small_file_threads=small_file_threads)
+
+    @abstractmethod
+    def copy_tree(
+        self,
+        source: Path,
+        target: Path,
+        copy_permissions: bool,
+        progress: ProgressCallback,
+        incremental: bool,
+    ) -> CopyStats:
+        """
+        Copy contents of `source` to `target`. Raise `ClickException` on error.
+
+        Report bytes copied to `progress` as they are copied.
+
+        If `incremental`, `target` may already exist. Files in `target` with the same
+        size and modified time as in `source` are not copied again.
+        """
+
+    def copy(
+        self,
+        source: Path,
+        target: Path,
+        dir_size_bytes: Optional[int] = None,
+        dry_run: bool = False,
+        copy_permissions: bool = False,
+        quiet=False,
+        incremental: bool = False,
+    ) -> Optional[CopyStats]:
+        """Return `None` in dry run mode. See `copy_tree()` for `incremental`."""
+        msg = f"Copying data from {con.style_path(source)} to {con.style_path(target)}"
+        if not dir_size_bytes:
+            dir_size_bytes = rob.filesystem.get_dir_size(source)
+        if target.exists() and not incremental:
+            con.print_(msg)
+            raise ClickException(f"{target} already exists")
+        if dry_run:
+            con.print_(msg, end="")
+            con.print_skipped()
+            return None
+        if not quiet:
+            con.print_(msg)
+
+        start = perf_counter()
+        if quiet:
+            stats = self.copy_tree(
+                source, target, copy_permissions, lambda advance: None, incremental
+            )
+        else:
+            with con.progress_bar("Copying data...", dir_size_bytes) as progress:
+                stats = self.copy_tree(
+                    source, target, copy_permissions, progress, incremental
+                )
+        if not stats.seconds:
+            stats.seconds = perf_counter() - start
+
+        if not quiet:
+            con.print_(
+                f"[green]Data copy complete[/green] {stats.files_copied:,} files, "
+                f"{con.style_bytes_as_gb(stats.bytes_copied)} at "
+                f"{con.style_bytes_per_second(stats.bytes_per_second)}"
+            )
+            if stats.files_cloned:
+                con.print_(
+                    f"{stats.files_cloned:,} files, {con.style_bytes_as_gb(stats.bytes_cloned)} "
+                    "were cloned and use no extra space until they are changed"
+                )
+        return stats
+
+
+@dataclass
+class NativeEngine(CopyEngine):
+    """
+    Copy with a pool of threads in this process
+
+    Uses `os.copy_file_range` or `os.sendfile` where the platform supports them,
+    so that data does not pass through user space. Otherwise data is copied
+    through a reusable buffer per thread.
+    """
+
+    name: ClassVar = "native"
+
+    buffer_size: int = DEFAULT_BUFFER_SIZE
+    _local: threading.local = field(
+        default_factory=threading.local, init=False, repr=False
+    )
+
+    def tune(
+        self, threads: int, small_file_threads: int, buffer_size: int
+    ) -> CopyEngine:
+        return replace(
+            self,
+            threads=threads,
+            small_file_threads=small_file_threads,
+            buffer_size=buffer_size,
+        )
+
+    def copy_tree(
+        self,
+        source: Path,
+        target: Path,
+        copy_permissions: bool,
+        progress: ProgressCallback,
+        incremental: bool,
+    ) -> CopyStats:
+        if copy_permissions and os.name == "nt":
+            raise ClickException(
+                "The native engine cannot copy NTFS permissions. Use the robocopy engine or --dont-copy-permissions."
+            )
+        dirs = [(source, target)]
+        errors: list[str] = []
+        stats = CopyStats()
+        with ExitStack() as stack:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=self.threads))
+            small_file_executor = (
+                stack.enter_context(
+                    ThreadPoolExecutor(max_workers=self.small_file_threads)
+                )
+                if self.small_file_threads
+                else executor
+            )
+            futures = []
+            try:
+                target.mkdir(parents=True, exist_ok=incremental)
+                # Directories are created by this thread, in order, so that parents
+                # always exist before their files are copied
+                index = 0
+                while index < len(dirs):
+                    from_dir, to_dir = dirs[index]
+                    index += 1
+                    for entry in os.scandir(from_dir):
+                        to_path = to_dir.joinpath(entry.name)
+                        if incremental and is_same_file(entry, to_path):
+                            progress(entry.stat(follow_symlinks=False).st_size)
+                            continue
+                        if incremental:
+                            remove_mismatched(entry, to_path)
+                        if entry.is_symlink():
+                            # On Windows, symlinks to folders are a different type
+                            os.symlink(
+                                os.readlink(entry.path),
+                                to_path,
+                                target_is_directory=entry.is_dir(),
+                            )
+                            stats.files_copied += 1
+                        elif entry.is_dir():
+                            to_path.mkdir(exist_ok=incremental)
+                            dirs.append((Path(entry.path), to_path))
+                        else:
+                            small = (
+                                entry.stat(follow_symlinks=False).st_size
+                                < SMALL_FILE_BYTES
+                            )
+                            futures.append(
+                                (small_file_executor if small else executor).submit(
+                                    self.copy_file,
+                                    Path(entry.path),
+                                    to_path,
+                                    copy_permissions,
+                                    progress,
+                                )
+                            )
+            except OSError as e:
+                errors.append(f"{e.filename}: {e.strerror}")
+                for future in futures:
+                    future.cancel()
+            for future in futures:
+                if future.cancelled():
+                    continue
+                try:
+                    stats.bytes_copied += future.result()
+                    stats.files_copied += 1
+                except OSError as e:
+                    errors.append(f"{e.filename}: {e.strerror}")
+        if not errors:
+            # Set directory timestamps last, as creating files changes them
+            for from_dir, to_dir in reversed(dirs):
+                try:
+                    self.copy_metadata(from_dir, to_dir, copy_permissions)
+                except OSError as e:
+                    errors.append(f"{e.filename}: {e.strerror}")
+        if errors:
+            raise ClickException(f"Copy failed: {errors}")
+        return stats
+
+    def copy_file(
+        self,
+        source: Path,
+        target: Path,
+        copy_permissions: bool,
+        progress: ProgressCallback,
+    ) -> int:
+        """Return number of bytes copied"""
+        with open(source, "rb") as fsrc, open(target, "wb") as fdst:
+            copied = self.copy_data(fsrc, fdst, progress)
+        self.copy_metadata(source, target, copy_permissions)
+        return copied
+
+    def copy_data(
+        self, fsrc: BinaryIO, fdst: BinaryIO, progress: ProgressCallback
+    ) -> int:
+        """Copy all data from `fsrc` to `fdst`. Return number of bytes copied."""
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        copied = 0
+        chunk_size = (
+            min(self.buffer_size, THROTTLE_CHUNK_BYTES)
+            if self.throttle
+            else self.buffer_size
+        )
+        size = os.fstat(infd).st_size
+
+        def get_reserve() -> int:
+            # The read at the end of the file doesn't wait. Data beyond `size`, if
+            # the file grows, is charged after it is copied.
+            return min(chunk_size, max(size - copied, 0))
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while count := self._timed(
+                    get_reserve(), lambda: os.copy_file_range(infd, outfd, chunk_size)
+                ):
+                    copied += count
+                    progress(count)
+                return copied
+            except OSError as e:
+                if copied or e.errno not in _ZERO_COPY_UNSUPPORTED:
+                    raise
+        if sys.platform == "linux":
+            # Other platforms only accept a socket as `out_fd`
+            try:
+                while count := self._timed(
+                    get_reserve(), lambda: os.sendfile(outfd, infd, copied, chunk_size)
+                ):
+                    copied += count
+                    progress(count)
+                return copied
+            except OSError as e:
+                if copied or e.errno not in _ZERO_COPY_UNSUPPORTED:
+                    raise
+        with memoryview(self._get_buffer()) as view, view[:chunk_size] as buffer:
+
+            def copy_chunk() -> int:
+                count = fsrc.readinto(buffer)
+                fdst.write(buffer[:count])
+                return count
+
+            while count := self._timed(get_reserve(), copy_chunk):
+                copied += count
+                progress(count)
+        return copied
+
+    def _timed(self, reserve: int, copy_chunk: Callable[[], int]) -> int:
+        """Wait until the throttle allows `reserve` bytes, then call `copy_chunk`"""
+        if not self.throttle:
+            return copy_chunk()
+        self.throttle.reserve(reserve)
+        start = perf_counter()
+        count = copy_chunk()
+        self.throttle.record(reserve, count, perf_counter() - start)
+        return count
+
+    def _get_buffer(self) -> bytearray:
+        """A buffer for each worker thread, reused for every file it copies"""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) != self.buffer_size:
+            buffer = self._local.buffer = bytearray(self.buffer_size)
+        return buffer
+
+    @staticmethod
+    def copy_metadata(source: Path, target: Path, copy_permissions: bool) -> None:
+        # Mode bits and timestamps, like robocopy's default /COPY:DAT
+        shutil.copystat(source, target)
+        if copy_permissions and hasattr(os, "chown"):
+            source_stat = source.stat()
+            os.chown(target, source_stat.st_uid, source_stat.st_gid)
+
+
+def is_same_file(entry: os.DirEntry, target: Path) -> bool:
+    """Whether `target` is a complete copy of file or symlink `entry`"""
+    if entry.is_dir(follow_symlinks=False):
+        return False
+    try:
+        target_stat = target.lstat()
+    except FileNotFoundError:
+        return False
+    if entry.is_symlink():
+        return stat.S_ISLNK(target_stat.st_mode) and (
+            os.readlink(entry.path) == os.readlink(target)
+        )
+    source_stat = entry.stat(follow_symlinks=False)
+    return (
+        stat.S_ISREG(target_stat.st_mode)
+        and source_stat.st_size == target_stat.st_size
+        and source_stat.st_mtime_ns == target_stat.st_mtime_ns
+    )
+
+
+def remove_mismatched(entry: os.DirEntry, target: Path) -> None:
+    """
+    Remove `target` if it can't be updated to match `entry`, e.g. a file where
+    `entry` is a symlink, or a symlink to somewhere else. Otherwise a file or dir
+    would be written through a symlink at `target`.
+    """
+    try:
+        target_stat = target.lstat()
+    except FileNotFoundError:
+        return
+    target_is_dir = stat.S_ISDIR(target_stat.st_mode)
+    if (
+        not entry.is_symlink()
+        and not stat.S_ISLNK(target_stat.st_mode)
+        and entry.is_dir(follow_symlinks=False) == target_is_dir
+    ):
+        return
+    if target_is_dir:
+        shutil.rmtree(target)
+    else:
+        target.unlink()
+
+
+def get_copy_engine(
+    name: str,
+    threads: Optional[int] = None,
+    max_rate: Optional[float] = None,
+    background: bool = False,
+) -> CopyEngine:
+    """
+    Return the engine registered as `name`. `threads` uses the engine's default if
+    `None`.
+
+    `max_rate` limits copies to bytes per second. If `background`, copies slow down
+    while other programs use the disk. The priority of the process is lowered by the
+    CLI, see `set_background_priority()`.
+    """
+    # pylint: disable=import-outside-toplevel
+    # These modules subclass CopyEngine, so cannot be imported before this module
+    from rob.clone import CloneEngine
+    from rob.robocopy import RobocopyEngine
+
+    engines: dict[str, type[CopyEngine]] = {
+        NativeEngine.name: NativeEngine,
+        RobocopyEngine.name: RobocopyEngine,
+        CloneEngine.name: CloneEngine,
+    }
+    # Threads chosen by the user are not replaced by `rob bench` settings
+    kwargs: dict = {"threads": threads, "auto_tune": False} if threads else {}
+    if max_rate or background:
+        kwargs["throttle"] = Throttle(max_rate, adaptive=background)
+    return engines[name](**kwargs)
+
+
+def get_default_engine_name() -> str:
+    """robocopy is only available on Windows"""
+    return "robocopy" if os.name == "nt" else NativeEngine.name
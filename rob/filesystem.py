@@ -1,18 +1,30 @@
+from __future__ import annotations
+
+import errno
 import os
 import shutil
+import stat
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from pathlib import WindowsPath
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TypeVar
 
 from click import ClickException
 
 import rob.console as con
-from rob.robocopy import run_robocopy
+
+CLUSTER_SIZE = 4096
+SCAN_WORKERS = 8
+DELETE_WORKERS = 8
+
+T = TypeVar("T")
 
 
 @dataclass
 class DiskUsage:
     drive: str
-    "Accepts `Path().drive`"
+    "Accepts `get_volume()`"
     usage: shutil._ntuple_diskusage
     """
     _ntuple_diskusage.total.__doc__ = 'Total space in bytes' \n
@@ -25,23 +37,156 @@ class DiskUsage:
         self.usage = shutil.disk_usage(drive)
 
 
-def get_dir_size(path: WindowsPath) -> int:
-    """Return total size of files in given path and subdirs"""
+def get_volume(path: Path) -> str:
+    """
+    Return the drive (Windows) or mount point (other platforms) that contains `path`
+
+    `path` does not need to exist.
+    """
+    if path.drive:
+        return path.drive
+    path = path.absolute()
+    for parent in [path] + list(path.parents):
+        if os.path.ismount(parent):
+            return str(parent)
+    return path.anchor
+
+
+def get_physical_disk(path: Path) -> str:
+    """
+    Return a name for the physical disk that contains `path`, so that partitions
+    of the same disk have the same name
+
+    Only Linux is supported. Falls back to `get_volume()` otherwise.
+    """
+    if sys.platform == "linux":
+        existing = next(
+            parent for parent in [path] + list(path.parents) if parent.exists()
+        )
+        device = existing.stat().st_dev
+        sys_path = Path(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+        if sys_path.exists():
+            sys_path = sys_path.resolve()
+            if sys_path.joinpath("partition").exists():
+                sys_path = sys_path.parent
+            return sys_path.name
+    return get_volume(path)
+
+
+def is_rotational(disk: str) -> Optional[bool]:
+    """Whether `disk` from `get_physical_disk()` is a spinning disk. `None` if unknown."""
+    try:
+        return Path(f"/sys/block/{disk}/queue/rotational").read_text().strip() == "1"
+    except (OSError, ValueError):
+        return None
+
+
+@dataclass
+class DirStats:
+    """Totals for a folder and its subdirs"""
+
+    files: int = 0
+    dirs: int = 0
+    "Number of subdirs, not including the folder itself"
+    apparent_bytes: int = 0
+    "Total size of files"
+    allocated_bytes: int = 0
+    "Disk space used by files"
+
+    def __add__(self, other: DirStats) -> DirStats:
+        return DirStats(
+            files=self.files + other.files,
+            dirs=self.dirs + other.dirs,
+            apparent_bytes=self.apparent_bytes + other.apparent_bytes,
+            allocated_bytes=self.allocated_bytes + other.allocated_bytes,
+        )
+
+
+def get_allocated_size(stat: os.stat_result) -> int:
+    if hasattr(stat, "st_blocks"):
+        return stat.st_blocks * 512
+    # Windows doesn't report blocks, so assume the default NTFS cluster size
+    return -(-stat.st_size // CLUSTER_SIZE) * CLUSTER_SIZE
+
+
+def list_dir(path: str) -> tuple[DirStats, list[tuple[str, os.stat_result]], list[str]]:
+    """
+    Return totals for the files directly inside `path`, the name and stat of each file,
+    and a list of its subdirs
+    """
+    stats = DirStats()
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stats.dirs += 1
+                    subdirs.append(entry.path)
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    stats.files += 1
+                    stats.apparent_bytes += stat.st_size
+                    stats.allocated_bytes += get_allocated_size(stat)
+                    files.append((entry.name, stat))
+    except FileNotFoundError:
+        # Avoid race with folder deletion
+        pass
+    return stats, files, subdirs
+
+
+def scan_dir(path: str) -> tuple[DirStats, list[str]]:
+    """Return totals for the files directly inside `path`, and a list of its subdirs"""
+    stats, _, subdirs = list_dir(path)
+    return stats, subdirs
+
+
+def walk_dirs(
+    path: Path,
+    scan: Callable[[str], tuple[T, list[str]]],
+    workers: int = SCAN_WORKERS,
+) -> Iterator[tuple[str, T]]:
+    """
+    Call `scan` for `path` and every subdir that it returns, using a pool of threads
+
+    Each subdir is a separate job, so deep trees don't need recursion and scans of
+    different subdirs overlap. Yields the path and result of each scan as it finishes.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan, str(path)): str(path)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, subdirs = future.result()
+                yield pending.pop(future), result
+                for subdir in subdirs:
+                    pending[executor.submit(scan, subdir)] = subdir
+
+
+def get_dir_stats(path: Path, workers: int = SCAN_WORKERS) -> DirStats:
+    """Return totals for files in given path and subdirs"""
+    total = DirStats()
     if not path.exists():
         # Avoid race with file creation
-        return 0
-
-    def get_tree_size(path) -> int:
-        # https://www.python.org/dev/peps/pep-0471/
-        total = 0
-        for entry in os.scandir(path):
-            if entry.is_dir(follow_symlinks=False):
-                total += get_tree_size(entry.path)
-            else:
-                total += entry.stat(follow_symlinks=False).st_size
         return total
+    for _, stats in walk_dirs(path, scan_dir, workers):
+        total += stats
+    return total
+
+
+def get_dir_size(path: Path) -> int:
+    """Return total size of files in given path and subdirs"""
+    return get_dir_stats(path).apparent_bytes
 
-    return get_tree_size(path)
+
+def is_same_filesystem(path: Path, other: Path) -> bool:
+    """
+    Whether folders can be moved between `path` and `other` by renaming them
+
+    Compares device IDs, so it works for folders mounted from other partitions.
+    Both paths must exist.
+    """
+    return os.stat(path).st_dev == os.stat(other).st_dev
 
 
 def test_disk_space(dir_size_bytes, target_disk: DiskUsage) -> None:
@@ -53,7 +198,12 @@ def test_disk_space(dir_size_bytes, target_disk: DiskUsage) -> None:
     con.print_success()
 
 
-def test_dir_creation(path: WindowsPath) -> None:
+def raise_if_exists(path: Path) -> None:
+    if path.exists() or path.is_symlink():
+        raise ClickException(f"{path} already exists")
+
+
+def test_dir_creation(path: Path) -> None:
     """Test write access by creating and deleting an empty folder"""
     con.print_(f"Testing write access to {con.style_path(path)}", end="")
     if path.exists():
@@ -70,14 +220,18 @@ def test_dir_creation(path: WindowsPath) -> None:
     con.print_success()
 
 
-def test_set_ntfs_permisisons(source: WindowsPath, target: WindowsPath) -> None:
+def test_set_ntfs_permisisons(source: Path, target: Path) -> None:
     con.print_(
         f"Testing access to copy permissions from {con.style_path(source)} to {con.style_path(target)}",
         end="",
     )
+    # pylint: disable=import-outside-toplevel
+    # rob.robocopy depends on this module via rob.engines
+    from rob.robocopy import RobocopyEngine
+
     try:
         source.mkdir()
-        run_robocopy(source, target, copy_permissions=True, quiet=True)
+        RobocopyEngine().copy(source, target, copy_permissions=True, quiet=True)
     except ClickException as e:
         if (
             "Copying NTFS Security to Destination Directory" in e.message
@@ -95,7 +249,34 @@ def test_set_ntfs_permisisons(source: WindowsPath, target: WindowsPath) -> None:
     con.print_success()
 
 
-def test_symlink_creation(source: WindowsPath, target: WindowsPath) -> None:
+def test_rename(source: Path, target: Path) -> bool:
+    """
+    Test that an empty folder can be moved from `source` to `target` by renaming it
+
+    Return `False` if the paths are on different filesystems, e.g. they are bind mounts
+    of the same device.
+    """
+    con.print_(
+        f"Testing rename from {con.style_path(source)} to {con.style_path(target)}",
+        end="",
+    )
+    source.mkdir()
+    try:
+        source.rename(target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise ClickException(f"\nUnable to rename {source} to {target}") from e
+        con.print_(" [grey50]NOT POSSIBLE, DATA WILL BE COPIED[/grey50]")
+        return False
+    finally:
+        for path in (source, target):
+            if path.exists():
+                path.rmdir()
+    con.print_success()
+    return True
+
+
+def test_symlink_creation(source: Path, target: Path) -> None:
     con.print_(
         f"Testing symlink creation from {con.style_path(source)} to {con.style_path(target)}",
         end="",
@@ -110,9 +291,7 @@ def test_symlink_creation(source: WindowsPath, target: WindowsPath) -> None:
     con.print_success()
 
 
-def rename_folder(
-    source: WindowsPath, target: WindowsPath, dry_run: bool = False
-) -> None:
+def rename_folder(source: Path, target: Path, dry_run: bool = False) -> None:
     con.print_(f"Renaming {con.style_path(source)} to {con.style_path(target)}", end="")
     if dry_run:
         con.print_skipped()
@@ -128,7 +307,7 @@ def rename_folder(
 
 
 def create_symlink(
-    source: WindowsPath, target: WindowsPath, quiet: bool = False, dry_run: bool = False
+    source: Path, target: Path, quiet: bool = False, dry_run: bool = False
 ) -> None:
     if not quiet:
         con.print_(
@@ -153,9 +332,7 @@ def create_symlink(
         con.print_success()
 
 
-def delete_symlink(
-    path: WindowsPath, quiet: bool = False, dry_run: bool = False
-) -> None:
+def delete_symlink(path: Path, quiet: bool = False, dry_run: bool = False) -> None:
     if not quiet:
         con.print_(f"Deleting symlink {con.style_path(path)}", end="")
     if not path.is_symlink():
@@ -170,7 +347,7 @@ def delete_symlink(
         con.print_success()
 
 
-def delete_folder(path: WindowsPath, dry_run: bool = False) -> None:
+def delete_folder(path: Path, dry_run: bool = False) -> None:
     con.print_(f"Deleting folder {con.style_path(path)}", end="")
     if path.is_symlink():
         raise ClickException(f"\nCannot delete. {path} is a symlink.")
@@ -178,7 +355,7 @@ def delete_folder(path: WindowsPath, dry_run: bool = False) -> None:
         con.print_skipped()
         return
     try:
-        shutil.rmtree(path)
+        delete_tree(path)
     except PermissionError:
         # Rarely, it might not be possible to delete a folder, even if earlier (folder renaming) checks pass.
         # The example I've seen of this is an Explorer extension DLL that's still loaded.
@@ -191,4 +368,85 @@ def delete_folder(path: WindowsPath, dry_run: bool = False) -> None:
         con.print_(
             "[red]To tidy up, restart your PC and delete this folder manually.[/red]"
         )
+        return
+    con.print_success()
+
+
+def delete_file(path: Path, dry_run: bool = False) -> None:
+    con.print_(f"Deleting file {con.style_path(path)}", end="")
+    if dry_run:
+        con.print_skipped()
+        return
+    path.unlink()
+    con.print_success()
+
+
+def delete_tree(path: Path, workers: int = DELETE_WORKERS) -> None:
+    """
+    Like `shutil.rmtree()`, but files in different subdirs are deleted at the same
+    time, which is much faster for trees of many small files
+    """
+    # Parents are yielded before their subdirs, so are removed after them
+    dirs = [dir_path for dir_path, _ in walk_dirs(path, delete_files, workers)]
+    for dir_path in reversed(dirs):
+        os.rmdir(dir_path)
+
+
+def delete_files(path: str) -> tuple[None, list[str]]:
+    """Delete the files and links directly inside `path`. Return its subdirs."""
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if is_link(entry):
+                # Not followed, so that data outside the tree is kept
+                if os.name == "nt" and entry.is_dir():
+                    os.rmdir(entry.path)
+                else:
+                    os.unlink(entry.path)
+            elif entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            else:
+                os.unlink(entry.path)
+    return None, subdirs
+
+
+def is_link(entry: os.DirEntry) -> bool:
+    """Symlinks, and junctions on Windows, which `is_symlink()` misses"""
+    if entry.is_symlink():
+        return True
+    if os.name != "nt":
+        return False
+    reparse_tag = entry.stat(follow_symlinks=False).st_reparse_tag
+    return reparse_tag == stat.IO_REPARSE_TAG_MOUNT_POINT
+
+
+def is_hard_link(path: Path) -> bool:
+    """Whether `path` is a file that shares its data with another path"""
+    try:
+        file_stat = path.lstat()
+    except FileNotFoundError:
+        return False
+    return stat.S_ISREG(file_stat.st_mode) and file_stat.st_nlink > 1
+
+
+def delete_paths(
+    root: Path, files: list[str], dirs: list[str], dry_run: bool = False
+) -> None:
+    """Delete `files` and `dirs`, which are relative to `root`"""
+    con.print_(
+        f"Deleting {len(files):,} files and {len(dirs):,} folders from {con.style_path(root)}",
+        end="",
+    )
+    if dry_run:
+        con.print_skipped()
+        return
+    try:
+        for rel_path in files:
+            root.joinpath(rel_path).unlink(missing_ok=True)
+        # Sorted paths put parents before their children, which are then gone
+        for rel_path in sorted(dirs):
+            if root.joinpath(rel_path).exists():
+                shutil.rmtree(root.joinpath(rel_path))
+    except OSError as e:
+        raise ClickException(f"\nUnable to delete {e.filename}: {e.strerror}") from e
     con.print_success()
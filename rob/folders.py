@@ -1,37 +1,116 @@
 from __future__ import annotations
 
+import glob
 import json
-from dataclasses import dataclass
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from functools import cached_property
 from hashlib import sha256
-from pathlib import WindowsPath
-from typing import ClassVar, Optional
+from pathlib import Path
+from typing import ClassVar, Iterator, Optional
+
+from click import ClickException
 
 import rob.console as con
 import rob.filesystem
+import rob.locks
+import rob.store
 from rob import PROJECT_NAME
+from rob.archive import ARCHIVE_SUFFIX
+from rob.index import SizeIndex
+
+SIZE_WORKERS = 4
+"Folders that are scanned at once. Each scan also uses a pool of threads."
 
 
 @dataclass
 class Folder:
     """A folder being managed by the tool. It is identifed by `source_dir`."""
 
-    source_dir: WindowsPath
+    source_dir: Path
     """The path of the folder on the source disk. It gets replaced by a symlink."""
+    state: str = field(default="active", compare=False)
+    """
+    `active` if data is in the library, or `warm` if the folder has been removed but
+    a copy of its data was kept in the library, so that it can be added again quickly.
+    `compressed` if data is in an archive in the library, and not at `source_dir`.
+    """
+    id: Optional[int] = field(default=None, compare=False)
+    "Set when the folder is saved in a library"
+    compressed_bytes: Optional[int] = field(default=None, compare=False)
+    "Size of the archive, if compressed"
+    health: Optional[str] = field(default=None, compare=False)
+    "Problem found by `rob watch`, or `ok`. See `check_health()`."
 
     def __post_init__(self):
-        self.source_dir = WindowsPath(self.source_dir)
+        self.source_dir = Path(self.source_dir)
 
-    def get_library_subdir(self, library: Library) -> WindowsPath:
+    @property
+    def is_warm(self) -> bool:
+        return self.state == "warm"
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.state == "compressed"
+
+    def to_json(self):
+        # Older versions saved a list of paths
+        if self.state == "active":
+            return str(self.source_dir)
+        return {"source_dir": str(self.source_dir), "state": self.state}
+
+    @classmethod
+    def from_json(cls, data) -> Folder:
+        if isinstance(data, str):
+            return cls(source_dir=data)
+        return cls(**data)
+
+    def get_library_subdir(self, library: Library) -> Path:
         """A subfolder of the library. It is the target for data."""
         return library.library_folder.joinpath(self.short_name).resolve()
 
-    def get_temp_dir(self) -> WindowsPath:
+    def get_archive_path(self, library: Library) -> Path:
+        """Where data is kept if the folder is compressed"""
+        return library.library_folder.joinpath(
+            f"{self.short_name}{ARCHIVE_SUFFIX}"
+        ).resolve()
+
+    def get_library_data_path(self, library: Library) -> Path:
+        return (
+            self.get_archive_path(library)
+            if self.is_compressed
+            else self.get_library_subdir(library)
+        )
+
+    def get_temp_dir(self) -> Path:
         """A sibling of the source. It is used for shuffling data and testing access."""
         temp_dir_name = f"_{PROJECT_NAME}_temp_{self.short_name}"
         return self.source_dir.parent.joinpath(temp_dir_name).resolve()
 
-    def get_library_data_size(self, library) -> int:
-        return rob.filesystem.get_dir_size(self.get_library_subdir(library))
+    def check_health(self, library: Library) -> str:
+        """Describe a problem with the symlink or data of the folder, or return `ok`"""
+        if not self.get_library_data_path(library).exists():
+            return "data missing"
+        if self.state != "active":
+            return "ok"
+        if not self.source_dir.is_symlink():
+            return "symlink missing"
+        if self.source_dir.resolve() != self.get_library_subdir(library):
+            return "symlink points elsewhere"
+        return "ok"
+
+    def get_library_data_stats(
+        self, library: Library, refresh: bool = False
+    ) -> rob.filesystem.DirStats:
+        if self.is_compressed:
+            # Measured before data was compressed
+            return library.get_saved_stats(self)
+        return library.size_index.get_stats(
+            self.short_name, self.get_library_subdir(library), refresh=refresh
+        )
 
     @property
     def short_name(self) -> str:
@@ -44,84 +123,441 @@ class Folder:
         # lower() so paths get same hash regardless of capitalisation
         return sha256(str(self.source_dir).lower().encode("utf-8")).hexdigest()[:12]
 
-    def get_table_data(self, library: Library, show_size: bool = False) -> dict:
-        result = {"Path": self.source_dir, "Name": self.short_name}
-        if show_size:
-            result["Size"] = self.get_library_data_size(library)
-        return result
+    def get_table_data(self) -> dict:
+        return {"Path": self.source_dir, "Name": self.short_name, "State": self.state}
 
 
 @dataclass
 class Library:
-    """The library is a folder that contains target data folders and a config file"""
+    """
+    The library is a folder that contains target data folders and a database
 
+    Changes to the folder list are written to the database by `save()`, all at once.
+    """
+
+    db_filename: ClassVar = f"{PROJECT_NAME}-library.db"
     config_filename: ClassVar = f"{PROJECT_NAME}-folders.json"
-    library_folder: WindowsPath
-    config_path: WindowsPath
-    folders: list[Folder]
+    "Folder list of older versions, which is moved to the database"
+    library_folder: Path
+    db_path: Path
+    config_path: Path
 
-    def __init__(self, library_folder: WindowsPath):
+    def __init__(self, library_folder: Path):
         self.library_folder = library_folder
+        self.db_path = library_folder.joinpath(self.db_filename).resolve()
         self.config_path = library_folder.joinpath(self.config_filename).resolve()
+        self._connection: Optional[sqlite3.Connection] = None
+
+        if self.config_path.exists() and not self.db_path.exists():
+            with rob.locks.metadata_lock(library_folder):
+                # Another process may have done it while this one waited
+                if not self.db_path.exists():
+                    self.migrate_config()
+        if self.db_path.exists():
+            con.print_(f"[grey50]Loading folder list from {self.db_path}...[/grey50]")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The database is only created when something is written to it"""
+        if self._connection is None:
+            self._connection = rob.store.connect(self.db_path)
+        return self._connection
 
-        self.folders = []
-        if self.config_path.exists():
-            con.print_(
-                f"[grey50]Loading folder list from {self.config_path}...[/grey50]"
+    def query(self, sql: str, params: tuple = ()) -> list[sqlite3.Row]:
+        if self._connection is None and not self.db_path.exists():
+            return []
+        return self.connection.execute(sql, params).fetchall()
+
+    def migrate_config(self) -> None:
+        """Move the folder list of older versions to the database"""
+        con.print_(
+            f"Moving folder list from {con.style_path(self.config_path)} to {con.style_path(self.db_path)}",
+            end="",
+        )
+        with open(self.config_path, encoding="utf8") as file:
+            folders = [Folder.from_json(item) for item in json.load(file)]
+        for index, folder in enumerate(folders):
+            # Keep the IDs that older versions showed
+            folder.id = index
+            self._save_folder(folder)
+        self.connection.commit()
+        self.config_path.rename(self.config_path.with_suffix(".json.bak"))
+        con.print_success()
+
+    @property
+    def folders(self) -> list[Folder]:
+        return [
+            self._get_folder(row)
+            for row in self.query("SELECT * FROM folders ORDER BY id")
+        ]
+
+    def __contains__(self, folder: Folder) -> bool:
+        return self.get_folder(folder.source_dir) is not None
+
+    def get_folder(self, source_dir: Path) -> Optional[Folder]:
+        rows = self.query(
+            "SELECT * FROM folders WHERE source_key = ?",
+            (rob.store.get_path_key(source_dir),),
+        )
+        return self._get_folder(rows[0]) if rows else None
+
+    @staticmethod
+    def _get_folder(row: sqlite3.Row) -> Folder:
+        return Folder(
+            source_dir=row["source_dir"],
+            state=row["state"],
+            id=row["id"],
+            compressed_bytes=row["compressed_bytes"],
+            health=row["health"],
+        )
+
+    def _save_folder(self, folder: Folder) -> None:
+        """Insert `folder`, or update its state if it exists"""
+        now = time.time()
+        try:
+            self.connection.execute(
+                """
+                INSERT INTO folders
+                    (id, source_dir, source_key, short_name, state, added_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source_key) DO UPDATE
+                    SET state = excluded.state, updated_at = excluded.updated_at
+                """,
+                (
+                    folder.id,
+                    str(folder.source_dir),
+                    rob.store.get_path_key(folder.source_dir),
+                    folder.short_name,
+                    folder.state,
+                    now,
+                    now,
+                ),
             )
-            with open(self.config_path, encoding="utf8") as file:
-                self.folders = [Folder(source_dir=item) for item in json.load(file)]
+        except sqlite3.IntegrityError as e:
+            # e.g. paths that differ only in case, on a case-sensitive filesystem
+            raise ClickException(
+                f"Cannot save {folder.source_dir}. Another folder in the library has "
+                f"the same name, {folder.short_name}."
+            ) from e
+        if saved := self.get_folder(folder.source_dir):
+            folder.id = saved.id
 
     def add_folder(self, folder: Folder) -> None:
-        if folder not in self.folders:
-            self.folders.append(folder)
+        """Add `folder`, or make it active if it is warm"""
+        folder.state = "active"
+        self._save_folder(folder)
 
     def remove_folder(self, folder: Folder) -> None:
-        if folder in self.folders:
-            self.folders.remove(folder)
+        self.connection.execute(
+            "DELETE FROM folders WHERE source_key = ?",
+            (rob.store.get_path_key(folder.source_dir),),
+        )
+        self.delete_content(folder.short_name)
+
+    def keep_warm(self, folder: Folder) -> None:
+        """Remove `folder`, but remember that its data is still in the library"""
+        folder.state = "warm"
+        self._save_folder(folder)
+
+    def compress_folder(
+        self,
+        folder: Folder,
+        stats: rob.filesystem.DirStats,
+        compressed_bytes: int,
+        bytes_per_second: Optional[float],
+    ) -> None:
+        """Remember that data of `folder` is in an archive, and how well it compressed"""
+        folder.state = "compressed"
+        folder.compressed_bytes = compressed_bytes
+        self._save_folder(folder)
+        # Files in archives can't be deduplicated
+        self.delete_content(folder.short_name)
+        self.set_folder_stats(folder, stats)
+        self.connection.execute(
+            """
+            UPDATE folders SET compressed_bytes = ?, compress_bytes_per_second = ?
+            WHERE source_key = ?
+            """,
+            (
+                compressed_bytes,
+                bytes_per_second,
+                rob.store.get_path_key(folder.source_dir),
+            ),
+        )
+
+    def get_warm_folder(self, source_dir: Path) -> Optional[Folder]:
+        folder = self.get_folder(source_dir)
+        return folder if folder and folder.is_warm else None
+
+    def add_history(self, folder: Folder, operation: str, size_bytes: int) -> None:
+        self.connection.execute(
+            "INSERT INTO history (folder_id, source_dir, operation, bytes, at) VALUES (?, ?, ?, ?, ?)",
+            (folder.id, str(folder.source_dir), operation, size_bytes, time.time()),
+        )
+
+    def get_history(self, limit: int) -> list[sqlite3.Row]:
+        """Most recent operations first"""
+        return self.query("SELECT * FROM history ORDER BY id DESC LIMIT ?", (limit,))
+
+    def get_moved_source_dirs(self) -> list[Path]:
+        """Every folder that has been added or removed"""
+        rows = self.query("SELECT DISTINCT source_dir FROM history")
+        return [Path(row["source_dir"]) for row in rows]
+
+    def get_probe(
+        self, key: tuple[str, str, str, str], since: float
+    ) -> Optional[sqlite3.Row]:
+        """Result of a pre-flight check that passed after `since`. See `rob.preflight`."""
+        rows = self.query(
+            """
+            SELECT result FROM probes
+            WHERE probe = ? AND source = ? AND target = ? AND privilege = ? AND checked_at > ?
+            """,
+            key + (since,),
+        )
+        return rows[0] if rows else None
+
+    def save_probe(
+        self, key: tuple[str, str, str, str], result: Optional[bool]
+    ) -> None:
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO probes (probe, source, target, privilege, result, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            key + (result, time.time()),
+        )
+
+    def has_content_index(self) -> bool:
+        """Whether `rob dedupe` has been run. See `rob.dedupe`."""
+        return bool(self.query("SELECT 1 FROM content LIMIT 1"))
+
+    def get_content(self, short_name: Optional[str] = None) -> list[sqlite3.Row]:
+        """Files in the content index, of one folder or all"""
+        if short_name is None:
+            return self.query("SELECT * FROM content")
+        return self.query("SELECT * FROM content WHERE short_name = ?", (short_name,))
+
+    def save_content(self, rows: list[dict]) -> None:
+        """Add or replace files, by `short_name` and `rel_path`. Hashes are optional."""
+        self.connection.executemany(
+            """
+            INSERT OR REPLACE INTO content
+                (short_name, rel_path, size, mtime_ns, partial_hash, hash)
+            VALUES
+                (:short_name, :rel_path, :size, :mtime_ns, :partial_hash, :hash)
+            """,
+            [{"partial_hash": None, "hash": None} | row for row in rows],
+        )
+
+    def save_content_hashes(
+        self, column: str, rows: list[tuple[bytes, str, str]]
+    ) -> None:
+        """Set `column` to each hash, by `short_name` and `rel_path`"""
+        assert column in ("partial_hash", "hash")
+        self.connection.executemany(
+            f"UPDATE content SET {column} = ? WHERE short_name = ? AND rel_path = ?",
+            rows,
+        )
+
+    def delete_content(
+        self, short_name: str, rel_paths: Optional[list[str]] = None
+    ) -> None:
+        if rel_paths is None:
+            self.connection.execute(
+                "DELETE FROM content WHERE short_name = ?", (short_name,)
+            )
+            return
+        self.connection.executemany(
+            "DELETE FROM content WHERE short_name = ? AND rel_path = ?",
+            [(short_name, rel_path) for rel_path in rel_paths],
+        )
+
+    def get_volume_profile(self, volume: str) -> Optional[sqlite3.Row]:
+        """Copy settings measured by `rob bench`. See `rob.bench.VolumeProfile`."""
+        rows = self.query("SELECT * FROM volume_profiles WHERE volume = ?", (volume,))
+        return rows[0] if rows else None
+
+    def save_volume_profile(self, row: dict) -> None:
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" * len(row))
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO volume_profiles ({columns}) VALUES ({placeholders})",
+            tuple(row.values()),
+        )
+
+    def get_folder_by_short_name(self, short_name: str) -> Optional[Folder]:
+        rows = self.query("SELECT * FROM folders WHERE short_name = ?", (short_name,))
+        return self._get_folder(rows[0]) if rows else None
 
     @property
-    def source_dirs(self) -> list[WindowsPath]:
-        return [folder.source_dir for folder in self.folders]
+    def source_dirs(self) -> list[Path]:
+        """Source folders that are symlinks to the library. Warm folders are not included."""
+        return [
+            Path(row["source_dir"])
+            for row in self.query(
+                "SELECT source_dir FROM folders WHERE state != 'warm' ORDER BY id"
+            )
+        ]
 
     @property
     def disk_usage(self) -> list[rob.filesystem.DiskUsage]:
         """Usage for disk containing library and any source disks"""
         paths = [self.library_folder] + self.source_dirs
-        drives = sorted({path.drive for path in paths})
+        drives = sorted({rob.filesystem.get_volume(path) for path in paths})
         return [rob.filesystem.DiskUsage(drive) for drive in drives]
 
     def find_folder(self, search_term: str) -> Optional[Folder]:
-        """Search library by index number, `source_dir` or `target_dir_name`"""
+        """Search library by ID, `source_dir` or `short_name`"""
         if search_term.isnumeric():
-            try:
-                return self.folders[int(search_term)]
-            except IndexError:
-                return None
-        match = next(
-            (x for x in self.folders if x.source_dir == WindowsPath(search_term)), None
-        )
-        if match:
-            return match
-        return next((x for x in self.folders if x.short_name == search_term), None)
-
-    def get_table_data(self, show_size: bool = False) -> list[dict]:
-        results = []
-        for i, item in enumerate(self.folders):
-            results.append(
-                {"Index": i} | item.get_table_data(self, show_size=show_size)
+            rows = self.query("SELECT * FROM folders WHERE id = ?", (int(search_term),))
+        else:
+            rows = self.query(
+                "SELECT * FROM folders WHERE source_key = ? OR short_name = ?",
+                (rob.store.get_path_key(Path(search_term)), search_term),
             )
-        return results
+        return self._get_folder(rows[0]) if rows else None
+
+    @cached_property
+    def size_index(self) -> SizeIndex:
+        """Read by the main thread, as the database can only be used by one thread"""
+        return SizeIndex(self.connection, self.library_folder)
+
+    def set_folder_stats(self, folder: Folder, stats: rob.filesystem.DirStats) -> None:
+        self.connection.execute(
+            """
+            UPDATE folders
+            SET apparent_bytes = ?, allocated_bytes = ?, files = ?, dirs = ?, sized_at = ?
+            WHERE source_key = ?
+            """,
+            (
+                stats.apparent_bytes,
+                stats.allocated_bytes,
+                stats.files,
+                stats.dirs,
+                time.time(),
+                rob.store.get_path_key(folder.source_dir),
+            ),
+        )
+
+    def set_folder_health(self, folder: Folder, health: str) -> None:
+        folder.health = health
+        self.connection.execute(
+            "UPDATE folders SET health = ?, checked_at = ? WHERE source_key = ?",
+            (health, time.time(), rob.store.get_path_key(folder.source_dir)),
+        )
+
+    @cached_property
+    def is_watched(self) -> bool:
+        """
+        Whether `rob watch` is keeping sizes and health of folders up to date. If so,
+        they are read from the database instead of scanning folders.
+        """
+        return rob.locks.is_watch_running(self.library_folder)
+
+    def get_saved_stats(self, folder: Folder) -> rob.filesystem.DirStats:
+        """Stats from the last time `folder` was scanned"""
+        rows = self.query(
+            "SELECT apparent_bytes, allocated_bytes, files, dirs FROM folders WHERE source_key = ?",
+            (rob.store.get_path_key(folder.source_dir),),
+        )
+        if not rows:
+            return rob.filesystem.DirStats()
+        return rob.filesystem.DirStats(
+            **{key: rows[0][key] or 0 for key in rows[0].keys()}
+        )
+
+    def update_size_index(self, folder: Folder) -> None:
+        """
+        Scan library subdir of `folder` if it is in the library, or forget it if not
+
+        Compressed folders don't have a subdir, and keep the stats saved by
+        `compress_folder()`.
+        """
+        saved = self.get_folder(folder.source_dir)
+        if saved and not saved.is_compressed:
+            stats = folder.get_library_data_stats(self, refresh=True)
+            self.set_folder_stats(folder, stats)
+        else:
+            self.size_index.remove(folder.short_name)
+        self.size_index.save()
+        self.connection.commit()
+
+    def find_folders(self, search_term: str) -> list[Folder]:
+        """Same as `find_folder()`, but `search_term` can include wildcards"""
+        if not glob.has_magic(search_term):  # type: ignore
+            folder = self.find_folder(search_term)
+            return [folder] if folder else []
+        return [
+            x
+            for x in self.folders
+            if fnmatch(str(x.source_dir), search_term)
+            or fnmatch(x.short_name, search_term)
+        ]
 
-    def get_test_dir(self) -> WindowsPath:
-        """Directory in library for testing write access"""
-        return self.library_folder.joinpath(f"_{PROJECT_NAME}_test").resolve()
+    def iter_folder_stats(
+        self, refresh: bool = False
+    ) -> Iterator[tuple[Folder, rob.filesystem.DirStats]]:
+        """
+        Scan library subdirs of all folders at the same time. Yield each folder and
+        its stats as soon as its scan finishes. Stats are saved when all are done.
+        """
+        folders = self.folders
+        if not refresh and self.is_watched:
+            for folder in folders:
+                yield folder, self.get_saved_stats(folder)
+            return
+        for folder in folders:
+            if folder.is_compressed:
+                yield folder, folder.get_library_data_stats(self)
+        uncompressed = [folder for folder in folders if not folder.is_compressed]
+        if not uncompressed:
+            return
+        # Read records before the scans start
+        size_index = self.size_index
+        with ThreadPoolExecutor(max_workers=SIZE_WORKERS) as executor:
+            futures = {
+                executor.submit(folder.get_library_data_stats, self, refresh): folder
+                for folder in uncompressed
+            }
+            for future in as_completed(futures):
+                folder, stats = futures[future], future.result()
+                # The database can only be used by this thread
+                self.set_folder_stats(folder, stats)
+                yield folder, stats
+        size_index.save()
+        self.connection.commit()
+
+    def get_table_data(
+        self, show_size: bool = False, refresh: bool = False
+    ) -> list[dict]:
+        folders = self.folders
+        results = [{"ID": folder.id} | folder.get_table_data() for folder in folders]
+        if self.is_watched:
+            for folder, row in zip(folders, results):
+                if folder.health not in (None, "ok"):
+                    row["State"] = f"{folder.state}, {folder.health}"
+        if show_size:
+            stats_by_id = {
+                folder.id: stats for folder, stats in self.iter_folder_stats(refresh)
+            }
+            compressed_bytes = {
+                folder.id: folder.compressed_bytes
+                for folder in self.folders
+                if folder.is_compressed
+            }
+            for row in results:
+                stats = stats_by_id[row["ID"]]
+                row |= {"Size": stats.apparent_bytes, "Files": stats.files}
+                if row["ID"] in compressed_bytes and stats.apparent_bytes:
+                    ratio = compressed_bytes[row["ID"]] / stats.apparent_bytes
+                    row["State"] = f"compressed to {ratio:.0%}"
+        return results
 
     def save(self) -> None:
-        if self.folders:
-            con.print_(
-                f"Saving folder list to {con.style_path(self.config_path)}", end=""
-            )
-            with open(self.config_path, "w", encoding="utf8") as file:
-                file.write(json.dumps([str(item.source_dir) for item in self.folders]))
-            con.print_success()
+        """Commit changes to the folder list"""
+        if self._connection is None or not self._connection.in_transaction:
+            return
+        con.print_(f"Saving folder list to {con.style_path(self.db_path)}", end="")
+        self._connection.commit()
+        con.print_success()
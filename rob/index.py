@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import ClassVar, Optional
+
+import rob.filesystem
+from rob import PROJECT_NAME
+from rob.filesystem import DirStats
+
+
+@dataclass
+class DirRecord:
+    """Totals for the files directly inside a folder, at the time it was scanned"""
+
+    mtime_ns: int
+    "Changes when an entry is added, removed or renamed in the folder"
+    stats: DirStats
+    subdirs: list[str]
+    "Names of subdirs"
+
+    def to_row(self, short_name: str, rel_path: str) -> dict:
+        return {
+            "short_name": short_name,
+            "rel_path": rel_path,
+            "mtime_ns": self.mtime_ns,
+            "subdirs": json.dumps(self.subdirs),
+        } | asdict(self.stats)
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> DirRecord:
+        return cls(
+            mtime_ns=row["mtime_ns"],
+            stats=DirStats(
+                files=row["files"],
+                dirs=row["dirs"],
+                apparent_bytes=row["apparent_bytes"],
+                allocated_bytes=row["allocated_bytes"],
+            ),
+            subdirs=json.loads(row["subdirs"]),
+        )
+
+    @classmethod
+    def from_json(cls, data: list) -> DirRecord:
+        mtime_ns, stats, subdirs = data
+        return cls(mtime_ns=mtime_ns, stats=DirStats(**stats), subdirs=subdirs)
+
+
+@dataclass
+class SizeIndex:
+    """
+    Sizes of library subdirs, stored in the library database
+
+    Each subdir of a folder is stored with its mtime. When the index is read, only
+    folders whose mtime has changed are scanned again. Note that a file which
+    changes size in place doesn't change the mtime of its folder. Use `refresh`
+    to scan everything.
+
+    Records are read when the index is created and written by `save()`, by the
+    thread that owns `connection`. `get_stats()` can be called by other threads.
+    """
+
+    index_filename: ClassVar = f"{PROJECT_NAME}-index.json"
+    "Size index of older versions, which is moved to the database"
+    connection: sqlite3.Connection
+    folders: dict[str, dict[str, DirRecord]]
+    "Records for each subdir, by relative path, for each `Folder.short_name`"
+    changed: set[str]
+    "Names of folders whose records need to be saved"
+
+    def __init__(self, connection: sqlite3.Connection, library_folder: Path):
+        self.connection = connection
+        self.folders = {}
+        self.changed = set()
+        for row in connection.execute("SELECT * FROM dir_records"):
+            self.folders.setdefault(row["short_name"], {})[row["rel_path"]] = (
+                DirRecord.from_row(row)
+            )
+        index_path = library_folder.joinpath(self.index_filename)
+        if index_path.exists():
+            self.migrate_json(index_path)
+
+    def migrate_json(self, index_path: Path) -> None:
+        """Move records of older versions to the database, when it is saved"""
+        try:
+            with open(index_path, encoding="utf8") as file:
+                for short_name, records in json.load(file).items():
+                    if short_name not in self.folders:
+                        self.folders[short_name] = {
+                            rel_path: DirRecord.from_json(record)
+                            for rel_path, record in records.items()
+                        }
+                        self.changed.add(short_name)
+        except (ValueError, TypeError):
+            # It's only a cache. Folders are scanned again if it can't be read.
+            pass
+        index_path.unlink()
+
+    def get_stats(self, short_name: str, path: Path, refresh: bool = False) -> DirStats:
+        """Return totals for `path`, scanning only folders that have changed since last time"""
+        old_records = {} if refresh else self.folders.get(short_name, {})
+        records: dict[str, DirRecord] = {}
+
+        def scan(dir_path: str) -> tuple[Optional[DirRecord], list[str]]:
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                return None, []
+            record = old_records.get(os.path.relpath(dir_path, path))
+            if not record or record.mtime_ns != mtime_ns:
+                stats, subdirs = rob.filesystem.scan_dir(dir_path)
+                record = DirRecord(
+                    mtime_ns=mtime_ns,
+                    stats=stats,
+                    subdirs=[os.path.basename(subdir) for subdir in subdirs],
+                )
+            return record, [os.path.join(dir_path, name) for name in record.subdirs]
+
+        total = DirStats()
+        if path.exists():
+            for dir_path, record in rob.filesystem.walk_dirs(path, scan):
+                if record:
+                    records[os.path.relpath(dir_path, path)] = record
+                    total += record.stats
+        if records != self.folders.get(short_name):
+            self.folders[short_name] = records
+            self.changed.add(short_name)
+        return total
+
+    def update_dirs(self, short_name: str, path: Path, rel_dirs: set[str]) -> DirStats:
+        """
+        Scan `rel_dirs` of `path` again, and any subdirs that are new. Other records
+        are trusted without being checked. Used by `rob watch`, which knows which
+        folders have changed, including files that changed size in place.
+        """
+        records = dict(self.folders.get(short_name, {}))
+        pending = list(rel_dirs)
+        while pending:
+            rel_dir = pending.pop()
+            dir_path = os.path.join(path, rel_dir)
+            old_record = records.pop(rel_dir, None)
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+                stats, subdirs = rob.filesystem.scan_dir(dir_path)
+            except (FileNotFoundError, NotADirectoryError):
+                # Forget its subdirs too
+                prefix = os.path.join(rel_dir, "")
+                records = {
+                    key: value
+                    for key, value in records.items()
+                    if not key.startswith(prefix)
+                }
+                continue
+            record = DirRecord(
+                mtime_ns=mtime_ns,
+                stats=stats,
+                subdirs=[os.path.basename(subdir) for subdir in subdirs],
+            )
+            records[rel_dir] = record
+            old_subdirs = set(old_record.subdirs) if old_record else set()
+            for name in old_subdirs.symmetric_difference(record.subdirs):
+                # New subdirs are scanned, and removed subdirs are forgotten
+                pending.append(os.path.normpath(os.path.join(rel_dir, name)))
+        self.folders[short_name] = records
+        self.changed.add(short_name)
+        total = DirStats()
+        for record in records.values():
+            total += record.stats
+        return total
+
+    def remove(self, short_name: str) -> None:
+        if self.folders.pop(short_name, None) is not None:
+            self.changed.add(short_name)
+
+    def save(self) -> None:
+        """Write records of changed folders. They are committed with the folder list."""
+        for short_name in self.changed:
+            self.connection.execute(
+                "DELETE FROM dir_records WHERE short_name = ?", (short_name,)
+            )
+            self.connection.executemany(
+                """
+                INSERT INTO dir_records
+                    (short_name, rel_path, mtime_ns, files, dirs, apparent_bytes,
+                    allocated_bytes, subdirs)
+                VALUES
+                    (:short_name, :rel_path, :mtime_ns, :files, :dirs, :apparent_bytes,
+                    :allocated_bytes, :subdirs)
+                """,
+                [
+                    record.to_row(short_name, rel_path)
+                    for rel_path, record in self.folders.get(short_name, {}).items()
+                ],
+            )
+        self.changed = set()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import ClassVar, Optional
+
+from rob import PROJECT_NAME
+from rob.folders import Folder, Library
+from rob.manifest import Manifest
+
+
+@dataclass
+class Journal:
+    """
+    Progress of an `add` or `remove` command, saved in the library after each step
+
+    If the command is interrupted, `rob resume` reads the journal to continue from
+    the last completed step.
+    """
+
+    dir_name: ClassVar = f"_{PROJECT_NAME}_journal"
+    library: Library
+    operation: str
+    "`add` or `remove`"
+    folder: Folder
+    manifest: Manifest
+    options: dict = field(default_factory=dict)
+    "Command line options that affect how data is moved"
+    steps_done: list[str] = field(default_factory=list)
+
+    @property
+    def path(self) -> Path:
+        return get_journal_dir(self.library).joinpath(f"{self.folder.short_name}.json")
+
+    def mark_done(self, step: str) -> None:
+        self.steps_done.append(step)
+        self.save()
+
+    def save(self) -> None:
+        data = {
+            "operation": self.operation,
+            "folder": self.folder.to_json(),
+            "options": self.options,
+            "steps_done": self.steps_done,
+            "manifest": self.manifest.to_json(),
+        }
+        self.path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first, so that the journal is never left half written
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf8") as file:
+            json.dump(data, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def delete(self) -> None:
+        self.path.unlink(missing_ok=True)
+        journal_dir = get_journal_dir(self.library)
+        if journal_dir.exists() and not any(journal_dir.iterdir()):
+            journal_dir.rmdir()
+
+
+def get_journal_dir(library: Library) -> Path:
+    return library.library_folder.joinpath(Journal.dir_name)
+
+
+def load_journal(library: Library, path: Path) -> Journal:
+    with open(path, encoding="utf8") as file:
+        data = json.load(file)
+    return Journal(
+        library=library,
+        operation=data["operation"],
+        folder=Folder.from_json(data["folder"]),
+        manifest=Manifest.from_json(data["manifest"]),
+        options=data["options"],
+        steps_done=data["steps_done"],
+    )
+
+
+def find_journal(library: Library, folder: Folder) -> Optional[Journal]:
+    path = get_journal_dir(library).joinpath(f"{folder.short_name}.json")
+    return load_journal(library, path) if path.exists() else None
+
+
+def get_journals(library: Library) -> list[Journal]:
+    """Journals of all interrupted commands in `library`"""
+    journal_dir = get_journal_dir(library)
+    if not journal_dir.exists():
+        return []
+    return [load_journal(library, path) for path in sorted(journal_dir.glob("*.json"))]
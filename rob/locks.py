@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from click import ClickException
+
+from rob import PROJECT_NAME
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+LOCK_DIR_NAME = f"_{PROJECT_NAME}_locks"
+METADATA_LOCK_TIMEOUT_SECONDS = 60
+"How long to wait for another process to finish saving the library"
+POLL_SECONDS = 0.1
+
+
+def get_lock_dir(library_folder: Path) -> Path:
+    return library_folder.joinpath(LOCK_DIR_NAME)
+
+
+@contextmanager
+def file_lock(
+    path: Path, busy_message: str, timeout: Optional[float] = None
+) -> Iterator[None]:
+    """
+    Hold an exclusive lock on `path` that other processes can see
+
+    The lock is released by the OS if the process ends. Wait up to `timeout`
+    seconds for another process to release it, or forever if `None`. Raise
+    `ClickException` with `busy_message` if it is not released in time.
+    """
+    path.parent.mkdir(exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not _try_lock(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise ClickException(busy_message)
+            time.sleep(POLL_SECONDS)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        if os.name == "nt":
+            # Locks the first byte, which doesn't need to exist
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(fd: int) -> None:
+    if os.name == "nt":
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def metadata_lock(library_folder: Path) -> Iterator[None]:
+    """
+    Hold while the folder list is read, changed and saved, so that other processes
+    don't change it at the same time. Keep it short, as other processes wait for it.
+    """
+    with file_lock(
+        get_lock_dir(library_folder).joinpath(f"{PROJECT_NAME}-library.lock"),
+        "Timed out waiting for another rob process to save the folder list",
+        timeout=METADATA_LOCK_TIMEOUT_SECONDS,
+    ):
+        yield
+
+
+@contextmanager
+def folder_lock(library_folder: Path, short_name: str) -> Iterator[None]:
+    """Hold while a folder is moved, so that other processes don't move it too"""
+    with file_lock(
+        get_lock_dir(library_folder).joinpath(f"{short_name}.lock"),
+        f"Folder {short_name} is being moved by another rob process",
+        timeout=0,
+    ):
+        yield
+
+
+@contextmanager
+def gc_lock(library_folder: Path, wait: bool) -> Iterator[None]:
+    """Hold while trash is deleted, so that other processes don't delete it too"""
+    with file_lock(
+        get_lock_dir(library_folder).joinpath(f"{PROJECT_NAME}-gc.lock"),
+        "Trash is being deleted by another rob process",
+        timeout=None if wait else 0,
+    ):
+        yield
+
+
+@contextmanager
+def dedupe_lock(library_folder: Path) -> Iterator[None]:
+    """Hold while files in the library are deduplicated. See `rob.dedupe`."""
+    with file_lock(
+        get_lock_dir(library_folder).joinpath(f"{PROJECT_NAME}-dedupe.lock"),
+        "Files are being deduplicated by another rob process",
+        timeout=0,
+    ):
+        yield
+
+
+def get_watch_lock_path(library_folder: Path) -> Path:
+    return get_lock_dir(library_folder).joinpath(f"{PROJECT_NAME}-watch.lock")
+
+
+@contextmanager
+def watch_lock(library_folder: Path) -> Iterator[None]:
+    """Hold while `rob watch` runs. See `is_watch_running()`."""
+    with file_lock(
+        get_watch_lock_path(library_folder),
+        "rob watch is already running for this library",
+        timeout=0,
+    ):
+        yield
+
+
+def is_watch_running(library_folder: Path) -> bool:
+    """Whether another process holds `watch_lock()`"""
+    path = get_watch_lock_path(library_folder)
+    if not path.exists():
+        return False
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if not _try_lock(fd):
+            return True
+        _unlock(fd)
+        return False
+    finally:
+        os.close(fd)
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import stat
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from click import ClickException
+
+import rob.console as con
+import rob.filesystem
+from rob.filesystem import DirStats
+
+VERIFY_MODES = ["quick", "hash"]
+HASH_WORKERS = 8
+HASH_CHUNK_SIZE = 1024**2
+# FAT and exFAT store mtime to the nearest 2 seconds
+MTIME_TOLERANCE_NS = 2 * 10**9
+MAX_REPORTED_FILES = 10
+
+
+@dataclass
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    is_symlink: bool = False
+
+
+@dataclass
+class Manifest:
+    """Files and subdirs of a folder, by path relative to the folder"""
+
+    files: dict[str, ManifestEntry] = field(default_factory=dict)
+    dirs: set[str] = field(default_factory=set)
+    stats: DirStats = field(default_factory=DirStats)
+
+    def to_json(self) -> dict:
+        return {
+            "files": {
+                rel_path: [entry.size, entry.mtime_ns, entry.is_symlink]
+                for rel_path, entry in self.files.items()
+            },
+            "dirs": sorted(self.dirs),
+            "stats": asdict(self.stats),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> Manifest:
+        return cls(
+            files={
+                rel_path: ManifestEntry(*values)
+                for rel_path, values in data["files"].items()
+            },
+            dirs=set(data["dirs"]),
+            stats=DirStats(**data["stats"]),
+        )
+
+    def compare(self, other: Manifest) -> list[str]:
+        """Return a description of each difference between `self` and `other`"""
+        problems = []
+        for rel_path in sorted(self.dirs - other.dirs):
+            problems.append(f"Missing folder {rel_path}")
+        for rel_path in sorted(other.dirs - self.dirs):
+            problems.append(f"Unexpected folder {rel_path}")
+        for rel_path in sorted(other.files.keys() - self.files.keys()):
+            problems.append(f"Unexpected file {rel_path}")
+        for rel_path, entry in sorted(self.files.items()):
+            other_entry = other.files.get(rel_path)
+            if other_entry is None:
+                problems.append(f"Missing file {rel_path}")
+            elif entry.size != other_entry.size:
+                problems.append(
+                    f"Size of {rel_path} is {other_entry.size:,} bytes, expected {entry.size:,}"
+                )
+            elif (
+                not entry.is_symlink
+                and abs(entry.mtime_ns - other_entry.mtime_ns) > MTIME_TOLERANCE_NS
+            ):
+                problems.append(f"Modified time of {rel_path} does not match")
+        return problems
+
+
+@dataclass
+class ManifestChanges:
+    """Differences between the manifests of a source folder and an older copy of it"""
+
+    changed_files: list[str]
+    "New or modified in source"
+    copy_bytes: int
+    deleted_files: list[str]
+    "Files or symlinks to delete from the copy before it is updated"
+    deleted_dirs: list[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.changed_files or self.deleted_files or self.deleted_dirs)
+
+
+def get_changes(source: Manifest, copy: Manifest) -> ManifestChanges:
+    """Find what needs to be copied and deleted to make `copy` match `source`"""
+    changed_files = {
+        rel_path
+        for rel_path, entry in source.files.items()
+        if _is_changed(entry, copy.files.get(rel_path))
+    }
+    # Symlinks are replaced rather than updated
+    deleted_files = [
+        rel_path
+        for rel_path, entry in copy.files.items()
+        if rel_path not in source.files
+        or (
+            rel_path in changed_files
+            and (entry.is_symlink or source.files[rel_path].is_symlink)
+        )
+    ]
+    return ManifestChanges(
+        changed_files=sorted(changed_files),
+        copy_bytes=sum(source.files[rel_path].size for rel_path in changed_files),
+        deleted_files=sorted(deleted_files),
+        deleted_dirs=sorted(copy.dirs - source.dirs),
+    )
+
+
+def _is_changed(entry: ManifestEntry, copy_entry: Optional[ManifestEntry]) -> bool:
+    if copy_entry and entry.is_symlink and copy_entry.is_symlink:
+        # A copy of a symlink is made when it is copied, so its modified time doesn't
+        # match. Its size is the length of its target. The copy engine also checks
+        # that targets match.
+        return entry.size != copy_entry.size
+    return copy_entry != entry
+
+
+def build_manifest(path: Path) -> Manifest:
+    """Scan `path` and its subdirs with a pool of threads"""
+    manifest = Manifest()
+    if not path.exists():
+        return manifest
+    for dir_path, (stats, files) in rob.filesystem.walk_dirs(path, _scan):
+        rel_dir = os.path.relpath(dir_path, path)
+        if rel_dir != os.curdir:
+            manifest.dirs.add(rel_dir)
+        else:
+            rel_dir = ""
+        manifest.stats += stats
+        for name, file_stat in files:
+            manifest.files[os.path.join(rel_dir, name)] = ManifestEntry(
+                size=file_stat.st_size,
+                mtime_ns=file_stat.st_mtime_ns,
+                is_symlink=stat.S_ISLNK(file_stat.st_mode),
+            )
+    return manifest
+
+
+def _scan(path: str):
+    stats, files, subdirs = rob.filesystem.list_dir(path)
+    return (stats, files), subdirs
+
+
+def hash_file(path: Path) -> bytes:
+    """Memory use is limited to one chunk at a time"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def compare_hashes(manifest: Manifest, source: Path, target: Path) -> list[str]:
+    """
+    Hash files in `source` and `target` at the same time. Return a problem for each
+    file that differs.
+
+    Only `HASH_WORKERS` files are queued at once, so memory use doesn't grow with the
+    number of files.
+    """
+    rel_paths = (
+        rel_path for rel_path, entry in manifest.files.items() if not entry.is_symlink
+    )
+    pending: deque[tuple[str, Future, Future]] = deque()
+    problems = []
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        while True:
+            while len(pending) < HASH_WORKERS and (rel_path := next(rel_paths, None)):
+                pending.append(
+                    (
+                        rel_path,
+                        executor.submit(hash_file, source.joinpath(rel_path)),
+                        executor.submit(hash_file, target.joinpath(rel_path)),
+                    )
+                )
+            if not pending:
+                return problems
+            rel_path, source_hash, target_hash = pending.popleft()
+            if source_hash.result() != target_hash.result():
+                problems.append(f"Content of {rel_path} does not match")
+
+
+def verify_copy(
+    manifest: Manifest,
+    source: Path,
+    target: Path,
+    mode: str = "quick",
+    dry_run: bool = False,
+) -> None:
+    """
+    Check that `target` matches `manifest`, which was made before `source` was copied
+
+    "quick" mode compares paths, sizes and modified times. "hash" mode also compares
+    the content of each file in `source` and `target`.
+    """
+    con.print_(f"Verifying data in {con.style_path(target)}", end="")
+    if dry_run:
+        con.print_skipped()
+        return
+
+    problems = manifest.compare(build_manifest(target))
+    if not problems and mode == "hash":
+        problems = compare_hashes(manifest, source, target)
+    raise_if_problems(problems, "Source and target folders do not match. Aborting.")
+
+
+def raise_if_problems(problems: list[str], message: str) -> None:
+    """Print `problems` and raise `ClickException` with `message`, or print success"""
+    if problems:
+        con.print_fail()
+        for problem in problems[:MAX_REPORTED_FILES]:
+            con.print_(f"[red]{problem}[/red]")
+        if len(problems) > MAX_REPORTED_FILES:
+            con.print_(f"[red]...and {len(problems) - MAX_REPORTED_FILES} more[/red]")
+        raise ClickException(message)
+    con.print_success()
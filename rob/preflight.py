@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Callable, Optional
+
+import rob.console as con
+import rob.store
+from rob import PROJECT_NAME
+from rob.filesystem import get_volume
+from rob.folders import Folder, Library
+
+PROBE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+"How long a check that passed is trusted for"
+PROBE_WORKERS = 4
+
+
+@dataclass
+class Probe:
+    """
+    A pre-flight check that creates test folders, which can be slow, e.g. on network
+    shares. Its result is cached for the volumes it tests.
+    """
+
+    name: str
+    run: Callable[[], Optional[bool]]
+    "Raises `ClickException` if the check fails"
+    source: str
+    "Volume or folder that the check depends on"
+    target: str = ""
+
+    @property
+    def cache_key(self) -> tuple[str, str, str, str]:
+        return (self.name, self.source, self.target, get_privilege_level())
+
+
+@cache
+def get_privilege_level() -> str:
+    """Checks can pass for administrators and fail for other users"""
+    if os.name == "nt":
+        # pylint: disable=import-outside-toplevel
+        import ctypes
+
+        return "admin" if ctypes.windll.shell32.IsUserAnAdmin() else "user"
+    return "admin" if os.geteuid() == 0 else "user"
+
+
+def get_probe_dir(parent: Path, folder: Folder, name: str) -> Path:
+    """A test folder in `parent` that isn't used by other probes or rob processes"""
+    return parent.joinpath(
+        f"_{PROJECT_NAME}_probe_{folder.short_name}_{name}"
+    ).resolve()
+
+
+def get_folder_key(path: Path) -> str:
+    """Write access depends on the folder, not only its volume"""
+    return rob.store.get_path_key(path)
+
+
+def get_volume_key(path: Path) -> str:
+    return rob.store.get_path_key(Path(get_volume(path)))
+
+
+def run_probes(
+    library: Library,
+    probes: list[Probe],
+    recheck: bool = False,
+    dry_run: bool = False,
+) -> list[Optional[bool]]:
+    """
+    Run `probes` at the same time, skipping those that passed recently unless
+    `recheck`. Output is printed in order. Return the result of each probe.
+
+    Results are not saved if `dry_run`, so that the library isn't changed.
+    """
+    since = 0.0 if recheck else time.time() - PROBE_CACHE_TTL_SECONDS
+    results: list[Optional[bool]] = []
+    to_run: dict[int, Future] = {}
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        for index, probe in enumerate(probes):
+            row = None if recheck else library.get_probe(probe.cache_key, since)
+            if row is None:
+                to_run[index] = executor.submit(_run_probe, probe)
+                results.append(None)
+            else:
+                results.append(None if row["result"] is None else bool(row["result"]))
+        # Print output of each probe before raising its error
+        for index, future in to_run.items():
+            captured, error, result = future.result()
+            con.print_captured(captured)
+            if error:
+                raise error
+            results[index] = result
+    if cached_count := len(probes) - len(to_run):
+        con.print_(
+            f"[grey50]Skipped {cached_count} checks that passed recently. Use --recheck to run them again.[/grey50]"
+        )
+    if to_run and not dry_run:
+        for index in to_run:
+            library.save_probe(probes[index].cache_key, results[index])
+        library.connection.commit()
+    return results
+
+
+def _run_probe(
+    probe: Probe,
+) -> tuple[list[str], Optional[BaseException], Optional[bool]]:
+    with con.captured_output() as captured:
+        try:
+            return captured, None, probe.run()
+        except Exception as e:  # pylint: disable=broad-except
+            # Raised in the main thread, after output of earlier probes is printed
+            return captured, e, None
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import rob.console as con
+import rob.filesystem
+from rob.filesystem import DirStats
+from rob.folders import Folder, Library
+
+KNAPSACK_UNITS = 4096
+"Folder sizes are rounded to this many units, to limit the work done to choose folders"
+ESTIMATED_BYTES_PER_SECOND = {True: 120 * 1024**2, False: 400 * 1024**2}
+"Typical copy speed for spinning disks (`True`) and other disks"
+
+
+@dataclass
+class Candidate:
+    """A folder that could be moved between the fast drive and the library"""
+
+    folder: Folder
+    stats: DirStats
+    last_access: Optional[datetime] = None
+    "Most recent access time of any file in the folder, if it was scanned"
+
+    @property
+    def size_bytes(self) -> int:
+        # Allocated size is what is freed on the drive
+        return self.stats.allocated_bytes
+
+
+@dataclass
+class RebalancePlan:
+    drive: str
+    goal_bytes: int
+    "Free space wanted on `drive`"
+    free_bytes: int
+    to_library: list[Candidate] = field(default_factory=list)
+    "Folders to add to the library"
+    to_drive: list[Candidate] = field(default_factory=list)
+    "Folders to remove from the library, as they are to be kept hot"
+
+    @property
+    def free_bytes_after(self) -> int:
+        return (
+            self.free_bytes
+            + sum(candidate.size_bytes for candidate in self.to_library)
+            - sum(candidate.size_bytes for candidate in self.to_drive)
+        )
+
+    @property
+    def bytes_moved(self) -> int:
+        return sum(
+            candidate.stats.apparent_bytes
+            for candidate in self.to_library + self.to_drive
+        )
+
+    def estimate_duration(self, library: Library) -> timedelta:
+        disk = rob.filesystem.get_physical_disk(library.library_folder)
+        rotational = rob.filesystem.is_rotational(disk) is not False
+        return timedelta(
+            seconds=round(self.bytes_moved / ESTIMATED_BYTES_PER_SECOND[rotational])
+        )
+
+
+def scan_candidate(folder: Folder) -> Candidate:
+    """Find size and last access time of `folder.source_dir`"""
+    stats = DirStats()
+    last_access = 0.0
+    for _, (dir_stats, files) in rob.filesystem.walk_dirs(folder.source_dir, _scan):
+        stats += dir_stats
+        for _, file_stat in files:
+            last_access = max(last_access, file_stat.st_atime)
+    return Candidate(
+        folder=folder,
+        stats=stats,
+        last_access=datetime.fromtimestamp(last_access) if last_access else None,
+    )
+
+
+def _scan(path: str):
+    stats, files, subdirs = rob.filesystem.list_dir(path)
+    return (stats, files), subdirs
+
+
+def choose_folders(candidates: list[Candidate], need_bytes: int) -> list[Candidate]:
+    """
+    Choose candidates whose total size is at least `need_bytes`, so that as few bytes
+    as possible are moved
+
+    This is a subset sum problem, solved with a table of reachable totals. Folders
+    that were accessed least recently are tried first, so they are preferred when
+    choices have the same total. If the goal can't be reached, all candidates are
+    returned.
+    """
+    if need_bytes <= 0:
+        return []
+    total_bytes = sum(candidate.size_bytes for candidate in candidates)
+    if total_bytes < need_bytes:
+        return list(candidates)
+
+    unit = max(1, math.ceil(total_bytes / KNAPSACK_UNITS))
+    # Round sizes down and the goal up, so that the real total is never short
+    need_units = math.ceil(need_bytes / unit)
+    by_last_access = sorted(
+        candidates,
+        key=lambda candidate: candidate.last_access or datetime.min,
+    )
+    # Total in units => indexes of candidates that reach it
+    reachable: dict[int, tuple[int, ...]] = {0: ()}
+    for index, candidate in enumerate(by_last_access):
+        size_units = candidate.size_bytes // unit
+        for total, chosen in list(reachable.items()):
+            new_total = total + size_units
+            if new_total not in reachable:
+                reachable[new_total] = chosen + (index,)
+    best = min(total for total in reachable if total >= need_units)
+    return [by_last_access[index] for index in reachable[best]]
+
+
+def make_plan(
+    library: Library,
+    drive: str,
+    goal_bytes: int,
+    candidates: list[Candidate],
+    keep_hot: list[Candidate],
+) -> RebalancePlan:
+    """
+    Plan moves so that `drive` has at least `goal_bytes` free
+
+    `keep_hot` folders that are in the library are moved back to the drive first.
+    Then the fewest bytes of `candidates` are moved to the library to reach the goal.
+    """
+    plan = RebalancePlan(
+        drive=drive,
+        goal_bytes=goal_bytes,
+        free_bytes=rob.filesystem.DiskUsage(drive).usage.free,
+        to_drive=[
+            candidate
+            for candidate in keep_hot
+            if candidate.folder in library and not candidate.folder.is_warm
+        ],
+    )
+    plan.to_library = choose_folders(candidates, goal_bytes - plan.free_bytes_after)
+    return plan
+
+
+def print_plan(plan: RebalancePlan, library: Library) -> None:
+    con.print_("\n[bold]Plan[/bold]")
+    for candidate in plan.to_drive:
+        con.print_(
+            f"Remove {con.style_path(candidate.folder.source_dir)} from library "
+            f"({con.style_bytes_as_gb(candidate.size_bytes)}, kept hot)"
+        )
+    for candidate in plan.to_library:
+        last_access = (
+            candidate.last_access.strftime("%Y-%m-%d")
+            if candidate.last_access
+            else "unknown"
+        )
+        con.print_(
+            f"Add {con.style_path(candidate.folder.source_dir)} to library "
+            f"({con.style_bytes_as_gb(candidate.size_bytes)}, last used {last_access})"
+        )
+    if not plan.to_drive and not plan.to_library:
+        con.print_("Nothing to move")
+    con.print_(
+        f"\nFree space on drive {con.style_path(plan.drive)}: "
+        f"{con.style_bytes_as_gb(plan.free_bytes)} now, "
+        f"{con.style_bytes_as_gb(plan.free_bytes_after)} after "
+        f"(goal {con.style_bytes_as_gb(plan.goal_bytes)})"
+    )
+    if plan.free_bytes_after < plan.goal_bytes:
+        con.print_(
+            "[yellow]Goal cannot be reached by moving these folders. Add more folders to choose from.[/yellow]"
+        )
+    con.print_(
+        f"Data to move: {con.style_bytes_as_gb(plan.bytes_moved)}, "
+        f"estimated duration {plan.estimate_duration(library)}"
+    )
+
+
+def get_fast_drive(paths: list[Path]) -> Optional[str]:
+    """The drive of `paths`, from `get_volume()`, if they are all on one drive"""
+    drives = {rob.filesystem.get_volume(path) for path in paths}
+    return drives.pop() if len(drives) == 1 else None
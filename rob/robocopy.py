@@ -1,129 +1,259 @@
+import math
 import os
+import re
 import subprocess
-from dataclasses import dataclass
-from pathlib import WindowsPath
-from time import sleep
-from typing import Optional, Sequence
+from dataclasses import dataclass, field
+from datetime import timedelta
+from pathlib import Path
+from typing import ClassVar, Optional
 
 from click import ClickException
-from rich.progress import Progress
 
-import rob.console as con
-import rob.filesystem
+from rob.engines import CopyEngine, CopyStats, ProgressCallback
+
+# A line of the file list, e.g. "\t    New File  \t\t    1048576\tC:\\Games\\data.pak"
+ROBOCOPY_FILE_LINE = re.compile(
+    r"^\s*(New File|Newer|Older|Changed|Tweaked|Modified|Same|Mismatch)\s+(?P<bytes>\d+)\s"
+)
+# Lines that are not errors, e.g. "\t*EXTRA File \t\t 123\told.log" for a file that is
+# only in the target. Extra files are left alone, as /PURGE is not used.
+ROBOCOPY_INFO_LINE = re.compile(r"^\s*(\*EXTRA File|\*EXTRA Dir|New Dir)\s")
+ROBOCOPY_ERROR_LINE = re.compile(r"\bERROR\b")
+ROBOCOPY_BLOCK_BYTES = 64 * 1024
+"robocopy /IPG waits after each block of this size"
+
+
+@dataclass
+class RobocopyCounts:
+    """A row of the summary table, e.g. `Files : 2 2 0 0 0 0`"""
+
+    total: int
+    copied: int
+    skipped: int
+    mismatch: int
+    failed: int
+    extras: int
+
+
+@dataclass
+class RobocopyTimes:
+    """The "Times" row of the summary table"""
+
+    total: timedelta
+    copying: timedelta
+    failed: timedelta
+    extras: timedelta
 
 
 @dataclass
 class RobocopyResults:
-    options: list[str]
-    # Using Sequence because "list" and other mutable container types are
-    # considered "invariant", so the contained type needs to match exactly.
-    # https://github.com/microsoft/pyright/issues/130
-    errors: Sequence[Optional[str]]
-    stats: Sequence[Optional[str]]
+    options: list[str] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    dirs: Optional[RobocopyCounts] = None
+    files: Optional[RobocopyCounts] = None
+    bytes_: Optional[RobocopyCounts] = None
+    "Only in bytes if robocopy is run with /BYTES"
+    times: Optional[RobocopyTimes] = None
+    bytes_per_second: Optional[int] = None
+    "Not shown by all versions of robocopy"
+
+
+@dataclass
+class RobocopyParser:
+    """
+    Parse robocopy output as it is written, one line at a time
+
+    Sections of output are separated by dividers:
+    title, options, file list and errors, then summary.
+    """
+
+    progress: Optional[ProgressCallback] = None
+    """
+    Called with the size of each file in the file list, when it has been copied.
+    robocopy lists a file when it starts to copy it, so a file is done when the next
+    one is listed, or the file list ends.
+    """
+    raise_errors: bool = True
+    "Raise `ClickException` as soon as an error is found"
+    results: RobocopyResults = field(default_factory=RobocopyResults)
+    _dividers: int = 0
+    _pending_error: Optional[str] = None
+    _pending_bytes: int = 0
+    "Size of the file that is being copied"
+    _summary_rows: int = 0
+
+    def feed(self, line: str) -> None:
+        line = line.rstrip("\r\n")
+        # 50 chars long. Finds dividers in output, which are 78/79 chars.
+        if "--------------------------------------------------" in line:
+            self._end_error()
+            self._end_file()
+            self._dividers += 1
+            return
+        if not line.strip():
+            return
+        if self._dividers == 2:
+            self.results.options.append(line)
+        elif self._dividers == 3:
+            self._parse_body_line(line)
+        elif self._dividers >= 4:
+            self._parse_summary_line(line)
+
+    def close(self) -> RobocopyResults:
+        """Call at end of output"""
+        self._end_error()
+        self._end_file()
+        return self.results
+
+    def _parse_body_line(self, line: str) -> None:
+        if match := ROBOCOPY_FILE_LINE.match(line):
+            self._end_error()
+            self._end_file()
+            self._pending_bytes = int(match["bytes"])
+        elif ROBOCOPY_INFO_LINE.match(line):
+            self._end_error()
+        elif ROBOCOPY_ERROR_LINE.search(line):
+            # e.g. "2022/01/31 12:00:00 ERROR 5 (0x00000005) Copying File C:\\Games\\data.pak"
+            # The next line is a description of the error, e.g. "Access is denied."
+            self._end_error()
+            self._pending_error = line.strip()
+        elif self._pending_error:
+            self._add_error(f"{self._pending_error} {line.strip()}")
+        # Other lines are informational, e.g. "Waiting 30 seconds... Retrying..."
+
+    def _end_file(self) -> None:
+        if self._pending_bytes and self.progress:
+            self.progress(self._pending_bytes)
+        self._pending_bytes = 0
+
+    def _end_error(self) -> None:
+        if self._pending_error:
+            self._add_error(self._pending_error)
+
+    def _add_error(self, error: str) -> None:
+        self._pending_error = None
+        self.results.errors.append(error)
+        if self.raise_errors:
+            raise ClickException(f"Robocopy: {error}")
+
+    def _parse_summary_line(self, line: str) -> None:
+        # Labels are translated in other languages of Windows, so rows are
+        # identified by their order and their values, not by their labels
+        if ":" not in line:
+            # Column headers
+            return
+        values = line.split(":", maxsplit=1)[1].split()
+        self._summary_rows += 1
+        if (
+            self._summary_rows <= 3
+            and len(values) == 6
+            and all(value.isdigit() for value in values)
+        ):
+            counts = RobocopyCounts(*(int(value) for value in values))
+            if self._summary_rows == 1:
+                self.results.dirs = counts
+            elif self._summary_rows == 2:
+                self.results.files = counts
+            else:
+                self.results.bytes_ = counts
+        elif self._summary_rows == 4 and len(values) == 4:
+            self.results.times = RobocopyTimes(
+                *(_parse_robocopy_time(value) for value in values)
+            )
+        elif self._summary_rows == 5 and values and values[0].isdigit():
+            self.results.bytes_per_second = int(values[0])
+
+
+def _parse_robocopy_time(value: str) -> timedelta:
+    hours, minutes, seconds = (int(part) for part in value.split(":"))
+    return timedelta(hours=hours, minutes=minutes, seconds=seconds)
 
 
 def parse_robocopy_output(
     output: str,
 ) -> RobocopyResults:
-    output_list = output.split("\n")
-    output_list = [line for line in output_list if line]
-    divider_idx = []
-    for index, line in enumerate(output_list):
-        # 50 chars long. Finds dividers in output, which are 78/79 chars.
-        if "--------------------------------------------------" in line:
-            divider_idx.append(index)
-
-    options = output_list[divider_idx[1] + 1 : divider_idx[2]]
-    if len(divider_idx) == 3:
-        errors = output_list[divider_idx[2] + 1 :]
-        stats = []
-    else:
-        errors = output_list[divider_idx[2] + 1 : divider_idx[3]]
-        stats = output_list[divider_idx[3] + 1 :]
-
-    return RobocopyResults(
-        options=options,
-        errors=errors,
-        stats=stats,
-    )
-
-
-def run_robocopy(
-    source: WindowsPath,
-    target: WindowsPath,
-    dir_size_bytes: Optional[int] = None,
-    dry_run: bool = False,
-    copy_permissions: bool = False,
-    quiet=False,
-) -> None:
-    msg = f"Copying data from {con.style_path(source)} to {con.style_path(target)}"
-    if not dir_size_bytes:
-        dir_size_bytes = rob.filesystem.get_dir_size(source)
-    if target.exists():
-        con.print_(msg)
-        raise ClickException("{target} already exists")
-    if dry_run:
-        con.print_(msg, end="")
-        con.print_skipped()
-        return
-    if not quiet:
-        con.print_(msg)
-
-    robocopy_exe = (
-        WindowsPath(os.environ["SystemRoot"])
-        .joinpath("system32/robocopy.exe")
-        .resolve()
-    )
-    robocopy_args = [
-        str(robocopy_exe),
-        str(source),
-        str(target),
-        "/E",  # copy subdirectories, including Empty ones.
-        "/MT",  # Do multi-threaded copies with n threads (default 8).
-        "/R:0",  # number of Retries on failed copies: default 1 million.
-        "/NDL",  # No Directory List - don't log directory names.
-        "/NFL",  # No File List - don't log file names.
-        "/NP",  # No Progress - don't display percentage copied.
-    ]
-    if copy_permissions:
-        robocopy_args.append(
-            # /COPY flags: D=Data, A=Attributes, T=Timestamps, X=Skip alt data streams,
-            # S=Security=NTFS ACLs, O=Owner info, U=aUditing info
-            "/COPY:DATSO"
+    """Parse all output of a finished robocopy process"""
+    parser = RobocopyParser(raise_errors=False)
+    for line in output.split("\n"):
+        parser.feed(line)
+    return parser.close()
+
+
+@dataclass
+class RobocopyEngine(CopyEngine):
+    """Copy with `robocopy.exe`, which is included with Windows"""
+
+    name: ClassVar = "robocopy"
+    copies_ntfs_permissions: ClassVar = True
+
+    def copy_tree(
+        self,
+        source: Path,
+        target: Path,
+        copy_permissions: bool,
+        progress: ProgressCallback,
+        incremental: bool,
+    ) -> CopyStats:
+        # robocopy is always incremental: it skips files that have the same size and
+        # modified time in source and target
+        robocopy_exe = (
+            Path(os.environ["SystemRoot"]).joinpath("system32/robocopy.exe").resolve()
         )
+        robocopy_args = [
+            str(robocopy_exe),
+            str(source),
+            str(target),
+            "/E",  # copy subdirectories, including Empty ones.
+            "/R:0",  # number of Retries on failed copies: default 1 million.
+            "/NDL",  # No Directory List - don't log directory names.
+            "/NP",  # No Progress - don't display percentage copied.
+            "/BYTES",  # Print sizes as bytes. File list is used for progress.
+        ]
+        if self.throttle and self.throttle.max_rate:
+            # Inter-Packet Gap: wait n ms after each block. It can't be used with /MT.
+            gap_ms = math.ceil(ROBOCOPY_BLOCK_BYTES / self.throttle.max_rate * 1000)
+            robocopy_args.append(f"/IPG:{gap_ms}")
+        else:
+            # Do multi-threaded copies with n threads. Threads copy a file each, so
+            # they mostly help with small files.
+            robocopy_args.append(f"/MT:{self.small_file_threads or self.threads}")
+        if copy_permissions:
+            robocopy_args.append(
+                # /COPY flags: D=Data, A=Attributes, T=Timestamps, X=Skip alt data streams,
+                # S=Security=NTFS ACLs, O=Owner info, U=aUditing info
+                "/COPY:DATSO"
+            )
 
-    proc = subprocess.Popen(
-        args=robocopy_args,
-        stdout=subprocess.PIPE,
-        # stderr included for completeness, robocopy doesn't seem to use it
-        stderr=subprocess.STDOUT,
-        text=True,
-    )
-    while proc.poll() is None:
-        # "is None" so that returncode 0 breaks loop
-        # 0: No errors occurred, and no copying was done.
-        #    The source and destination directory trees are completely synchronized.
-        # 1: One or more files were copied successfully (that is, new files have arrived).
-        # https://ss64.com/nt/robocopy-exit.html
-        if not quiet:
-            with Progress(auto_refresh=False, transient=True) as progress:
-                task_id = progress.add_task(
-                    "[green]Copying data...[/green]", total=dir_size_bytes
-                )
-                progress.update(task_id, completed=rob.filesystem.get_dir_size(target))
-                progress.refresh()
-                sleep(2)
-
-    output = proc.stdout.read()  # type: ignore
-    # Exit code cannot be trusted as, for example, this error:
-    # ERROR 5 (0x00000005) Copying NTFS Security to Destination Directory
-    # ...can be present despite returncode 0, so let's look for errors ourselves
-    robocopy_results = parse_robocopy_output(output)
-    if robocopy_results.errors:
-        raise ClickException(f"Robocopy: {str(robocopy_results.errors)}")
-
-    if dir_size_bytes != rob.filesystem.get_dir_size(target):
-        raise ClickException("Source and target folder sizes do not match. Aborting.")
-
-    if not quiet:
-        con.print_("[green]Data copy complete[/green]")
+        parser = RobocopyParser(progress=progress)
+        # Output is parsed as it is written, so that the pipe never fills up and
+        # blocks robocopy, and so that we can stop at the first error.
+        with subprocess.Popen(
+            args=robocopy_args,
+            stdout=subprocess.PIPE,
+            # stderr included for completeness, robocopy doesn't seem to use it
+            stderr=subprocess.STDOUT,
+            text=True,
+            # Low CPU and disk priority. robocopy can't adapt its rate as it runs.
+            creationflags=(
+                subprocess.IDLE_PRIORITY_CLASS  # type: ignore
+                if self.throttle and self.throttle.adaptive
+                else 0
+            ),
+        ) as proc:
+            try:
+                for line in proc.stdout:  # type: ignore
+                    # Exit code cannot be trusted as, for example, this error:
+                    # ERROR 5 (0x00000005) Copying NTFS Security to Destination Directory
+                    # ...can be present despite returncode 0, so let's look for errors ourselves
+                    parser.feed(line)
+                results = parser.close()
+            except ClickException:
+                proc.kill()
+                raise
+
+        files, bytes_, times = results.files, results.bytes_, results.times
+        return CopyStats(
+            files_copied=files.copied if files else 0,
+            bytes_copied=bytes_.copied if bytes_ else 0,
+            seconds=times.copying.total_seconds() if times else 0,
+        )
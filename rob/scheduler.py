@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from click import ClickException
+
+import rob.console as con
+from rob.filesystem import is_rotational
+
+SOLID_STATE_JOBS = 4
+"Number of jobs that may use a disk at once, if it is not a spinning disk"
+
+
+@dataclass
+class Job:
+    name: str
+    disks: set[str]
+    "Physical disks that the job reads from or writes to. See `get_physical_disk()`."
+    run: Callable[[], None]
+    error: Optional[Exception] = field(default=None, init=False)
+
+
+def get_disk_slots(disk: str) -> int:
+    """Spinning disks are slowed down by seeking between jobs, so only run one job at a time"""
+    return SOLID_STATE_JOBS if is_rotational(disk) is False else 1
+
+
+def run_jobs(jobs: list[Job]) -> list[Job]:
+    """
+    Run jobs at the same time if they use different disks
+
+    Jobs start in order, as soon as slots are free on all of their disks. A job that
+    fails doesn't stop the others. Return jobs that failed.
+    """
+    free_slots = {
+        disk: get_disk_slots(disk) for disk in set().union(*(job.disks for job in jobs))
+    }
+    waiting = list(jobs)
+    running: dict[Future, Job] = {}
+
+    with ThreadPoolExecutor(max_workers=len(jobs) or 1) as executor:
+        while waiting or running:
+            for job in list(waiting):
+                if all(free_slots[disk] for disk in job.disks):
+                    for disk in job.disks:
+                        free_slots[disk] -= 1
+                    waiting.remove(job)
+                    running[executor.submit(_run_job, job)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                for disk in job.disks:
+                    free_slots[disk] += 1
+                future.result()
+    return [job for job in jobs if job.error]
+
+
+def _run_job(job: Job) -> None:
+    with con.job_output(job.name):
+        try:
+            job.run()
+        except ClickException as e:
+            job.error = e
+            con.print_(f"[red]Error: {e.message}[/red]")
+        except Exception as e:  # pylint: disable=broad-except
+            # e.g. `OSError` from a disk that was disconnected
+            job.error = e
+            con.print_(f"[red]Error: {e}[/red]")
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from pathlib import Path
+
+MIGRATIONS = [
+    """
+    CREATE TABLE folders (
+        id INTEGER PRIMARY KEY,
+        source_dir TEXT NOT NULL,
+        source_key TEXT NOT NULL UNIQUE,
+        short_name TEXT NOT NULL UNIQUE,
+        state TEXT NOT NULL DEFAULT 'active',
+        added_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        apparent_bytes INTEGER,
+        allocated_bytes INTEGER,
+        files INTEGER,
+        dirs INTEGER,
+        sized_at REAL
+    );
+    CREATE INDEX folders_state ON folders (state);
+    CREATE TABLE history (
+        id INTEGER PRIMARY KEY,
+        folder_id INTEGER,
+        source_dir TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        bytes INTEGER,
+        at REAL NOT NULL
+    );
+    CREATE INDEX history_folder_id ON history (folder_id);
+    """,
+    """
+    CREATE TABLE probes (
+        probe TEXT NOT NULL,
+        source TEXT NOT NULL,
+        target TEXT NOT NULL,
+        privilege TEXT NOT NULL,
+        result INTEGER,
+        checked_at REAL NOT NULL,
+        PRIMARY KEY (probe, source, target, privilege)
+    );
+    """,
+    """
+    CREATE TABLE volume_profiles (
+        volume TEXT PRIMARY KEY,
+        threads INTEGER NOT NULL,
+        small_file_threads INTEGER NOT NULL,
+        buffer_size INTEGER NOT NULL,
+        read_bytes_per_second REAL NOT NULL,
+        write_bytes_per_second REAL NOT NULL,
+        small_files_per_second REAL NOT NULL,
+        measured_at REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE folders ADD COLUMN compressed_bytes INTEGER;
+    ALTER TABLE folders ADD COLUMN compress_bytes_per_second REAL;
+    """,
+    """
+    CREATE TABLE content (
+        short_name TEXT NOT NULL,
+        rel_path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        partial_hash BLOB,
+        hash BLOB,
+        PRIMARY KEY (short_name, rel_path)
+    );
+    CREATE INDEX content_size ON content (size);
+    """,
+    """
+    ALTER TABLE folders ADD COLUMN health TEXT;
+    ALTER TABLE folders ADD COLUMN checked_at REAL;
+    """,
+    """
+    CREATE TABLE dir_records (
+        short_name TEXT NOT NULL,
+        rel_path TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        files INTEGER NOT NULL,
+        dirs INTEGER NOT NULL,
+        apparent_bytes INTEGER NOT NULL,
+        allocated_bytes INTEGER NOT NULL,
+        subdirs TEXT NOT NULL,
+        PRIMARY KEY (short_name, rel_path)
+    );
+    """,
+]
+"""
+Scripts that update the database schema, in order. The number of scripts that have
+been run is stored in `PRAGMA user_version`. Only add to the end of this list.
+"""
+BUSY_TIMEOUT_SECONDS = 30
+"How long to wait for another process to finish writing"
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """
+    Open the library database, creating it or updating its schema if needed
+
+    Changes are made in a transaction that is only written by `commit()`.
+    """
+    connection = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS)
+    connection.row_factory = sqlite3.Row
+    # Not using write-ahead log, as it doesn't work if the library is a network share
+    connection.execute("PRAGMA synchronous = FULL")
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for index, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        connection.executescript(
+            f"BEGIN; {script}; PRAGMA user_version = {index}; COMMIT;"
+        )
+    return connection
+
+
+def get_path_key(path: Path) -> str:
+    """Paths that are the same folder have the same key, e.g. on Windows case is ignored"""
+    return os.path.normcase(str(path))
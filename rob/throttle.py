@@ -0,0 +1,153 @@
+"""
+Limit how fast data is copied, so that other programs can use the disk
+
+A token bucket holds back copy threads to `max_rate`. In background mode the rate
+also adapts: it is halved when copying a chunk takes much longer than usual, which
+means that another program is using the disk, and it grows slowly again while the
+disk is quiet.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+THROTTLE_CHUNK_BYTES = 1024**2
+"Data is copied in chunks of this size when throttled, so that pauses are short"
+ADJUST_SECONDS = 0.5
+"How often the rate adapts"
+SLOW_FACTOR = 2.0
+"A chunk that takes this many times longer than the fastest means the disk is busy"
+MIN_RATE = 1024**2
+INCREASE_RATE = 4 * 1024**2
+"Added to the rate each `ADJUST_SECONDS` while the disk is quiet"
+BASELINE_DECAY = 1.01
+"The fastest time per byte is forgotten slowly, in case the disk gets slower"
+
+# From <linux/ioprio.h>
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30}
+"""
+Syscall numbers of 64-bit platforms that have been checked. Other platforms are
+skipped, as the wrong number would call a different syscall.
+"""
+# From <winbase.h>
+PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+
+
+@dataclass
+class Throttle:
+    """
+    Limits the total rate of all threads that share it. Thread safe.
+
+    `max_rate` is in bytes per second, or unlimited if `None`. If `adaptive`, the
+    rate also backs off while the disk is busy.
+    """
+
+    max_rate: Optional[float] = None
+    adaptive: bool = False
+    rate: float = field(init=False)
+    _tokens: float = field(init=False)
+    _updated_at: float = field(init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _fastest: Optional[float] = field(default=None, init=False)
+    "Seconds per byte of the fastest recent chunk"
+    _slowest: float = field(default=0, init=False)
+    "Seconds per byte of the slowest chunk since the last adjustment"
+    _bytes: int = field(default=0, init=False)
+    _adjusted_at: float = field(init=False)
+
+    def __post_init__(self):
+        self.rate = self.max_rate or float("inf")
+        self._tokens = 0
+        self._updated_at = self._adjusted_at = time.monotonic()
+
+    def reserve(self, count: int) -> None:
+        """Wait until the rate allows `count` more bytes to be copied"""
+        with self._lock:
+            if self.rate == float("inf") or not count:
+                return
+            now = time.monotonic()
+            # Unused rate isn't saved up, so threads that start together can't
+            # copy a burst of chunks before the first wait
+            self._tokens = min(self._tokens + (now - self._updated_at) * self.rate, 0)
+            self._tokens -= count
+            self._updated_at = now
+            wait = -self._tokens / self.rate
+        time.sleep(wait)
+
+    def record(self, reserved: int, count: int, seconds: float) -> None:
+        """Record that `count` of `reserved` bytes were copied in `seconds`"""
+        with self._lock:
+            if self.rate != float("inf"):
+                # Refund bytes that weren't copied, or charge for extra bytes
+                self._tokens += reserved - count
+            if self.adaptive and count:
+                self._record(count, seconds, time.monotonic())
+
+    def _record(self, count: int, seconds: float, now: float) -> None:
+        per_byte = seconds / count
+        if self._fastest is None or per_byte < self._fastest:
+            self._fastest = per_byte
+        self._slowest = max(self._slowest, per_byte)
+        self._bytes += count
+        if now - self._adjusted_at < ADJUST_SECONDS:
+            return
+        recent_rate = self._bytes / (now - self._adjusted_at)
+        # Additive increase, multiplicative decrease, like TCP congestion control
+        if self._slowest > self._fastest * SLOW_FACTOR:
+            self.rate = max(min(self.rate, recent_rate) / 2, MIN_RATE)
+        elif self.rate != float("inf"):
+            self.rate += INCREASE_RATE
+            if self.max_rate is None and self.rate > recent_rate * 4:
+                # Far above what the disk does, so stop limiting
+                self.rate = float("inf")
+            elif self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+        self._fastest *= BASELINE_DECAY
+        self._slowest = 0
+        self._bytes = 0
+        self._adjusted_at = now
+
+
+def set_background_priority() -> bool:
+    """
+    Give this process, and threads that it starts later, low CPU and disk priority.
+    Return whether disk priority was lowered. Not all platforms and disk schedulers
+    support it.
+    """
+    # pylint: disable=import-outside-toplevel
+    import ctypes
+    import platform
+
+    if os.name == "nt":
+        kernel32 = ctypes.WinDLL("kernel32")  # type: ignore
+        return bool(
+            kernel32.SetPriorityClass(
+                kernel32.GetCurrentProcess(), PROCESS_MODE_BACKGROUND_BEGIN
+            )
+        )
+    os.nice(19 - os.nice(0))
+    # 32-bit Python on a 64-bit kernel has different syscall numbers
+    if (
+        sys.platform != "linux"
+        or platform.machine() not in SYS_IOPRIO_SET
+        or sys.maxsize <= 2**32
+    ):
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    # Applies to the calling thread, and threads it creates. It fails with -1 if
+    # the kernel doesn't support it.
+    result = libc.syscall(
+        SYS_IOPRIO_SET[platform.machine()],
+        IOPRIO_WHO_PROCESS,
+        0,
+        IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT,
+    )
+    return result == 0
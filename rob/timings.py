@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+import rob.console as con
+
+
+@dataclass
+class Span:
+    """Time taken by a phase of a command, e.g. a step of `FilestoreActions`"""
+
+    name: str
+    folder: str
+    "`Folder.short_name`, if the phase is for one folder"
+    start: float
+    "Seconds since timings were enabled"
+    seconds: float = 0
+    bytes_: int = 0
+    files: int = 0
+    thread: int = 0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_ / self.seconds if self.seconds else 0
+
+    def to_trace_event(self) -> dict:
+        """Chrome trace format, which can be opened in e.g. chrome://tracing or Perfetto"""
+        return {
+            "name": self.name,
+            "cat": self.folder or "rob",
+            "ph": "X",
+            "ts": round(self.start * 10**6),
+            "dur": round(self.seconds * 10**6),
+            "pid": os.getpid(),
+            "tid": self.thread,
+            "args": {
+                "folder": self.folder,
+                "bytes": self.bytes_,
+                "files": self.files,
+                "bytes_per_second": round(self.bytes_per_second),
+            },
+        }
+
+
+@dataclass
+class Timings:
+    origin: float
+    "`time.perf_counter()` when timings were enabled"
+    spans: list[Span]
+    lock: threading.Lock
+
+
+_timings: Optional[Timings] = None
+"Only set if timings are wanted, so that phases cost nothing otherwise"
+
+
+def enable() -> None:
+    global _timings  # pylint: disable=global-statement
+    if _timings is None:
+        _timings = Timings(time.perf_counter(), [], threading.Lock())
+
+
+@contextmanager
+def phase(
+    name: str, folder: str = "", bytes_: int = 0, files: int = 0
+) -> Iterator[Span]:
+    """
+    Time the code in this block, if timings are enabled
+
+    Yields the `Span`, so that `bytes_` and `files` can be set when they are known.
+    The span is recorded even if the block raises.
+    """
+    timings = _timings
+    start = time.perf_counter()
+    span = Span(
+        name=name,
+        folder=folder,
+        start=start - timings.origin if timings else 0,
+        bytes_=bytes_,
+        files=files,
+        thread=threading.get_ident(),
+    )
+    try:
+        yield span
+    finally:
+        if timings:
+            span.seconds = time.perf_counter() - start
+            with timings.lock:
+                timings.spans.append(span)
+
+
+def get_spans() -> list[Span]:
+    if _timings is None:
+        return []
+    with _timings.lock:
+        return sorted(_timings.spans, key=lambda span: span.start)
+
+
+def print_timings() -> None:
+    con.print_timings_table(get_spans())
+
+
+def write_trace(path: Path) -> None:
+    data = {"traceEvents": [span.to_trace_event() for span in get_spans()]}
+    with open(path, "w", encoding="utf8") as file:
+        json.dump(data, file)
+    con.print_(f"[grey50]Trace saved to {path}[/grey50]")
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from click import ClickException
+
+import rob.console as con
+from rob import PROJECT_NAME
+from rob.filesystem import delete_file, delete_folder
+from rob.folders import Library
+
+TRASH_DIR_NAME = f"_{PROJECT_NAME}_trash"
+
+
+def get_trash_dir(parent: Path) -> Path:
+    """
+    Trash in `parent`. Folders in `parent` are moved there by renaming them, which is
+    instant, as it is on the same filesystem.
+    """
+    return parent.joinpath(TRASH_DIR_NAME)
+
+
+def move_to_trash(path: Path, dry_run: bool = False) -> None:
+    """Move `path` to trash, to be deleted later by `empty_trash()`"""
+    # Archives of compressed folders are files
+    kind = "folder" if path.is_dir() else "file"
+    con.print_(f"Moving {kind} {con.style_path(path)} to trash", end="")
+    if path.is_symlink():
+        raise ClickException(f"\nCannot delete. {path} is a symlink.")
+    if dry_run:
+        con.print_skipped()
+        return
+    trash_dir = get_trash_dir(path.parent)
+    trash_dir.mkdir(exist_ok=True)
+    try:
+        path.rename(trash_dir.joinpath(f"{path.name}_{time.time_ns()}"))
+    except PermissionError:
+        # Not throwing exception, as this is a tidy up action. See `delete_folder()`.
+        con.print_fail()
+        con.print_(
+            f"[red]Unable to move {path} to trash, probably because an application is locking it open.[/red]"
+        )
+        con.print_(
+            f"[red]To tidy up, restart your PC and delete this {kind} manually.[/red]"
+        )
+        return
+    con.print_success()
+
+
+def get_trash_dirs(library: Library) -> list[Path]:
+    """Trash in the library and next to every folder that has been moved"""
+    parents = {library.library_folder} | {
+        source_dir.parent for source_dir in library.get_moved_source_dirs()
+    }
+    return sorted(
+        trash_dir for parent in parents if (trash_dir := get_trash_dir(parent)).is_dir()
+    )
+
+
+def empty_trash(library: Library, dry_run: bool = False) -> int:
+    """Delete folders in trash. Return the number of folders."""
+    count = 0
+    for trash_dir in get_trash_dirs(library):
+        for path in sorted(trash_dir.iterdir()):
+            # Archives of compressed folders are files
+            if path.is_file():
+                delete_file(path, dry_run=dry_run)
+            else:
+                delete_folder(path, dry_run=dry_run)
+            count += 1
+        if not dry_run and not any(trash_dir.iterdir()):
+            trash_dir.rmdir()
+    return count
+
+
+def start_background_gc(library_folder: Path) -> None:
+    """Run `rob gc` in a process that continues after this one ends"""
+    if getattr(sys, "frozen", False):
+        # Built by PyInstaller
+        args = [sys.executable]
+    else:
+        args = [sys.executable, "-m", PROJECT_NAME]
+    args += ["gc", "--library-folder", str(library_folder), "--wait"]
+    if sys.platform == "win32":
+        kwargs: dict = {
+            "creationflags": subprocess.DETACHED_PROCESS
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+        }
+    else:
+        kwargs = {"start_new_session": True}
+    # pylint: disable=consider-using-with
+    subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        **kwargs,
+    )
@@ -0,0 +1,407 @@
+"""
+Keep sizes and health of folders up to date while `rob watch` runs
+
+Changes are reported by inotify on Linux. Other platforms, or too many folders for
+the inotify limit, check every folder at an interval instead. Changes are collected
+until none have been seen for a while, so a game update that writes thousands of
+files causes one update. Only folders that changed are scanned again.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import rob.console as con
+from rob import PROJECT_NAME
+from rob.folders import Folder, Library
+from rob.index import SizeIndex
+from rob.locks import metadata_lock
+
+POLL_INTERVAL_SECONDS = 60
+"Used if inotify can't be"
+MAX_DELAY_SECONDS = 30
+"Update folders that change constantly at least this often"
+
+LIBRARY_KEY = ""
+"Key of watches on the library folder itself, which contains the folder list"
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+    | IN_EXCL_UNLINK
+)
+EVENT = struct.Struct("iIII")
+"wd, mask, cookie and length of name, followed by the name"
+
+
+@dataclass
+class Event:
+    key: str
+    "`Folder.short_name`, `LIBRARY_KEY`, or a source parent folder"
+    rel_dir: str
+    "Folder that changed, relative to the watched folder"
+    name: str = ""
+    moved_dir: bool = False
+    "Paths of watches in a subdir that was moved are out of date"
+
+
+@dataclass
+class Changes:
+    """Changes that haven't been handled yet"""
+
+    dirs: dict[str, set[str]] = field(default_factory=dict)
+    "Changed subdirs of each `Folder.short_name`"
+    rescan: set[str] = field(default_factory=set)
+    "Folders to scan in full"
+    folder_list: bool = False
+    health: bool = False
+    first_at: Optional[float] = None
+    last_at: Optional[float] = None
+
+    def add(self, events: list[Event], folders: dict[str, Folder]) -> None:
+        source_names = {folder.source_dir.name for folder in folders.values()}
+        for event in events:
+            if event.key == LIBRARY_KEY:
+                # Temporary folders of rob commands don't change the folder list
+                if not event.name.startswith(f"_{PROJECT_NAME}_"):
+                    self.folder_list = True
+            elif event.key not in folders:
+                # A parent of source folders, where symlinks are
+                self.health = (
+                    self.health or not event.name or event.name in source_names
+                )
+            elif event.moved_dir:
+                self.rescan.add(event.key)
+            else:
+                self.dirs.setdefault(event.key, set()).add(event.rel_dir)
+        if events:
+            now = time.monotonic()
+            self.first_at = self.first_at or now
+            self.last_at = now
+
+    def get_wait(self, debounce: float) -> Optional[float]:
+        """Seconds until changes should be handled, or `None` if there are none"""
+        if self.first_at is None or self.last_at is None:
+            return None
+        return max(
+            min(self.last_at + debounce, self.first_at + MAX_DELAY_SECONDS)
+            - time.monotonic(),
+            0,
+        )
+
+
+class Watcher(ABC):
+    @abstractmethod
+    def add(self, path: Path, key: str, recursive: bool) -> None:
+        """Report changes in `path`, and in its subdirs if `recursive`"""
+
+    @abstractmethod
+    def remove(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def read(self, timeout: Optional[float]) -> list[Event]:
+        """Wait up to `timeout` seconds for changes, or forever if `None`"""
+
+
+class InotifyWatcher(Watcher):
+    """Changes reported by Linux, with a watch for each folder"""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise _get_error()
+        self._watches: dict[int, tuple[str, str]] = {}
+        "`key` and relative path of each watch descriptor"
+        self._roots: dict[str, tuple[Path, bool]] = {}
+
+    def add(self, path: Path, key: str, recursive: bool) -> None:
+        self._roots[key] = (path, recursive)
+        self._add_dir(path, key, os.curdir, recursive)
+
+    def _add_dir(self, root: Path, key: str, rel_dir: str, recursive: bool) -> None:
+        path = os.path.normpath(os.path.join(root, rel_dir))
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = _get_error()
+            if error.errno in (errno.ENOENT, errno.ENOTDIR):
+                # Removed since it was found
+                return
+            raise error
+        self._watches[wd] = (key, rel_dir)
+        if recursive:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self._add_dir(
+                            root,
+                            key,
+                            os.path.normpath(os.path.join(rel_dir, entry.name)),
+                            recursive,
+                        )
+
+    def remove(self, key: str) -> None:
+        self._roots.pop(key, None)
+        for wd in [wd for wd, (wd_key, _) in self._watches.items() if wd_key == key]:
+            self._libc.inotify_rm_watch(self._fd, wd)
+            del self._watches[wd]
+
+    def read(self, timeout: Optional[float]) -> list[Event]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        data = b""
+        while True:
+            try:
+                data += os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so scan everything
+                events += [Event(key, os.curdir, moved_dir=True) for key in self._roots]
+                continue
+            if wd not in self._watches:
+                continue
+            key, rel_dir = self._watches[wd]
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            events.append(
+                Event(
+                    key,
+                    rel_dir,
+                    name,
+                    moved_dir=bool(mask & IN_ISDIR and mask & IN_MOVED_FROM),
+                )
+            )
+            root, recursive = self._roots[key]
+            if recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_dir(
+                    root, key, os.path.normpath(os.path.join(rel_dir, name)), True
+                )
+        return events
+
+
+class PollingWatcher(Watcher):
+    """Report every folder as changed, each `interval` seconds"""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._keys: set[str] = set()
+        self._next_at = time.monotonic() + interval
+
+    def add(self, path: Path, key: str, recursive: bool) -> None:
+        self._keys.add(key)
+
+    def remove(self, key: str) -> None:
+        self._keys.discard(key)
+
+    def read(self, timeout: Optional[float]) -> list[Event]:
+        wait = self._next_at - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next_at = time.monotonic() + self.interval
+        # Sizes are checked with `SizeIndex.get_stats()`, as it isn't known which
+        # subdirs changed
+        return [Event(key, os.curdir, moved_dir=True) for key in self._keys]
+
+
+def _get_error() -> OSError:
+    error = ctypes.get_errno()
+    return OSError(error, os.strerror(error))
+
+
+def get_watcher(poll_interval: Optional[float]) -> Watcher:
+    """inotify on Linux, or polling if `poll_interval` is given"""
+    if poll_interval is None and sys.platform == "linux":
+        try:
+            return InotifyWatcher()
+        except OSError as e:
+            con.print_(f"[yellow]Unable to use inotify: {e.strerror}[/yellow]")
+    return PollingWatcher(poll_interval or POLL_INTERVAL_SECONDS)
+
+
+@dataclass
+class LibraryWatch:
+    """Folders that are being watched, and their changes"""
+
+    library: Library
+    watcher: Watcher
+    debounce: float
+    index: SizeIndex = field(init=False)
+    folders: dict[str, Folder] = field(default_factory=dict)
+    "By `Folder.short_name`"
+    source_parents: set[Path] = field(default_factory=set)
+    changes: Changes = field(default_factory=Changes)
+
+    def __post_init__(self):
+        self.index = SizeIndex(self.library.connection, self.library.library_folder)
+
+    def run(self) -> None:
+        self.watcher.add(self.library.library_folder, LIBRARY_KEY, recursive=False)
+        self.sync_folders()
+        self.update(set(self.folders), {}, check_health=True)
+        con.print_("Watching for changes. Press Ctrl+C to stop.")
+        while True:
+            events = self.watcher.read(self.changes.get_wait(self.debounce))
+            self.changes.add(events, self.folders)
+            if self.changes.get_wait(self.debounce) == 0:
+                changes, self.changes = self.changes, Changes()
+                self.handle(changes)
+
+    def handle(self, changes: Changes) -> None:
+        rescan = set(changes.rescan)
+        if changes.folder_list:
+            rescan |= self.sync_folders()
+        # Watches in moved subdirs have the wrong paths
+        for short_name in changes.rescan & set(self.folders):
+            self.watcher.remove(short_name)
+            self._watch_folder(self.folders[short_name])
+        self.update(
+            rescan,
+            changes.dirs,
+            check_health=changes.health or changes.folder_list,
+        )
+
+    def sync_folders(self) -> set[str]:
+        """
+        Watch folders that have been added to the library, and stop watching those
+        that have been removed. Return names of folders that are new.
+        """
+        folders = {
+            folder.short_name: folder
+            for folder in self.library.folders
+            if not folder.is_compressed
+        }
+        for short_name in self.folders.keys() - folders.keys():
+            self.watcher.remove(short_name)
+        new = folders.keys() - self.folders.keys()
+        for short_name in new:
+            self._watch_folder(folders[short_name])
+        self.folders = folders
+        source_parents = {folder.source_dir.parent for folder in folders.values()}
+        for parent in self.source_parents - source_parents:
+            self.watcher.remove(str(parent))
+        for parent in source_parents - self.source_parents:
+            if parent.is_dir():
+                self.watcher.add(parent, str(parent), recursive=False)
+        self.source_parents = source_parents
+        if new:
+            # Another process has updated the index
+            self.index = SizeIndex(self.library.connection, self.library.library_folder)
+        return new
+
+    def _watch_folder(self, folder: Folder) -> None:
+        subdir = folder.get_library_subdir(self.library)
+        if subdir.is_dir():
+            self.watcher.add(subdir, folder.short_name, recursive=True)
+
+    def update(
+        self, rescan: set[str], dirs: dict[str, set[str]], check_health: bool
+    ) -> None:
+        """Scan folders that have changed, and save their sizes and health"""
+        stats = {}
+        for short_name in rescan | dirs.keys():
+            if (folder := self.folders.get(short_name)) is None:
+                continue
+            subdir = folder.get_library_subdir(self.library)
+            if short_name in rescan:
+                stats[short_name] = self.index.get_stats(short_name, subdir)
+            else:
+                stats[short_name] = self.index.update_dirs(
+                    short_name, subdir, dirs[short_name]
+                )
+        health = {}
+        if check_health:
+            health = {
+                short_name: folder.check_health(self.library)
+                for short_name, folder in self.folders.items()
+            }
+        if not stats and not health:
+            return
+        with metadata_lock(self.library.library_folder):
+            # Folders that are being moved by another process are updated by it
+            saved = {folder.short_name: folder for folder in self.library.folders}
+            for short_name, folder_stats in stats.items():
+                if short_name in saved:
+                    self.library.set_folder_stats(saved[short_name], folder_stats)
+            for short_name, folder_health in health.items():
+                if short_name not in saved:
+                    continue
+                old_health = saved[short_name].health
+                if old_health != folder_health:
+                    self.library.set_folder_health(saved[short_name], folder_health)
+                    # Folders start with no health
+                    if old_health or folder_health != "ok":
+                        self.print_health(saved[short_name])
+            self.index.save()
+            self.library.connection.commit()
+        for short_name, folder_stats in sorted(stats.items()):
+            con.print_(
+                f"[grey50]{datetime.now():%H:%M:%S}[/grey50] "
+                f"{con.style_path(short_name)} "
+                f"{con.style_bytes_as_gb(folder_stats.apparent_bytes)}, "
+                f"{folder_stats.files:,} files"
+            )
+
+    @staticmethod
+    def print_health(folder: Folder) -> None:
+        message = f"{datetime.now():%H:%M:%S} {folder.source_dir}: {folder.health}"
+        con.print_(message if folder.health == "ok" else f"[red]{message}[/red]")
+
+
+def watch(
+    library_folder: Path, debounce: float, poll_interval: Optional[float]
+) -> None:
+    """Watch `library_folder` and its folders until interrupted"""
+    watcher = get_watcher(poll_interval)
+    library_watch = LibraryWatch(Library(library_folder), watcher, debounce)
+    try:
+        library_watch.run()
+    except OSError as e:
+        if isinstance(watcher, PollingWatcher) or e.errno != errno.ENOSPC:
+            raise
+        con.print_(
+            "[yellow]Too many folders for inotify. Checking for changes every minute instead.[/yellow]"
+        )
+        LibraryWatch(
+            Library(library_folder), PollingWatcher(POLL_INTERVAL_SECONDS), debounce
+        ).run()
@@ -0,0 +1,152 @@
+import os
+import struct
+
+import pytest
+from click import ClickException
+
+import rob.archive
+from rob.archive import (
+    CHUNK_BYTES,
+    ENTRY,
+    KIND_DIR,
+    KIND_END,
+    KIND_FILE,
+    KIND_SYMLINK,
+    MAGIC,
+    compress_tree,
+    extract_archive,
+    read_manifest,
+)
+from rob.manifest import build_manifest, compare_hashes
+
+
+@pytest.fixture(name="source")
+def fixture_source(tmp_path):
+    source = tmp_path.joinpath("source")
+    source.joinpath("empty_dir").mkdir(parents=True)
+    source.joinpath("dir").mkdir()
+    source.joinpath("dir", "compressible").write_bytes(b"rob" * CHUNK_BYTES)
+    source.joinpath("empty").write_bytes(b"")
+    # Stored as it is, as random data doesn't compress
+    source.joinpath("random").write_bytes(os.urandom(CHUNK_BYTES + 1))
+    if hasattr(os, "symlink"):
+        os.symlink("random", source.joinpath("link"))
+    return source
+
+
+def test_round_trip(tmp_path, source):
+    archive_path = tmp_path.joinpath("source.robz")
+    progress = []
+    stats = compress_tree(source, archive_path, progress.append, threads=2)
+    manifest = build_manifest(source)
+    assert stats.files == manifest.stats.files
+    assert stats.bytes_ == sum(progress) == 4 * CHUNK_BYTES + 1
+    assert stats.compressed_bytes == archive_path.stat().st_size
+    assert not tmp_path.joinpath("source.robz.partial").exists()
+    assert read_manifest(archive_path).files == manifest.files
+
+    target = tmp_path.joinpath("target")
+    extract_archive(archive_path, target, lambda count: None, threads=2)
+    assert manifest.compare(build_manifest(target)) == []
+    assert compare_hashes(manifest, source, target) == []
+    if hasattr(os, "symlink"):
+        assert os.readlink(target.joinpath("link")) == "random"
+
+
+def corrupt(archive_path, offset):
+    with open(archive_path, "r+b") as file:
+        file.seek(offset, os.SEEK_END if offset < 0 else os.SEEK_SET)
+        byte = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+
+@pytest.mark.parametrize(
+    "name, data",
+    [("stored", os.urandom(1000)), ("compressed", b"rob" * 1000)],
+)
+def test_damaged_chunk(tmp_path, name, data):
+    source = tmp_path.joinpath("source")
+    source.mkdir()
+    source.joinpath(name).write_bytes(data)
+    archive_path = tmp_path.joinpath("source.robz")
+    compress_tree(source, archive_path, lambda count: None)
+    # The last byte before the end marker is data of the only file
+    corrupt(archive_path, -2)
+    with pytest.raises(ClickException, match="Archive is damaged"):
+        rob.archive.test_archive(archive_path)
+    target = tmp_path.joinpath("target")
+    with pytest.raises(ClickException, match="Archive is damaged"):
+        extract_archive(archive_path, target, lambda count: None)
+    # So that extraction can be tried again
+    assert not target.exists()
+
+
+@pytest.mark.parametrize("chunk_size", [0, 1001])
+def test_damaged_chunk_size(tmp_path, chunk_size):
+    source = tmp_path.joinpath("source")
+    source.mkdir()
+    source.joinpath("file").write_bytes(b"rob" * 333 + b"!")
+    archive_path = tmp_path.joinpath("source.robz")
+    compress_tree(source, archive_path, lambda count: None)
+    # The size of the first chunk follows its codec
+    with open(archive_path, "r+b") as file:
+        file.seek(len(MAGIC) + ENTRY.size + len("file") + 1)
+        file.write(struct.pack("<I", chunk_size))
+    with pytest.raises(ClickException, match="Archive is damaged"):
+        read_manifest(archive_path)
+    with pytest.raises(ClickException, match="Archive is damaged"):
+        rob.archive.test_archive(archive_path)
+    with pytest.raises(ClickException, match="Archive is damaged"):
+        extract_archive(archive_path, tmp_path.joinpath("target"), lambda count: None)
+
+
+def write_archive(archive_path, entries):
+    """Write an archive of `entries` of kind, path and data, without chunks"""
+    with open(archive_path, "wb") as file:
+        file.write(MAGIC)
+        for kind, path, data in entries:
+            file.write(ENTRY.pack(kind, 0o644, 0, len(data), len(path)) + path + data)
+        file.write(KIND_END)
+
+
+@pytest.mark.parametrize(
+    "entries",
+    [
+        [(KIND_FILE, b"../outside", b"")],
+        [(KIND_FILE, b"/outside", b"")],
+        [(KIND_DIR, b"dir", b""), (KIND_FILE, b"dir/../../outside", b"")],
+        [(KIND_FILE, b"missing_dir/file", b"")],
+        [(KIND_SYMLINK, b"link", b".."), (KIND_FILE, b"link/outside", b"")],
+    ],
+)
+def test_paths_outside_target(tmp_path, entries):
+    archive_path = tmp_path.joinpath("source.robz")
+    write_archive(archive_path, entries)
+    target = tmp_path.joinpath("target")
+    with pytest.raises(ClickException, match="is invalid"):
+        extract_archive(archive_path, target, lambda count: None)
+    assert not target.exists()
+    assert not tmp_path.joinpath("outside").exists()
+
+
+def test_incomplete_archive(tmp_path, source):
+    archive_path = tmp_path.joinpath("source.robz")
+    compress_tree(source, archive_path, lambda count: None)
+    with open(archive_path, "r+b") as file:
+        file.truncate(archive_path.stat().st_size // 2)
+    with pytest.raises(ClickException, match="incomplete"):
+        read_manifest(archive_path)
+
+
+def test_failed_compression_leaves_no_partial_file(tmp_path, source, monkeypatch):
+    def walk(path):
+        yield from []
+        raise PermissionError(13, "Permission denied", str(path))
+
+    monkeypatch.setattr(rob.archive, "_walk", walk)
+    archive_path = tmp_path.joinpath("source.robz")
+    with pytest.raises(PermissionError):
+        compress_tree(source, archive_path, lambda count: None)
+    assert not archive_path.exists()
+    assert not tmp_path.joinpath("source.robz.partial").exists()
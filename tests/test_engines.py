@@ -0,0 +1,94 @@
+import os
+
+import pytest
+from click import ClickException
+
+import rob.engines
+from rob.engines import NativeEngine, get_copy_engine
+from rob.manifest import build_manifest, compare_hashes
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "symlink") or os.name == "nt",
+    reason="Creating symlinks needs privileges on Windows",
+)
+
+
+def copy_tree(engine: NativeEngine, source, target, incremental=False) -> int:
+    progress = []
+    engine.copy_tree(source, target, False, progress.append, incremental)
+    return sum(progress)
+
+
+@pytest.fixture(name="source")
+def fixture_source(tmp_path):
+    source = tmp_path.joinpath("source")
+    source.joinpath("dir").mkdir(parents=True)
+    source.joinpath("dir", "small").write_bytes(b"small")
+    source.joinpath("large").write_bytes(os.urandom(3 * 1024**2 + 1))
+    os.symlink("large", source.joinpath("link"))
+    return source
+
+
+@pytest.mark.parametrize("max_rate", [None, 1024**3])
+def test_copy_tree(tmp_path, source, max_rate):
+    target = tmp_path.joinpath("target")
+    engine = get_copy_engine("native", threads=2, max_rate=max_rate)
+    assert copy_tree(engine, source, target) == 3 * 1024**2 + 1 + len(b"small")
+    manifest = build_manifest(source)
+    assert manifest.compare(build_manifest(target)) == []
+    assert compare_hashes(manifest, source, target) == []
+    assert os.readlink(target.joinpath("link")) == "large"
+
+
+def test_incremental_copy_replaces_mismatched_entries(tmp_path, source):
+    target = tmp_path.joinpath("target")
+    elsewhere = tmp_path.joinpath("elsewhere")
+    elsewhere.mkdir()
+    engine = NativeEngine(threads=2, auto_tune=False)
+    copy_tree(engine, source, target)
+
+    # A stale symlink, a file where the source has a symlink, and symlinks where
+    # the source has a dir and a file
+    target.joinpath("link").unlink()
+    os.symlink("old", target.joinpath("link"))
+    os.symlink("large", target.joinpath("new_link"))
+    os.symlink("dir", source.joinpath("new_link"))
+    target.joinpath("new_link").unlink()
+    target.joinpath("new_link").write_bytes(b"file")
+    os.rename(target.joinpath("dir"), elsewhere.joinpath("dir"))
+    os.symlink(elsewhere.joinpath("dir"), target.joinpath("dir"))
+    target.joinpath("large").unlink()
+    os.symlink(elsewhere.joinpath("large"), target.joinpath("large"))
+
+    copy_tree(engine, source, target, incremental=True)
+    assert os.readlink(target.joinpath("link")) == "large"
+    assert os.readlink(target.joinpath("new_link")) == "dir"
+    assert not target.joinpath("dir").is_symlink()
+    assert not target.joinpath("large").is_symlink()
+    assert not elsewhere.joinpath("large").exists()
+    assert build_manifest(source).compare(build_manifest(target)) == []
+
+
+def test_incremental_copy_skips_same_files(tmp_path, source):
+    target = tmp_path.joinpath("target")
+    engine = NativeEngine(threads=2, auto_tune=False)
+    copy_tree(engine, source, target)
+    link_stat = target.joinpath("link").lstat()
+    stats = engine.copy_tree(source, target, False, lambda count: None, True)
+    assert stats.files_copied == 0
+    # The symlink wasn't replaced
+    assert target.joinpath("link").lstat().st_ino == link_stat.st_ino
+
+
+def test_failed_dir_metadata_is_an_error(tmp_path, source, monkeypatch):
+    copystat = rob.engines.shutil.copystat
+
+    def copystat_files(src, dst, **kwargs):
+        if os.path.isdir(src):
+            raise PermissionError(1, "Operation not permitted", str(dst))
+        copystat(src, dst, **kwargs)
+
+    monkeypatch.setattr(rob.engines.shutil, "copystat", copystat_files)
+    engine = NativeEngine(threads=2, auto_tune=False)
+    with pytest.raises(ClickException, match="Operation not permitted"):
+        copy_tree(engine, source, tmp_path.joinpath("target"))
@@ -0,0 +1,92 @@
+import json
+import os
+from dataclasses import asdict
+
+import pytest
+
+import rob.store
+from rob.filesystem import DirStats
+from rob.index import SizeIndex
+
+
+@pytest.fixture(name="connection")
+def fixture_connection(tmp_path):
+    connection = rob.store.connect(tmp_path.joinpath("rob-library.db"))
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(name="folder")
+def fixture_folder(tmp_path):
+    folder = tmp_path.joinpath("Game")
+    folder.joinpath("a", "b").mkdir(parents=True)
+    folder.joinpath("top").write_bytes(b"1234")
+    folder.joinpath("a", "b", "deep").write_bytes(b"56")
+    return folder
+
+
+def test_stats_are_saved(tmp_path, connection, folder):
+    index = SizeIndex(connection, tmp_path)
+    stats = index.get_stats("Game", folder)
+    assert (stats.files, stats.dirs, stats.apparent_bytes) == (2, 2, 6)
+    index.save()
+    connection.commit()
+
+    index = SizeIndex(connection, tmp_path)
+    assert index.folders["Game"].keys() == {".", "a", os.path.join("a", "b")}
+    assert index.get_stats("Game", folder) == stats
+    assert not index.changed
+
+
+def test_changed_folders_are_scanned(tmp_path, connection, folder):
+    index = SizeIndex(connection, tmp_path)
+    index.get_stats("Game", folder)
+    index.save()
+    folder.joinpath("a", "new").write_bytes(b"789")
+    stats = index.get_stats("Game", folder)
+    assert (stats.files, stats.apparent_bytes) == (3, 9)
+    assert index.changed == {"Game"}
+
+
+def test_update_dirs(tmp_path, connection, folder):
+    index = SizeIndex(connection, tmp_path)
+    index.get_stats("Game", folder)
+    # A file that grows in place doesn't change the mtime of its folder
+    folder.joinpath("a", "b", "deep").write_bytes(b"5678")
+    folder.joinpath("a", "c").mkdir()
+    folder.joinpath("a", "c", "new").write_bytes(b"9")
+    stats = index.update_dirs("Game", folder, {os.path.join("a", "b"), "a"})
+    assert (stats.files, stats.dirs, stats.apparent_bytes) == (3, 3, 9)
+
+
+def test_remove(tmp_path, connection, folder):
+    index = SizeIndex(connection, tmp_path)
+    index.get_stats("Game", folder)
+    index.save()
+    index.remove("Game")
+    index.save()
+    assert connection.execute("SELECT * FROM dir_records").fetchall() == []
+
+
+def test_json_index_is_moved_to_database(tmp_path, connection, folder):
+    index_path = tmp_path.joinpath(SizeIndex.index_filename)
+    stats = DirStats(files=1, apparent_bytes=4, allocated_bytes=4096)
+    mtime_ns = folder.stat().st_mtime_ns
+    index_path.write_text(
+        json.dumps({"Old": {".": [mtime_ns, asdict(stats), []]}}), encoding="utf8"
+    )
+    index = SizeIndex(connection, tmp_path)
+    assert not index_path.exists()
+    index.save()
+    assert SizeIndex(connection, tmp_path).folders["Old"]["."].stats == stats
+    rows = connection.execute("SELECT * FROM dir_records").fetchall()
+    assert [(row["short_name"], row["rel_path"], row["files"]) for row in rows] == [
+        ("Old", ".", 1)
+    ]
+
+
+def test_damaged_json_index_is_ignored(tmp_path, connection):
+    index_path = tmp_path.joinpath(SizeIndex.index_filename)
+    index_path.write_text("{", encoding="utf8")
+    assert SizeIndex(connection, tmp_path).folders == {}
+    assert not index_path.exists()
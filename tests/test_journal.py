@@ -0,0 +1,92 @@
+from dataclasses import dataclass, field
+from typing import ClassVar
+
+import pytest
+
+from rob.actions import FilestoreActions
+from rob.engines import NativeEngine
+from rob.folders import Folder, Library
+from rob.journal import Journal, find_journal, get_journals, load_journal
+from rob.manifest import Manifest, ManifestEntry
+
+STEPS = ["copy", "verify", "symlink", "delete"]
+
+
+@dataclass
+class StepActions(FilestoreActions):
+    """Records which steps are run, and fails at step `fail_at`"""
+
+    operation: ClassVar = "add"
+    fail_at: str = ""
+    ran: list[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.from_dir = self.folder.source_dir
+        self.to_dir = self.folder.get_library_subdir(self.library)
+        self.manifest = Manifest(files={"a": ManifestEntry(size=1, mtime_ns=2)})
+        super().__post_init__()
+
+    def get_steps(self):
+        return [(name, lambda name=name: self.run_step(name)) for name in STEPS]
+
+    def run_step(self, name: str) -> None:
+        if name == self.fail_at:
+            raise KeyboardInterrupt
+        self.ran.append(name)
+
+
+def make_actions(library: Library, folder: Folder, **kwargs) -> StepActions:
+    return StepActions(
+        folder=folder,
+        library=library,
+        dry_run=False,
+        dont_copy_permissions=True,
+        copy_engine=NativeEngine(auto_tune=False),
+        **kwargs,
+    )
+
+
+@pytest.fixture(name="library")
+def fixture_library(tmp_path):
+    library_folder = tmp_path.joinpath("library")
+    library_folder.mkdir()
+    return Library(library_folder)
+
+
+def test_resume_skips_completed_steps(tmp_path, library):
+    folder = Folder(tmp_path.joinpath("Game"))
+    actions = make_actions(library, folder, fail_at="symlink")
+    with pytest.raises(KeyboardInterrupt):
+        actions.actions()
+    assert actions.ran == ["copy", "verify"]
+
+    journal = find_journal(library, folder)
+    assert journal is not None
+    assert journal.operation == "add"
+    assert journal.steps_done == ["copy", "verify"]
+    assert journal.manifest == actions.manifest
+    assert journal.options == actions.get_options()
+
+    resumed = make_actions(library, journal.folder, journal=journal)
+    resumed.actions()
+    assert resumed.ran == ["symlink", "delete"]
+    assert load_journal(library, journal.path).steps_done == STEPS
+    resumed.complete()
+    assert get_journals(library) == []
+    assert not journal.path.parent.exists()
+
+
+def test_journals_are_kept_for_each_folder(tmp_path, library):
+    for name in ("a", "b"):
+        Journal(
+            library=library,
+            operation="remove",
+            folder=Folder(tmp_path.joinpath(name), state="warm"),
+            manifest=Manifest(),
+            steps_done=["copy"],
+        ).save()
+    journals = get_journals(library)
+    assert [journal.folder.source_dir.name for journal in journals] == ["a", "b"]
+    assert all(journal.folder.is_warm for journal in journals)
+    journals[0].delete()
+    assert len(get_journals(library)) == 1
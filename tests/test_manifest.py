@@ -0,0 +1,111 @@
+import os
+
+from rob.filesystem import DirStats
+from rob.manifest import (
+    MTIME_TOLERANCE_NS,
+    Manifest,
+    ManifestEntry,
+    build_manifest,
+    compare_hashes,
+    get_changes,
+)
+
+
+def make_manifest(files: dict, dirs: set = frozenset()) -> Manifest:
+    return Manifest(
+        files={rel_path: ManifestEntry(*values) for rel_path, values in files.items()},
+        dirs=set(dirs),
+    )
+
+
+def test_compare_same():
+    manifest = make_manifest({"a": (1, 0), os.path.join("d", "b"): (2, 0)}, {"d"})
+    assert manifest.compare(manifest) == []
+
+
+def test_compare_differences():
+    expected = make_manifest(
+        {"missing": (1, 0), "size": (2, 0), "mtime": (3, 0)}, {"missing_dir"}
+    )
+    actual = make_manifest(
+        {"size": (4, 0), "mtime": (3, MTIME_TOLERANCE_NS + 1), "unexpected": (5, 0)},
+        {"unexpected_dir"},
+    )
+    assert expected.compare(actual) == [
+        "Missing folder missing_dir",
+        "Unexpected folder unexpected_dir",
+        "Unexpected file unexpected",
+        "Missing file missing",
+        "Modified time of mtime does not match",
+        "Size of size is 4 bytes, expected 2",
+    ]
+
+
+def test_compare_tolerates_mtime_of_symlinks_and_fat():
+    expected = make_manifest({"file": (1, 0), "link": (2, 0, True)})
+    actual = make_manifest({"file": (1, MTIME_TOLERANCE_NS), "link": (2, 10**12, True)})
+    assert expected.compare(actual) == []
+
+
+def test_get_changes():
+    source = make_manifest(
+        {
+            "same": (1, 0),
+            "modified": (2, 1),
+            "new": (3, 0),
+            "now_link": (4, 0, True),
+            "link": (5, 1, True),
+            # Copies of symlinks are made when they are copied
+            "same_link": (7, 1, True),
+        },
+        {"dir"},
+    )
+    copy = make_manifest(
+        {
+            "same": (1, 0),
+            "modified": (2, 0),
+            "deleted": (6, 0),
+            "now_link": (4, 0),
+            "link": (8, 0, True),
+            "same_link": (7, 2, True),
+        },
+        {"dir", "deleted_dir"},
+    )
+    changes = get_changes(source, copy)
+    assert changes.changed_files == ["link", "modified", "new", "now_link"]
+    assert changes.copy_bytes == 2 + 3 + 4 + 5
+    # Symlinks are replaced, not updated
+    assert changes.deleted_files == ["deleted", "link", "now_link"]
+    assert changes.deleted_dirs == ["deleted_dir"]
+    assert not get_changes(source, source)
+
+
+def test_build_manifest(tmp_path):
+    tmp_path.joinpath("d").mkdir()
+    tmp_path.joinpath("d", "a").write_bytes(b"abc")
+    tmp_path.joinpath("b").write_bytes(b"")
+    manifest = build_manifest(tmp_path)
+    assert manifest.dirs == {"d"}
+    assert {rel_path: entry.size for rel_path, entry in manifest.files.items()} == {
+        os.path.join("d", "a"): 3,
+        "b": 0,
+    }
+    assert manifest.stats.files == 2
+    assert manifest.stats.dirs == 1
+    assert manifest.stats.apparent_bytes == 3
+    assert build_manifest(tmp_path.joinpath("missing")) == Manifest(stats=DirStats())
+
+
+def test_compare_hashes(tmp_path):
+    source, target = tmp_path.joinpath("source"), tmp_path.joinpath("target")
+    for path in (source, target):
+        path.mkdir()
+        for index in range(20):
+            path.joinpath(str(index)).write_text(str(index))
+    manifest = build_manifest(source)
+    assert compare_hashes(manifest, source, target) == []
+    for name in ("7", "13", "19"):
+        target.joinpath(name).write_text("x")
+    assert sorted(compare_hashes(manifest, source, target)) == [
+        f"Content of {name} does not match" for name in ("13", "19", "7")
+    ]
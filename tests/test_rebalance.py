@@ -0,0 +1,67 @@
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from rob.filesystem import DirStats
+from rob.folders import Folder
+from rob.rebalance import KNAPSACK_UNITS, Candidate, choose_folders
+
+
+def make_candidates(sizes: list[int]) -> list[Candidate]:
+    """Candidates that were accessed in the order of `sizes`"""
+    start = datetime(2022, 1, 1)
+    return [
+        Candidate(
+            folder=Folder(Path(f"/games/{index}")),
+            stats=DirStats(allocated_bytes=size, apparent_bytes=size),
+            last_access=start + timedelta(days=index),
+        )
+        for index, size in enumerate(sizes)
+    ]
+
+
+def total(candidates: list[Candidate]) -> int:
+    return sum(candidate.size_bytes for candidate in candidates)
+
+
+def test_smallest_total_that_reaches_goal():
+    candidates = make_candidates([50, 30, 20, 10])
+    assert total(choose_folders(candidates, 25)) == 30
+    assert total(choose_folders(candidates, 35)) == 40
+    assert total(choose_folders(candidates, 110)) == 110
+
+
+def test_nothing_needed():
+    assert choose_folders(make_candidates([10]), 0) == []
+
+
+def test_goal_out_of_reach():
+    candidates = make_candidates([10, 20])
+    assert choose_folders(candidates, 31) == candidates
+
+
+def test_least_recently_used_is_preferred():
+    candidates = make_candidates([10, 10, 10])
+    assert choose_folders(candidates, 10) == candidates[:1]
+    candidates[0].last_access = None
+    assert choose_folders(candidates, 20) == candidates[:2]
+
+
+def test_rounding_never_falls_short():
+    # Sizes just below a multiple of the unit lose most of a unit when rounded down
+    unit = 1024**2
+    sizes = [2 * unit - 1] * (KNAPSACK_UNITS // 2) + [3 * unit - 1] * 100
+    candidates = make_candidates(sizes)
+    for need_bytes in (unit, 5 * unit, 5 * unit + 1, total(candidates) // 3):
+        chosen = choose_folders(candidates, need_bytes)
+        assert total(chosen) >= need_bytes
+
+
+def test_random_sizes_reach_goal():
+    generator = random.Random(1)
+    for _ in range(20):
+        sizes = [generator.randrange(1, 100 * 1024**3) for _ in range(40)]
+        need_bytes = generator.randrange(1, sum(sizes))
+        chosen = choose_folders(make_candidates(sizes), need_bytes)
+        assert total(chosen) >= need_bytes
+        assert len({candidate.folder.source_dir for candidate in chosen}) == len(chosen)
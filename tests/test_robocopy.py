@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+import pytest
+from click import ClickException
+
+from rob.robocopy import RobocopyCounts, RobocopyParser, parse_robocopy_output
+
+DIVIDER = "-" * 79
+
+OUTPUT = f"""
+{DIVIDER}
+   ROBOCOPY     ::     Robust File Copy for Windows
+{DIVIDER}
+
+  Started : Monday, 31 January 2022 12:00:00
+   Source : C:\\Games\\
+     Dest : D:\\Library\\Games(6079d94ba840)\\
+
+    Files : *.*
+
+  Options : *.* /S /E /DCOPY:DA /COPY:DAT /MT:8 /R:0 /W:0
+
+{DIVIDER}
+
+\t                   3\tC:\\Games\\
+\t    New File  \t\t    1048576\tC:\\Games\\data.pak
+\t   *EXTRA File \t\t 123\told.log
+\t  *EXTRA Dir        -1\tD:\\Library\\Games(6079d94ba840)\\mods\\
+\t  New Dir          1\tC:\\Games\\saves\\
+\t    New File  \t\t       2048\tC:\\Games\\saves\\1.sav
+2022/01/31 12:00:01 ERROR 5 (0x00000005) Copying File C:\\Games\\locked.dat
+Access is denied.
+
+\t    Newer     \t\t        512\tC:\\Games\\config.ini
+
+{DIVIDER}
+
+               Total    Copied   Skipped  Mismatch    FAILED    Extras
+    Dirs :         2         1         1         0         0         1
+   Files :         4         3         0         0         1         1
+   Bytes :   1051136   1051136         0         0         0       123
+   Times :   0:00:01   0:00:01                       0:00:00   0:00:00
+
+   Speed :             1051136 Bytes/sec.
+   Ended : Monday, 31 January 2022 12:00:01
+"""
+
+
+def test_parse_output():
+    results = parse_robocopy_output(OUTPUT)
+    assert results.options == [
+        "  Started : Monday, 31 January 2022 12:00:00",
+        "   Source : C:\\Games\\",
+        "     Dest : D:\\Library\\Games(6079d94ba840)\\",
+        "    Files : *.*",
+        "  Options : *.* /S /E /DCOPY:DA /COPY:DAT /MT:8 /R:0 /W:0",
+    ]
+    assert results.errors == [
+        "2022/01/31 12:00:01 ERROR 5 (0x00000005) Copying File C:\\Games\\locked.dat "
+        "Access is denied."
+    ]
+    assert results.dirs == RobocopyCounts(2, 1, 1, 0, 0, 1)
+    assert results.files == RobocopyCounts(4, 3, 0, 0, 1, 1)
+    assert results.bytes_ == RobocopyCounts(1051136, 1051136, 0, 0, 0, 123)
+    assert results.times is not None
+    assert results.times.total == timedelta(seconds=1)
+    assert results.bytes_per_second == 1051136
+
+
+def test_progress_counts_copied_files_only():
+    copied = []
+    parser = RobocopyParser(progress=copied.append, raise_errors=False)
+    for line in OUTPUT.split("\n"):
+        parser.feed(line)
+    parser.close()
+    assert copied == [1048576, 2048, 512]
+
+
+def test_progress_counts_files_when_they_are_done():
+    copied = []
+    parser = RobocopyParser(progress=copied.append)
+    for line in [DIVIDER] * 3 + [
+        "\t    New File  \t\t 4294967296\tC:\\Games\\data1.pak",
+    ]:
+        parser.feed(line)
+    # Listed when robocopy starts to copy it
+    assert copied == []
+    parser.feed("\t    New File  \t\t 4294967296\tC:\\Games\\data2.pak")
+    assert copied == [4294967296]
+    parser.feed(DIVIDER)
+    assert copied == [4294967296, 4294967296]
+
+
+def test_extras_are_not_errors():
+    parser = RobocopyParser()
+    for line in [DIVIDER] * 3 + [
+        "\t   *EXTRA File \t\t 123\told.log",
+        "\t  *EXTRA Dir        -1\tD:\\Library\\Games(6079d94ba840)\\mods\\",
+        "\t  New Dir          1\tC:\\Games\\saves\\",
+        "Waiting 30 seconds... Retrying...",
+    ]:
+        parser.feed(line)
+    assert not parser.close().errors
+
+
+def test_raise_errors():
+    parser = RobocopyParser()
+    with pytest.raises(ClickException, match="Access is denied"):
+        for line in OUTPUT.split("\n"):
+            parser.feed(line)
+
+
+def test_error_without_description():
+    parser = RobocopyParser(raise_errors=False)
+    for line in [DIVIDER] * 3 + [
+        "2022/01/31 12:00:01 ERROR 2 (0x00000002) Accessing Source Directory C:\\a\\",
+        "2022/01/31 12:00:02 ERROR 3 (0x00000003) Accessing Source Directory C:\\b\\",
+        "The system cannot find the path specified.",
+    ]:
+        parser.feed(line)
+    assert parser.close().errors == [
+        "2022/01/31 12:00:01 ERROR 2 (0x00000002) Accessing Source Directory C:\\a\\",
+        "2022/01/31 12:00:02 ERROR 3 (0x00000003) Accessing Source Directory C:\\b\\ "
+        "The system cannot find the path specified.",
+    ]
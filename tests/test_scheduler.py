@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+from click import ClickException
+
+import rob.scheduler
+from rob.scheduler import SOLID_STATE_JOBS, Job, run_jobs
+
+
+@pytest.fixture(autouse=True)
+def fake_disks(monkeypatch):
+    """Disks named `hdd...` are spinning disks"""
+    monkeypatch.setattr(
+        rob.scheduler, "is_rotational", lambda disk: disk.startswith("hdd")
+    )
+
+
+class DiskUse:
+    """Counts jobs that use each disk at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running: Counter = Counter()
+        self.most: Counter = Counter()
+        self.order: list[str] = []
+
+    def job(self, name: str, disks: set[str], seconds: float = 0.02, error=None):
+        def run():
+            with self.lock:
+                self.order.append(name)
+                self.running.update(disks)
+                for disk in disks:
+                    self.most[disk] = max(self.most[disk], self.running[disk])
+            time.sleep(seconds)
+            with self.lock:
+                self.running.subtract(disks)
+            if error:
+                raise error
+
+        return Job(name, disks, run)
+
+
+def test_spinning_disk_runs_one_job_at_a_time():
+    use = DiskUse()
+    jobs = [use.job(str(index), {"hdd1", "ssd1"}) for index in range(4)]
+    assert run_jobs(jobs) == []
+    assert use.most["hdd1"] == 1
+    assert use.order == ["0", "1", "2", "3"]
+
+
+def test_solid_state_disk_runs_jobs_at_once():
+    use = DiskUse()
+    jobs = [use.job(str(index), {"ssd1", "ssd2"}, 0.1) for index in range(8)]
+    run_jobs(jobs)
+    assert use.most["ssd1"] == SOLID_STATE_JOBS
+
+
+def test_jobs_on_different_disks_run_at_once():
+    use = DiskUse()
+    jobs = [
+        use.job("a", {"hdd1", "ssd1"}, 0.1),
+        use.job("b", {"hdd1", "ssd1"}, 0.1),
+        use.job("c", {"hdd2", "ssd1"}, 0.1),
+    ]
+    run_jobs(jobs)
+    assert use.most == {"hdd1": 1, "hdd2": 1, "ssd1": 2}
+    # "c" doesn't wait for "b", which waits for "a"
+    assert set(use.order[:2]) == {"a", "c"}
+    assert use.order[2] == "b"
+
+
+def test_slots_are_freed_by_failed_jobs():
+    use = DiskUse()
+    jobs = [
+        use.job("click", {"hdd1"}, error=ClickException("Copy failed")),
+        use.job("os", {"hdd1"}, error=OSError(5, "Input/output error")),
+        use.job("ok", {"hdd1"}),
+    ]
+    failed = run_jobs(jobs)
+    assert failed == jobs[:2]
+    assert isinstance(jobs[1].error, OSError)
+    assert jobs[2].error is None
+    assert use.order == ["click", "os", "ok"]
+
+
+def test_no_jobs():
+    assert run_jobs([]) == []
@@ -0,0 +1,145 @@
+import ctypes
+import os
+import platform
+import sys
+
+import pytest
+
+import rob.throttle
+from rob.throttle import (
+    MIN_RATE,
+    SYS_IOPRIO_SET,
+    THROTTLE_CHUNK_BYTES,
+    Throttle,
+    set_background_priority,
+)
+
+MB = 1024**2
+
+
+class FakeTime:
+    """Replaces the `time` module, so that sleeping is instant"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        assert seconds >= 0
+        self.now += seconds
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(rob.throttle, "time", clock)
+    return clock
+
+
+def copy(throttle: Throttle, clock: FakeTime, count: int, seconds: float = 0) -> None:
+    throttle.reserve(count)
+    clock.sleep(seconds)
+    throttle.record(count, count, seconds)
+
+
+def test_unlimited(clock):
+    throttle = Throttle()
+    for _ in range(100):
+        copy(throttle, clock, THROTTLE_CHUNK_BYTES)
+    assert clock.now == 1000.0
+
+
+def test_first_chunks_wait(clock):
+    # Threads that start together can't copy a burst of chunks
+    throttle = Throttle(max_rate=1 * MB)
+    start = clock.now
+    for _ in range(8):
+        throttle.reserve(THROTTLE_CHUNK_BYTES)
+    assert clock.now - start == pytest.approx(8 * THROTTLE_CHUNK_BYTES / MB)
+
+
+def test_rate_is_limited(clock):
+    throttle = Throttle(max_rate=20 * MB)
+    start = clock.now
+    for _ in range(100):
+        copy(throttle, clock, THROTTLE_CHUNK_BYTES, seconds=0.001)
+    assert 100 * THROTTLE_CHUNK_BYTES / (clock.now - start) <= 20 * MB
+
+
+def test_idle_time_is_not_saved_up(clock):
+    throttle = Throttle(max_rate=1 * MB)
+    clock.sleep(60)
+    start = clock.now
+    copy(throttle, clock, MB)
+    assert clock.now - start == pytest.approx(1)
+
+
+def test_unused_reservation_is_refunded(clock, monkeypatch):
+    # Threads that wait at the same time, so the clock doesn't move
+    waits = []
+    monkeypatch.setattr(clock, "sleep", waits.append)
+    throttle = Throttle(max_rate=1 * MB)
+    throttle.reserve(MB)
+    throttle.record(MB, MB // 2, 0)
+    throttle.reserve(MB)
+    # Nothing to wait for at the end of a file
+    throttle.reserve(0)
+    assert waits == pytest.approx([1, 1.5])
+
+
+def test_background_backs_off_when_disk_is_busy(clock):
+    throttle = Throttle(adaptive=True)
+    # Fast chunks set the baseline, and the rate isn't limited
+    for _ in range(10):
+        copy(throttle, clock, MB, seconds=0.01)
+    assert throttle.rate == float("inf")
+    # Much slower chunks mean another program is using the disk
+    for _ in range(10):
+        copy(throttle, clock, MB, seconds=0.1)
+    busy_rate = throttle.rate
+    assert MIN_RATE <= busy_rate < 10 * MB
+    # The rate grows again while the disk is quiet
+    for _ in range(100):
+        copy(throttle, clock, MB, seconds=0.01)
+    assert throttle.rate > busy_rate
+
+
+def test_background_respects_max_rate(clock):
+    throttle = Throttle(max_rate=5 * MB, adaptive=True)
+    for _ in range(200):
+        copy(throttle, clock, MB, seconds=0.01)
+    assert throttle.rate == 5 * MB
+
+
+@pytest.fixture(name="syscalls")
+def fixture_syscalls(monkeypatch):
+    """Record syscalls instead of making them, and don't lower test priority"""
+    calls = []
+
+    class FakeLibc:
+        @staticmethod
+        def syscall(*args):
+            calls.append(args)
+            return -1
+
+    monkeypatch.setattr(os, "nice", lambda increment: 0, raising=False)
+    monkeypatch.setattr(sys, "platform", "linux")
+    monkeypatch.setattr(ctypes, "CDLL", lambda *args, **kwargs: FakeLibc)
+    return calls
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses the Windows API instead")
+def test_unknown_platforms_skip_disk_priority(syscalls, monkeypatch):
+    monkeypatch.setattr(platform, "machine", lambda: "mips")
+    assert not set_background_priority()
+    assert syscalls == []
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses the Windows API instead")
+def test_failed_disk_priority_is_unsupported(syscalls, monkeypatch):
+    monkeypatch.setattr(platform, "machine", lambda: "x86_64")
+    monkeypatch.setattr(sys, "maxsize", 2**63 - 1)
+    assert not set_background_priority()
+    assert syscalls[0][0] == SYS_IOPRIO_SET["x86_64"]